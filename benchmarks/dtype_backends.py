@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the dtype backends of the makers on the string-heavy steps and on
+the joins of create_all_data.
+
+Each step is timed on the same raw data read with every backend in
+makers.DTYPE_BACKENDS. The string steps can be run on the raw rows repeated
+--scale times; the joins always run on the real datasets.
+
+    python benchmarks/dtype_backends.py
+    python benchmarks/dtype_backends.py --scale 20 --repeat 7
+"""
+import argparse
+from pathlib import Path
+import sys
+import tempfile
+import time
+import warnings
+
+PROJECT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PROJECT_DIR))
+
+import pandas as pd
+
+from src.data import builders, makers
+from src.data.combine_datasets import (create_district_dataset, create_school_dataset, find_district_id,
+                                       merge_all_data, remove_district_and_school_info)
+from src.data.input_output_functions import append_path
+from src.data.make_datasets import make_census, make_expenditures, make_kaggle
+
+RAW_DIR = PROJECT_DIR.joinpath('data/raw')
+YEARS = (2010, 2011, 2012)
+
+
+def best_time(function, repeat):
+    """ The shortest wall time of repeat calls of function in ms """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def read_raw(maker, filename, dtype_backend, scale):
+    """ The raw files of every year with their columns transformed, repeated scale times """
+    dataframes = []
+    for year in YEARS:
+        df_maker = maker(maker.read(RAW_DIR.joinpath(filename.format(year=year)), dtype_backend), dtype_backend)
+        df_maker._transform_rows()
+        df_maker._transform_cols()
+        dataframes.append(df_maker.df)
+    return pd.concat(dataframes * scale, ignore_index=True)
+
+
+def string_steps(dtype_backend, scale):
+    """ Maps the name of each string-heavy step to a function running it on fresh copies """
+    final = read_raw(makers.FinalMaker, 'kaggle/{year}_final_grade.csv', dtype_backend, scale)
+    expenditures = read_raw(makers.ExpenditureMaker, 'expenditures/expenditures{year}.csv', dtype_backend, scale)
+    census = read_raw(makers.CensusMaker, 'census/saipe{year}.csv', dtype_backend, scale)
+
+    def remove_boces():
+        maker = makers.FinalMaker(final.copy(), dtype_backend)
+        maker._remove_boces()
+
+    def clean_numbers():
+        maker = makers.ExpenditureMaker(expenditures.copy(), dtype_backend)
+        maker._clean_numbers()
+
+    return {'KaggleMaker._remove_boces': remove_boces,
+            'transform_district_name': lambda: builders.transform_district_name(census['district_name']),
+            'ExpenditureMaker._clean_numbers': clean_numbers}
+
+
+def join_step(dtype_backend):
+    """ A function running the joins of create_all_data on the datasets made with dtype_backend """
+    with tempfile.TemporaryDirectory() as directory:
+        for name in ('census', 'expenditures', 'kaggle'):
+            Path(directory, name).mkdir()
+        census = make_census(RAW_DIR.joinpath('census'), append_path(directory, 'census'),
+                             YEARS, dtype_backend=dtype_backend)
+        exp = make_expenditures(RAW_DIR.joinpath('expenditures'), append_path(directory, 'expenditures'),
+                                YEARS, dtype_backend=dtype_backend)
+        change, coact, enroll, final, frl, remediation, address = make_kaggle(
+            RAW_DIR.joinpath('kaggle'), append_path(directory, 'kaggle'), YEARS, dtype_backend=dtype_backend)
+
+        district = create_district_dataset(directory, directory, change, enroll, final, frl)
+        school = create_school_dataset(directory, directory, change, final)
+        census, exp = find_district_id(district, census, exp)
+        census, exp, change, enroll, final, frl = remove_district_and_school_info(
+            [census, exp, change, enroll, final, frl], district, school)
+
+    return lambda: merge_all_data(census, exp, change, enroll, final, frl, district, school)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare the dtype backends of the makers.')
+    parser.add_argument('--scale', type=int, default=10,
+                        help='times the raw rows are repeated for the string steps (default: 10)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='runs to take the best of (default: 5)')
+    args = parser.parse_args(argv)
+
+    results = {}
+    with warnings.catch_warnings():
+        # The makers still use the deprecated fillna(method=...)
+        warnings.simplefilter('ignore', FutureWarning)
+        for dtype_backend in makers.DTYPE_BACKENDS:
+            steps = string_steps(dtype_backend, args.scale)
+            steps['create_all_data joins'] = join_step(dtype_backend)
+            results[dtype_backend] = {name: best_time(step, args.repeat) for name, step in steps.items()}
+
+    default, *others = makers.DTYPE_BACKENDS
+    print(f"{'step':<34}" + ''.join(f'{backend:>16}' for backend in makers.DTYPE_BACKENDS)
+          + ''.join(f'{"speedup " + backend:>20}' for backend in others))
+    for name in results[default]:
+        times = [results[backend][name] for backend in makers.DTYPE_BACKENDS]
+        speedups = [results[default][name] / results[backend][name] for backend in others]
+        print(f'{name:<34}' + ''.join(f'{ms:>13.2f} ms' for ms in times)
+              + ''.join(f'{speedup:>19.2f}x' for speedup in speedups))
+    print(f'(best of {args.repeat}, string steps on the raw rows x{args.scale})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Checks that the pandas and polars engines make equal datasets from the raw
+data and compares their speed.
+
+Fails when any maker with a Polars translation gives a different DataFrame
+than its pandas transform under either dtype backend.
+
+    python benchmarks/engines.py
+    python benchmarks/engines.py --repeat 10
+"""
+import argparse
+from pathlib import Path
+import sys
+import time
+import warnings
+
+PROJECT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PROJECT_DIR))
+
+from src.data import engines
+from src.data.makers import DTYPE_BACKENDS, ENGINES
+
+RAW_DIR = PROJECT_DIR.joinpath('data/raw')
+YEARS = (2010, 2011, 2012)
+
+
+def best_time(maker, filename, engine, repeat):
+    """ The shortest time in ms to make every year of a raw file with engine """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for year in YEARS:
+            engines.make_dataframe(maker, RAW_DIR.joinpath(filename.format(year=year)), engine=engine)
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check and time the maker engines.')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='runs to take the best of (default: 5)')
+    args = parser.parse_args(argv)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', FutureWarning)
+        differences = [(dtype_backend,) + difference for dtype_backend in DTYPE_BACKENDS
+                       for difference in engines.check_engines(RAW_DIR, YEARS, dtype_backend)]
+
+        print(f"{'maker':<20}" + ''.join(f'{engine:>14}' for engine in ENGINES) + f"{'speedup':>10}")
+        for maker, filename in engines.RAW_FILENAMES.items():
+            times = [best_time(maker, filename, engine, args.repeat) for engine in ENGINES]
+            print(f'{maker.__name__:<20}' + ''.join(f'{ms:>11.1f} ms' for ms in times)
+                  + f'{times[0] / times[1]:>9.2f}x')
+
+    for dtype_backend, maker, filename, difference in differences:
+        print(f'\n{maker} {filename} ({dtype_backend}):\n{difference}')
+    if differences:
+        print('FAIL: the engines differ')
+        return 1
+
+    print('OK: the engines are equal')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
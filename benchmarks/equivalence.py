@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Checks candidate implementations against the current ones and times them.
+
+Every target of src/equivalence.py is run on the shipped data and on
+--synthetic random inputs. A candidate is given as target=module:function
+and must have the signature of the target's reference. Targets without one
+run their default candidate: the polars engine for the makers and the
+reference itself otherwise. The references are first compared with their
+frozen outputs in tests/golden. Fails when any output differs. After an
+intended change of a reference, --freeze saves its outputs again.
+
+    python benchmarks/equivalence.py
+    python benchmarks/equivalence.py combine_datasets --freeze
+    python benchmarks/equivalence.py transform_district_name --candidate transform_district_name=fast:names
+    python benchmarks/equivalence.py makers --synthetic 100 --repeat 3 --verbose
+"""
+import argparse
+from pathlib import Path
+import sys
+import warnings
+
+PROJECT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PROJECT_DIR))
+
+from src.equivalence import TARGETS, check_references, check_target, freeze_references, load_candidate
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check candidate implementations against the current ones.')
+    parser.add_argument('targets', nargs='*', metavar='target',
+                        help=f"targets to check, from {', '.join(TARGETS)} (default: all)")
+    parser.add_argument('--candidate', action='append', default=[], metavar='TARGET=MODULE:FUNCTION',
+                        help='the alternate implementation of a target, may be repeated')
+    parser.add_argument('--synthetic', type=int, default=20,
+                        help='synthetic cases per target (default: 20)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic cases (default: 0)')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='runs of each case to take the best time of (default: 1)')
+    parser.add_argument('--rtol', type=float, default=0.0,
+                        help='relative tolerance of float columns (default: 0, exact)')
+    parser.add_argument('--verbose', action='store_true', help='print the result of every case')
+    parser.add_argument('--freeze', action='store_true',
+                        help='save the reference outputs of the targets as their frozen outputs and exit')
+    args = parser.parse_args(argv)
+
+    unknown = [target for target in args.targets if target not in TARGETS]
+    if unknown:
+        parser.error(f"unknown targets {', '.join(unknown)}, choose from {', '.join(TARGETS)}")
+    candidates = {}
+    for candidate in args.candidate:
+        target, _, path = candidate.partition('=')
+        if target not in TARGETS:
+            parser.error(f'unknown target {target} in --candidate {candidate}')
+        candidates[target] = load_candidate(path)
+
+    with warnings.catch_warnings():
+        # The makers and fill_back_forward still use the deprecated fillna(method=...)
+        warnings.simplefilter('ignore', FutureWarning)
+        if args.freeze:
+            freeze_references(args.targets or None)
+            print(f"froze {', '.join(args.targets or TARGETS)}")
+            return 0
+        changed = {target: check_references(target) for target in args.targets or TARGETS}
+
+    changed = {target: differences for target, differences in changed.items() if differences}
+    for target, differences in changed.items():
+        print(f'{target} reference:\n' + '\n'.join(differences))
+    if changed:
+        print('FAIL: the references differ from their frozen outputs')
+        return 1
+
+    failed = []
+    print(f"{'target':<26}{'cases':>6}{'differ':>8}{'reference':>14}{'candidate':>14}{'ratio':>8}")
+    with warnings.catch_warnings():
+        # The makers and fill_back_forward still use the deprecated fillna(method=...)
+        warnings.simplefilter('ignore', FutureWarning)
+        for target in args.targets or TARGETS:
+            results = check_target(target, candidates.get(target), synthetic=args.synthetic, seed=args.seed,
+                                   repeat=args.repeat, rtol=args.rtol)
+            differ = [result for result in results if result.differences]
+            reference = sum(result.reference_seconds for result in results) * 1000
+            candidate = sum(result.candidate_seconds for result in results) * 1000
+            print(f'{target:<26}{len(results):>6}{len(differ):>8}{reference:>11.1f} ms{candidate:>11.1f} ms'
+                  f'{reference / candidate:>7.2f}x')
+            if args.verbose:
+                for result in results:
+                    print(f'    {result.case:<40}{result.reference_seconds * 1000:>9.1f} ms'
+                          f'{result.candidate_seconds * 1000:>9.1f} ms  {"DIFFER" if result.differences else "ok"}')
+            failed += differ
+
+    for result in failed:
+        print(f'\n{result.target} {result.case}:\n' + '\n'.join(result.differences))
+    if failed:
+        print('FAIL: the candidates differ from the references')
+        return 1
+    print('OK')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
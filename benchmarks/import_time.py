@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the cold start of the pipeline CLI against a fixed budget.
+
+Runs `python -X importtime -m src --help` from the project root, sums the
+import time of the top-level imports and fails when the best of several runs
+is over the budget or when a heavy module was imported.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --budget-ms 80 --command "src combine --dry-run"
+"""
+import argparse
+from pathlib import Path
+import shlex
+import subprocess
+import sys
+
+PROJECT_DIR = Path(__file__).resolve().parents[1]
+# The import time allowed for the CLI to show its help
+BUDGET_MS = 150
+# Modules that must only be imported when a stage runs
+HEAVY_MODULES = ('pandas', 'numpy', 'scipy', 'sklearn', 'pyarrow', 'matplotlib',
+                 'requests', 'dotenv', 'kaggle')
+
+
+def measure(command):
+    """
+    Runs command under -X importtime.
+
+    Returns
+    -------
+    total_ms : float
+        The sum of the cumulative time of the top-level imports
+    modules : dict
+        Maps every imported module to its cumulative time in ms
+
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-m'] + command,
+                            cwd=PROJECT_DIR, capture_output=True, text=True, check=True)
+
+    total_ms = 0.0
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        cumulative_ms = int(cumulative) / 1000
+        modules[name.strip()] = cumulative_ms
+        # Nested imports are indented under the module that imported them
+        if not name[1:].startswith(' '):
+            total_ms += cumulative_ms
+
+    return total_ms, modules
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check the import time of the pipeline CLI.')
+    parser.add_argument('--budget-ms', type=float, default=BUDGET_MS,
+                        help=f'allowed import time in ms (default: {BUDGET_MS})')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='runs to take the best of (default: 5)')
+    parser.add_argument('--command', default='src --help',
+                        help="module and arguments run with python -m (default: 'src --help')")
+    args = parser.parse_args(argv)
+    command = shlex.split(args.command)
+
+    runs = [measure(command) for _ in range(args.repeat)]
+    total_ms, modules = min(runs, key=lambda run: run[0])
+
+    print(f"python -m {args.command}: {total_ms:.1f} ms of imports "
+          f"(budget {args.budget_ms:.0f} ms, best of {args.repeat})")
+    for name, cumulative_ms in sorted(modules.items(), key=lambda item: -item[1])[:10]:
+        print(f'  {cumulative_ms:8.1f} ms  {name}')
+
+    heavy = sorted(name for name in modules if name.split('.')[0] in HEAVY_MODULES)
+    if heavy:
+        print(f"FAIL: imported {', '.join(heavy)}")
+        return 1
+    if total_ms > args.budget_ms:
+        print('FAIL: over budget')
+        return 1
+
+    print('OK')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
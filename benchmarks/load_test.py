@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Load test of the profile API in src/api.py.
+
+Starts a server on a free local port in a background thread, unless --port
+points at one already running, then sends profile requests for random schools
+and districts from --connections keep-alive connections and reports the p50,
+p99 and max latency and the requests per second. With --conditional a share
+of the requests repeat an earlier ETag in If-None-Match and expect a 304.
+
+    python benchmarks/load_test.py
+    python benchmarks/load_test.py --requests 20000 --connections 32 --conditional 0.5
+    python benchmarks/load_test.py --port 8000
+"""
+import argparse
+import asyncio
+from pathlib import Path
+import random
+import sys
+import threading
+import time
+
+PROJECT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PROJECT_DIR))
+
+import numpy as np
+
+from src.api import ProfileStore, serve
+
+
+def start_server(interim, cache_size):
+    """ Serves the interim data from a daemon thread and returns its port and store """
+    store = ProfileStore.load(interim)
+    ready = threading.Event()
+    address = {}
+
+    def started(host_port):
+        address['port'] = host_port[1]
+        ready.set()
+
+    thread = threading.Thread(target=asyncio.run, args=(serve(store, '127.0.0.1', 0, cache_size, started),),
+                              daemon=True)
+    thread.start()
+    ready.wait()
+    return address['port'], store
+
+
+def make_paths(store, count, seed):
+    """ count request paths spread over the schools and districts of store """
+    rng = random.Random(seed)
+    school_ids = list(store.schools)
+    district_ids = list(store.districts)
+    paths = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.6:
+            paths.append(f'/schools/{rng.choice(school_ids)}')
+        elif kind < 0.8:
+            paths.append(f'/districts/{rng.choice(district_ids)}')
+        elif kind < 0.9:
+            paths.append(f'/districts/{rng.choice(district_ids)}/schools')
+        else:
+            paths.append(f'/districts/{rng.choice(district_ids)}?years={rng.choice((2010, 2011, 2012))}')
+    return paths
+
+
+async def request(reader, writer, path, etag=None):
+    """ Sends a GET on a keep-alive connection and returns the status, ETag and body """
+    lines = [f'GET {path} HTTP/1.1', 'Host: localhost']
+    if etag is not None:
+        lines.append(f'If-None-Match: {etag}')
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode())
+    await writer.drain()
+
+    head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+    status = int(head[0].split(' ')[1])
+    headers = {name.lower(): value.strip() for name, _, value in
+               (line.partition(':') for line in head[1:] if line)}
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return status, headers.get('etag'), body
+
+
+async def run_connection(port, paths, conditional, etags, latencies, statuses, rng):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    for path in paths:
+        etag = etags.get(path) if rng.random() < conditional else None
+        start = time.perf_counter()
+        status, response_etag, _ = await request(reader, writer, path, etag)
+        latencies.append(time.perf_counter() - start)
+        statuses[status] = statuses.get(status, 0) + 1
+        if response_etag is not None:
+            etags[path] = response_etag
+    writer.close()
+
+
+async def load_test(port, paths, connections, conditional, seed):
+    """ The latencies in seconds and the count of each status of the requests for paths """
+    latencies, statuses, etags = [], {}, {}
+    rng = random.Random(seed)
+    await asyncio.gather(*(run_connection(port, paths[i::connections], conditional, etags, latencies,
+                                          statuses, rng)
+                           for i in range(connections)))
+    return latencies, statuses
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the profile API.')
+    parser.add_argument('--requests', type=int, default=5000, help='requests to send (default: 5000)')
+    parser.add_argument('--connections', type=int, default=16,
+                        help='concurrent keep-alive connections (default: 16)')
+    parser.add_argument('--conditional', type=float, default=0.0,
+                        help='share of requests sent with a known ETag (default: 0)')
+    parser.add_argument('--port', type=int, help='port of a running server (default: start one)')
+    parser.add_argument('--interim', type=Path, default=PROJECT_DIR.joinpath('data/interim'),
+                        help='interim data directory (default: data/interim)')
+    parser.add_argument('--cache-size', type=int, default=4096,
+                        help='responses cached by the started server (default: 4096)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    args = parser.parse_args(argv)
+
+    if args.port is None:
+        port, store = start_server(args.interim, args.cache_size)
+    else:
+        port, store = args.port, ProfileStore.load(args.interim)
+    paths = make_paths(store, args.requests, args.seed)
+
+    start = time.perf_counter()
+    latencies, statuses = asyncio.run(load_test(port, paths, args.connections, args.conditional, args.seed))
+    seconds = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000
+    print(f'{len(latencies)} requests over {args.connections} connections in {seconds:.2f} s '
+          f'({len(latencies) / seconds:,.0f} requests/s)')
+    print(f'p50 {np.percentile(latencies, 50):.2f} ms  p99 {np.percentile(latencies, 99):.2f} ms  '
+          f'max {latencies.max():.2f} ms')
+    print('statuses ' + ', '.join(f'{status}: {count}' for status, count in sorted(statuses.items())))
+
+
+if __name__ == '__main__':
+    main()
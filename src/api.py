@@ -0,0 +1,432 @@
+# -*- coding: utf-8 -*-
+"""
+A small JSON API serving school and district profiles for the dashboard.
+
+    python -m src.api --port 8000
+    curl localhost:8000/schools/10
+    curl localhost:8000/districts/880?years=2011,2012
+    curl localhost:8000/districts/880/schools
+
+The interim tables are read once at start-up and indexed by school_id and
+district_id, so a profile is assembled from a few rows instead of a scan.
+Responses are kept in an LRU cache keyed by path and query, and carry an
+ETag; a request whose If-None-Match matches gets an empty 304 reply. The
+server is plain asyncio with HTTP/1.1 keep-alive and only answers GET and
+HEAD. benchmarks/load_test.py reports its latency.
+"""
+import argparse
+import asyncio
+from collections import OrderedDict
+from email.utils import formatdate
+import hashlib
+from http import HTTPStatus
+import json
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+from src.data.input_output_functions import append_path, read_partitioned, to_numeric
+from src.features.aggregations import weighted_mean
+
+# The project root
+PROJECT_DIR = Path(__file__).resolve().parents[1]
+# The number of responses kept by the cache
+CACHE_SIZE = 4096
+# The longest request line and header block read, in bytes
+MAX_HEADER_BYTES = 16_384
+# Seconds an idle keep-alive connection is kept open
+KEEP_ALIVE_TIMEOUT = 15
+
+# The columns of a school profile for each year
+SCHOOL_COLS = ['year', 'emh', 'school_grade', 'achievement_dir', 'growth_dir', 'overall_dir',
+               'read_achievement', 'math_achievement', 'write_achievement', 'science_achievement',
+               'overall_weighted_growth', 'read_growth', 'math_growth', 'write_growth',
+               'total', 'pct_fr', 'pct_amind', 'pct_asian', 'pct_black', 'pct_hisp', 'pct_white',
+               'pct_pi', 'pct_2ormore']
+# The columns of a high school profile for each year
+HIGH_SCHOOL_COLS = ['year', 'graduation_rate', 'pct_remediation', 'eng_yn', 'math_yn', 'read_yn', 'sci_yn']
+# The columns of a district profile for each year, which are the same for all of its schools
+DISTRICT_COLS = ['year', 'est_child_poverty', 'est_total_child', 'est_total_pop', 'child_pov_ratio',
+                 'child_adult_ratio', 'instruction_total', 'support_total', 'community_total', 'other_total',
+                 'sum_total', 'instruction_per_pupil', 'support_per_pupil', 'community_per_pupil',
+                 'other_per_pupil', 'sum_per_pupil']
+# The columns of each school in the list of the schools of a district
+DISTRICT_SCHOOL_COLS = ['school_id', 'school', 'year', 'emh', 'school_grade', 'pct_fr', 'total']
+# Text columns that are not converted to numbers
+TEXT_COLS = ['county', 'emh', 'emh_combined_x', 'emh_combined_y', 'district_name', 'school']
+
+
+class NotFound(Exception):
+    """ Raised for a school or district that is not in the data """
+
+
+class ProfileStore:
+    """ The records of the interim tables indexed by school and district """
+
+    def __init__(self, all_data, high_school, districts, schools):
+        all_data = _clean(all_data)
+        high_school = _clean(high_school)
+        district_names = districts.set_index('district_id')['district_name'].to_dict()
+        school_info = schools.drop_duplicates('school_id').set_index('school_id')
+        first = all_data.dropna(subset=['school_id']).drop_duplicates('school_id').set_index('school_id')
+
+        # The records of each school and district, made once so that a request only selects years
+        self.school_years = _group_records(all_data[SCHOOL_COLS], all_data['school_id'])
+        self.high_school_years = _group_records(high_school[HIGH_SCHOOL_COLS], high_school['school_id'])
+        self.district_years = _group_records(_district_summary(all_data), 'district_id')
+        self.district_school_years = _group_records(
+            all_data.sort_values(['school_id', 'year', 'emh'])[DISTRICT_SCHOOL_COLS], all_data['district_id'])
+
+        self.schools = {}
+        for school_id, row in first.iterrows():
+            info = school_info.loc[school_id] if school_id in school_info.index else row
+            district_id = int(info['district_id'])
+            self.schools[int(school_id)] = {'school_id': int(school_id), 'school': info['school'],
+                                            'district_id': district_id,
+                                            'district_name': district_names.get(district_id)}
+        self.districts = {int(district_id): {'district_id': int(district_id),
+                                             'district_name': district_names.get(district_id),
+                                             'county': county}
+                          for district_id, county in all_data.groupby('district_id')['county'].first().items()}
+        # Identifies the data the responses were made from, part of every ETag
+        self.version = _frame_hash(all_data, high_school)
+
+
+    @classmethod
+    def load(cls, input_filepath):
+        """ Reads the combined tables of an interim directory, partitioned or not """
+        return cls(*(_read_table(input_filepath, name) for name in
+                     ('all_data', 'high_school', 'districts', 'schools')))
+
+
+    def school(self, school_id, years=None):
+        """ The profile of a school in the given years, or all of them """
+        if school_id not in self.schools:
+            raise NotFound(f'school {school_id} not found')
+
+        profile = dict(self.schools[school_id])
+        profile['years'] = _select_years(self.school_years[school_id], years)
+        school_years = {record['year'] for record in profile['years']}
+        profile['district'] = [record for record in self.district_years[profile['district_id']]
+                               if record['year'] in school_years]
+        if school_id in self.high_school_years:
+            profile['high_school'] = _select_years(self.high_school_years[school_id], years)
+        return profile
+
+
+    def district(self, district_id, years=None):
+        """ The profile of a district: its spending, poverty and the means of its schools by year """
+        if district_id not in self.districts:
+            raise NotFound(f'district {district_id} not found')
+        return dict(self.districts[district_id], years=_select_years(self.district_years[district_id], years))
+
+
+    def district_schools(self, district_id, years=None):
+        """ The schools of a district with their grade and lunch share in each year """
+        if district_id not in self.districts:
+            raise NotFound(f'district {district_id} not found')
+
+        district = self.districts[district_id]
+        return {'district_id': district_id, 'district_name': district['district_name'],
+                'schools': _select_years(self.district_school_years[district_id], years)}
+
+
+
+class ResponseCache:
+    """ A least recently used cache of encoded responses """
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.responses = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+
+    def get(self, key):
+        if key not in self.responses:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.responses.move_to_end(key)
+        return self.responses[key]
+
+
+    def put(self, key, response):
+        self.responses[key] = response
+        self.responses.move_to_end(key)
+        if len(self.responses) > self.maxsize:
+            self.responses.popitem(last=False)
+
+
+
+class ProfileServer:
+    """ Answers HTTP requests for profiles from a ProfileStore """
+
+    def __init__(self, store, cache_size=CACHE_SIZE):
+        self.store = store
+        self.cache = ResponseCache(cache_size)
+        # Maps the first part of a path to the function making its body
+        self.routes = {'schools': self._school,
+                       'districts': self._district,
+                       'health': self._health}
+
+
+    async def handle(self, reader, writer):
+        """ Serves the requests of one connection until it is closed """
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEP_ALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                        ConnectionError):
+                    break
+
+                method, target, version, headers = _parse_head(head)
+                status, response_headers, body = self.respond(method, target, headers)
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+                writer.write(_encode_response(status, response_headers, body, keep_alive, method == 'HEAD'))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+    def respond(self, method, target, headers):
+        """
+        Makes the response to a request.
+
+        Returns
+        -------
+        status : HTTPStatus
+        headers : dict
+        body : bytes
+
+        """
+        if method is None:
+            return _error(HTTPStatus.BAD_REQUEST, 'malformed request')
+        if method not in ('GET', 'HEAD'):
+            status, response_headers, body = _error(HTTPStatus.METHOD_NOT_ALLOWED, f'{method} is not allowed')
+            response_headers['Allow'] = 'GET, HEAD'
+            return status, response_headers, body
+
+        url = urlsplit(target)
+        key = _cache_key(url)
+        response = self.cache.get(key)
+        if response is None:
+            response = self._make_response(url)
+            # Errors other than not found and the live health counts are not cached
+            if response[0] in (HTTPStatus.OK, HTTPStatus.NOT_FOUND) and key[0] != '/health':
+                self.cache.put(key, response)
+
+        status, response_headers, body = response
+        if status == HTTPStatus.OK and _etag_matches(headers.get('if-none-match'), response_headers['ETag']):
+            return HTTPStatus.NOT_MODIFIED, response_headers, b''
+        return response
+
+
+    def _make_response(self, url):
+        parts = [part for part in url.path.split('/') if part]
+        if not parts or parts[0] not in self.routes:
+            return _error(HTTPStatus.NOT_FOUND, f'no route for {url.path}')
+        try:
+            years = _parse_years(parse_qs(url.query).get('years'))
+            data = self.routes[parts[0]](parts[1:], years)
+        except NotFound as error:
+            return _error(HTTPStatus.NOT_FOUND, str(error))
+        except ValueError as error:
+            return _error(HTTPStatus.BAD_REQUEST, str(error))
+
+        body = json.dumps(data, separators=(',', ':')).encode()
+        etag = '"' + hashlib.sha1(self.store.version.encode() + body).hexdigest()[:20] + '"'
+        return HTTPStatus.OK, {'Content-Type': 'application/json', 'ETag': etag,
+                               'Cache-Control': 'no-cache'}, body
+
+
+    def _school(self, parts, years):
+        if len(parts) != 1:
+            raise NotFound('use /schools/{school_id}')
+        return self.store.school(_parse_id(parts[0]), years)
+
+
+    def _district(self, parts, years):
+        if len(parts) == 1:
+            return self.store.district(_parse_id(parts[0]), years)
+        if len(parts) == 2 and parts[1] == 'schools':
+            return self.store.district_schools(_parse_id(parts[0]), years)
+        raise NotFound('use /districts/{district_id} or /districts/{district_id}/schools')
+
+
+    def _health(self, parts, years):
+        return {'status': 'ok', 'version': self.store.version,
+                'cache': {'size': len(self.cache.responses), 'hits': self.cache.hits,
+                          'misses': self.cache.misses}}
+
+
+
+async def serve(store, host='127.0.0.1', port=8000, cache_size=CACHE_SIZE, started=None):
+    """
+    Serves profiles until cancelled.
+
+    Parameters
+    ----------
+    store : ProfileStore
+        The data to serve
+    host, port : optional
+        The address to listen on. Port 0 picks a free port.
+    cache_size : int, optional
+        The number of responses cached. The default is CACHE_SIZE.
+    started : callable, optional
+        Called with the (host, port) listened on once the server is ready.
+
+    """
+    server = ProfileServer(store, cache_size)
+    listener = await asyncio.start_server(server.handle, host, port, limit=MAX_HEADER_BYTES)
+    if started is not None:
+        started(listener.sockets[0].getsockname()[:2])
+    async with listener:
+        await listener.serve_forever()
+
+
+def _read_table(input_filepath, name):
+    filepath = Path(append_path(input_filepath, f'{name}.csv'))
+    if filepath.with_suffix('').is_dir():
+        return read_partitioned(filepath.with_suffix(''))
+    return pd.read_csv(filepath)
+
+
+def _clean(df):
+    """ Converts text numbers such as ' 6022 ' to numbers and makes the ids integers """
+    df = df.copy()
+    for col in df.columns:
+        if col not in TEXT_COLS and df[col].dtype == object:
+            df[col] = to_numeric(df[col])
+    df = df.dropna(subset=['district_id'])
+    for col in ('district_id', 'school_id'):
+        if col in df.columns:
+            df[col] = df[col].astype('Int64')
+    return df.reset_index(drop=True)
+
+
+def _frame_hash(*dfs):
+    digest = hashlib.sha1()
+    for df in dfs:
+        digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()[:12]
+
+
+def _cache_key(url):
+    """ The path and sorted query, so that reordered query parameters share a response """
+    query = parse_qs(url.query)
+    return url.path.rstrip('/'), tuple(sorted((name, tuple(values)) for name, values in query.items()))
+
+
+def _district_summary(all_data):
+    """ One row per district and year with its spending, poverty and the means of its schools """
+    summary = all_data[['district_id'] + DISTRICT_COLS].drop_duplicates(['district_id', 'year'])
+    summary = summary.set_index(['district_id', 'year'])
+    by_year = all_data.groupby(['district_id', 'year'])
+    summary['schools'] = by_year['school_id'].nunique()
+    summary['students'] = by_year['total'].sum()
+    summary['mean_school_grade'] = by_year['school_grade'].mean()
+    # Weighted by enrollment, so that large schools count for more
+    pct_fr = weighted_mean(all_data, ['district_id', 'year'], 'pct_fr').set_index(['district_id', 'year'])
+    summary['pct_fr'] = pct_fr['pct_fr']
+    return summary.reset_index().sort_values(['district_id', 'year'])
+
+
+def _group_records(df, by):
+    """ Maps each value of by to the records of its rows in df, in order """
+    records = _records(df.drop(columns=by) if isinstance(by, str) else df)
+    keys = df[by] if isinstance(by, str) else by.reindex(df.index)
+    positions = pd.Series(range(len(df))).groupby(keys.to_numpy()).indices
+    return {int(key): [records[i] for i in rows] for key, rows in positions.items()}
+
+
+def _select_years(records, years):
+    return records if years is None else [record for record in records if record['year'] in years]
+
+
+def _records(df):
+    """ The rows of df as dictionaries of JSON values, with None for missing values """
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+
+def _parse_id(text):
+    try:
+        return int(text)
+    except ValueError:
+        raise ValueError(f'{text} is not an id') from None
+
+
+def _parse_years(values):
+    if not values:
+        return None
+    try:
+        return sorted({int(year) for value in values for year in value.split(',') if year})
+    except ValueError:
+        raise ValueError(f'years must be integers separated by commas, not {",".join(values)}') from None
+
+
+def _parse_head(head):
+    """ The method, target, version and lower case headers of a request, or Nones if it is malformed """
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, target, version = lines[0].split(' ')
+    except ValueError:
+        return None, None, None, {}
+
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        if name:
+            headers[name.strip().lower()] = value.strip()
+    return method, target, version, headers
+
+
+def _etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+
+
+def _error(status, message):
+    body = json.dumps({'error': message}).encode()
+    return status, {'Content-Type': 'application/json'}, body
+
+
+def _encode_response(status, headers, body, keep_alive, head=False):
+    lines = [f'HTTP/1.1 {status.value} {status.phrase}',
+             f'Date: {formatdate(usegmt=True)}',
+             f'Connection: {"keep-alive" if keep_alive else "close"}']
+    lines += [f'{name}: {value}' for name, value in headers.items()]
+    # A 304 has no body, a HEAD reply gives the length of the body it leaves out
+    if status != HTTPStatus.NOT_MODIFIED:
+        lines.append(f'Content-Length: {len(body)}')
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (b'' if head else body)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m src.api', description='Serve school and district profiles.')
+    parser.add_argument('--interim', type=Path, default=PROJECT_DIR.joinpath('data/interim'),
+                        help='interim data directory (default: data/interim)')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8000, help='port to listen on (default: 8000)')
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE,
+                        help=f'responses kept in the cache (default: {CACHE_SIZE})')
+    args = parser.parse_args(argv)
+
+    store = ProfileStore.load(args.interim)
+    try:
+        asyncio.run(serve(store, args.host, args.port, args.cache_size,
+                          started=lambda address: print('Serving on http://%s:%d' % address)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,9 @@ Created on Mon Jul 10 19:36:49 2023
 """
 import pandas as pd
 
+# The state FIPS code of the Kaggle datasets
+COLORADO = '08'
+
 # List of changes to make to district_name
 DISTRICT_NAME_CHANGES = {' SCHOOLS': '',
                          'SCHOOL ': '',
@@ -41,6 +44,21 @@ DISTRICT_NAME_CHANGES = {' SCHOOLS': '',
                          'FLORENCE': 'FREMONT'
                         }
 
+# Changes to make to the district_name of states without their own changes
+COMMON_DISTRICT_NAME_CHANGES = {' SCHOOLS': '',
+                                'SCHOOL ': '',
+                                'DISTRICT ': '',
+                                'DISTRICT': '',
+                                '-': ' ',
+                                ':': ' ',
+                                '/': ' ',
+                                r'[^\w\s]+': '',
+                                r'\s+': ' '
+                               }
+
+# The district_name changes of each state by FIPS code
+STATE_DISTRICT_NAME_CHANGES = {COLORADO: DISTRICT_NAME_CHANGES}
+
 class IDDatasetBuilder:
     """ Base Class that helps build ID datasets from a collection of datasets that
         contain pieces of information about the entire list of ids"""
@@ -70,13 +88,13 @@ class IDDatasetBuilder:
         
     def build(self):
         """
-        Concatenates a list of id data then drops duplicates keeping the first entry
+        Concatenates a list of id data then drops missing ids and duplicates keeping the first entry
         """
         # Create a long list of id_datasets
         self._concatenate()
         
-        # Remove duplicates
-        self.id_dataset = self.id_dataset.drop_duplicates(subset=self.id_cols)
+        # Remove missing ids and duplicates
+        self.id_dataset = self.id_dataset.dropna(subset=self.id_cols).drop_duplicates(subset=self.id_cols)
         
                  
     def save(self, filepath):
@@ -106,21 +124,49 @@ class DistrictIDBuilder(IDDatasetBuilder):
     # The id column in the districts dataset
     id_cols = ['district_id']
     
+    def __init__(self, kaggle_datasets, state=None):
+        """
+        
+        Parameters
+        ----------
+        kaggle_datasets : list(pd.DataFrames)
+            A list of dataframes to build an id dataset from
+        state : String, optional
+            The FIPS code of the state of the districts. When given, it is
+            added as a state column and selects the state's district_name
+            changes. The default is None or Colorado without a state column.
+
+        Returns
+        -------
+        None.
+
+        """
+        super().__init__(kaggle_datasets)
+        self.state = state
+    
+    
     def build(self):
         super().build()
         self._transform_district_name()
+        if self.state is not None:
+            self.id_dataset.insert(0, 'state', self.state)
     
         
     def _transform_district_name(self):
-        self.id_dataset['district_name'] = transform_district_name(self.id_dataset['district_name'])
+        district_name = transform_district_name(self.id_dataset['district_name'], self.state or COLORADO)
+        self.id_dataset = self.id_dataset.assign(district_name=district_name)
     
     
-def transform_district_name(col):
+def transform_district_name(col, state=COLORADO):
     # Uppercase the district_names
     col = col.str.upper()
+    # Fold accents such as Ñ to N. Arrow strings match regexes with RE2, where \w
+    # is ASCII only, so accented letters would otherwise be removed as symbols.
+    col = col.str.normalize('NFKD').str.replace('[\u0300-\u036f]', '', regex=True)
     
-    # Apply all changes
-    for original, replacement in DISTRICT_NAME_CHANGES.items():
+    # Apply all changes of the state
+    changes = STATE_DISTRICT_NAME_CHANGES.get(state, COMMON_DISTRICT_NAME_CHANGES)
+    for original, replacement in changes.items():
         col = col.str.replace(original, replacement, regex=True)
     
     col = col.str.strip()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Memory-mapped columnar storage for the combined datasets.
+
+Each column is saved as its own .npy file so that it can be mapped with
+np.load(mmap_mode='r'). Processes that load the same directory share the page
+cache instead of each holding a parsed copy. String columns are dictionary
+encoded as integer codes plus a dictionary saved in schema.json.
+"""
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.data.input_output_functions import to_numeric
+
+# The file describing the column order, kinds and string dictionaries
+SCHEMA_FILENAME = 'schema.json'
+
+
+def save_columnar(df, directory):
+    """
+    Saves a DataFrame as one .npy file per column.
+
+    Parameters
+    ----------
+    df : DataFrame
+        The DataFrame to save
+    directory : str, Path
+        The directory to save the columns in. It is created if it does not exist.
+
+    Returns
+    -------
+    None.
+
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    schema = {'columns': []}
+    for i, col in enumerate(df.columns):
+        # Columns are saved by position because names may not be valid filenames
+        filename = f'{i}.npy'
+        values, kind, dictionary = _encode_column(df[col])
+        np.save(directory.joinpath(filename), values, allow_pickle=False)
+
+        entry = {'name': col, 'file': filename, 'kind': kind}
+        if dictionary is not None:
+            entry['dictionary'] = dictionary
+        schema['columns'].append(entry)
+
+    with open(directory.joinpath(SCHEMA_FILENAME), 'w') as f:
+        json.dump(schema, f)
+
+
+def load_columnar(directory, columns=None):
+    """
+    Maps a directory written by save_columnar without copying the numeric data.
+
+    Parameters
+    ----------
+    directory : str, Path
+        The directory written by save_columnar
+    columns : list(String), optional
+        The columns to load. The default is None or all columns.
+
+    Returns
+    -------
+    DataFrame
+        A read-only DataFrame backed by the memory-mapped files.
+        String columns are returned as Categoricals over the mapped codes.
+
+    """
+    directory = Path(directory)
+    with open(directory.joinpath(SCHEMA_FILENAME)) as f:
+        schema = json.load(f)
+
+    entries = schema['columns']
+    if columns is not None:
+        missing = set(columns) - {entry['name'] for entry in entries}
+        if missing:
+            raise KeyError(f'columns not found in {directory}: {sorted(missing)}')
+        entries = [entry for entry in entries if entry['name'] in columns]
+
+    data = {}
+    for entry in entries:
+        values = np.load(directory.joinpath(entry['file']), mmap_mode='r')
+        if entry['kind'] == 'string':
+            values = pd.Categorical.from_codes(values, categories=entry['dictionary'])
+        data[entry['name']] = values
+
+    # copy=False keeps each column as a view of its mapped file
+    return pd.DataFrame(data, copy=False)
+
+
+def _encode_column(col):
+    """
+    Encodes a column as a numpy array that can be memory-mapped.
+
+    Returns
+    -------
+    values : ndarray
+        The values to save
+    kind : String
+        'numeric', 'bool' or 'string'
+    dictionary : list(String) or None
+        The categories of a string column
+
+    """
+    if pd.api.types.is_bool_dtype(col) and not col.hasnans:
+        return col.to_numpy(dtype=bool), 'bool', None
+
+    if pd.api.types.is_numeric_dtype(col) and not pd.api.types.is_bool_dtype(col):
+        return _to_numeric_array(col), 'numeric', None
+
+    # Some numbers are stored as text such as ' 6022 ' or '1,230'
+    as_numbers = to_numeric(col)
+    if as_numbers.notna().sum() == col.notna().sum():
+        return _to_numeric_array(as_numbers), 'numeric', None
+
+    # Everything else is dictionary encoded. Missing values get the code -1
+    codes, uniques = pd.factorize(col.astype('string'))
+    return codes.astype(_codes_dtype(len(uniques))), 'string', [str(value) for value in uniques]
+
+
+def _codes_dtype(num_categories):
+    """
+    The smallest integer type that holds the codes. It matches the type pandas
+    uses for Categorical codes, so that mapped codes are not copied on load.
+    """
+    for dtype in (np.int8, np.int16, np.int32):
+        if num_categories < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def _to_numeric_array(col):
+    """ Converts a numeric column to int64 when it has no missing values and float64 otherwise """
+    if pd.api.types.is_integer_dtype(col) and not col.hasnans:
+        return col.to_numpy(dtype=np.int64)
+
+    return col.to_numpy(dtype=np.float64, na_value=np.nan)
@@ -4,12 +4,31 @@ Created on Mon Jul 10 18:35:03 2023
 
 @author: caeley
 """
-from input_output_functions import append_path
+from src.data.input_output_functions import (append_path, append_csv, iter_partitioned, read_partitioned,
+                                             write_partitioned)
 import pandas as pd
 from pathlib import Path
-import builders
+import shutil
+import tempfile
+from src.data import builders
+from src.data import columnar as columnar_storage
 
-def combine_datasets(input_filepath, output_filepath, census, exp, kaggle):
+# The tall datasets combined by combine_datasets
+TALL_FILENAMES = {'census': 'census/tall_saipe.csv',
+                  'exp': 'expenditures/tall_expenditures.csv',
+                  'change': 'kaggle/1YR_3YR_change_tall.csv',
+                  'coact': 'kaggle/COACT_tall.csv',
+                  'enroll': 'kaggle/enrl_working_tall.csv',
+                  'final': 'kaggle/final_grade_tall.csv',
+                  'frl': 'kaggle/FRL_tall.csv',
+                  'remediation': 'kaggle/remediation_tall.csv'}
+# The number of district_id hash partitions of the out-of-core combine
+NUM_PARTITIONS = 16
+# The number of rows read at a time by the out-of-core combine
+CHUNKSIZE = 50_000
+
+def combine_datasets(input_filepath, output_filepath, census, exp, kaggle, columnar=False,
+                     partitioned=False):
     # Extract kaggle datasets
     change, coact, enroll, final, frl, remediation, address = kaggle
     
@@ -33,10 +52,13 @@ def combine_datasets(input_filepath, output_filepath, census, exp, kaggle):
                                census, 
                                exp, 
                                change, enroll, final, frl,
-                               district, school)
+                               district, school,
+                               columnar=columnar,
+                               partitioned=partitioned)
     
     # Build high school data
-    high_school = create_high_school(input_filepath, output_filepath, coact, remediation, all_data)
+    high_school = create_high_school(input_filepath, output_filepath, coact, remediation, all_data,
+                                     partitioned=partitioned)
     
     
     
@@ -69,7 +91,29 @@ def create_all_data(input_filepath, output_filepath,
                     census, 
                     exp, 
                     change, enroll, final, frl,
-                    district, school):
+                    district, school,
+                    columnar=False,
+                    partitioned=False):
+    all_data = merge_all_data(census, exp, change, enroll, final, frl, district, school)
+    
+    if partitioned:
+        write_partitioned(all_data.drop('graduation_rate', axis=1), append_path(output_filepath, 'all_data'))
+    else:
+        all_data.drop('graduation_rate', axis=1).to_csv(append_path(output_filepath, 'all_data.csv'), index=False)
+    
+    # Save a memory-mapped copy that analysis processes can share
+    if columnar:
+        columnar_storage.save_columnar(all_data.drop('graduation_rate', axis=1),
+                                       append_path(output_filepath, 'all_data_columnar'))
+    
+    return all_data
+
+
+def merge_all_data(census, 
+                   exp, 
+                   change, enroll, final, frl,
+                   district, school):
+    """ Joins the district and school level datasets into all_data without saving it """
     census_exp_df = pd.merge(census, exp, on=['district_id', 'year'], how='outer')
     change_final_df = pd.merge(change, final, on=['school_id', 'district_id', 'emh', 'year'], how='outer')
     
@@ -79,31 +123,292 @@ def create_all_data(input_filepath, output_filepath,
     all_data = pd.merge(all_data, district, on='district_id')
     all_data = pd.merge(all_data, school, on=['school_id', 'district_id'])
     
-    
-    all_data.drop('graduation_rate', axis=1).to_csv(append_path(output_filepath, 'all_data.csv'), index=False)
-    
     return all_data
+
     
 def create_high_school(input_filepath, output_filepath,
                        coact, remediation,
-                       all_data):
+                       all_data,
+                       partitioned=False):
+    high_school = merge_high_school(coact, remediation, all_data)
+    
+    if partitioned:
+        write_partitioned(high_school, append_path(output_filepath, 'high_school'))
+    else:
+        high_school.to_csv(append_path(output_filepath, 'high_school.csv'), index=False)
+    
+    return high_school
+
+
+def merge_high_school(coact, remediation, all_data):
+    """ Joins the high school datasets with the high schools in all_data without saving it """
     coact_remediation = pd.merge(coact, remediation, on=['school_id', 'year'])
     all_data_high_schools = all_data[all_data['emh'] == 'H'].drop('emh', axis=1)
     
+    return pd.merge(coact_remediation, all_data_high_schools, on=['school_id', 'district_id', 'year'])
+
+
+def append_combined_datasets(input_filepath, output_filepath, census, exp, kaggle, partitioned=False):
+    """
+    Appends new years to the combined datasets. Only the ids that are not
+    already in districts.csv and schools.csv are added, and only the rows of
+    all_data and high_school for the new years are computed and appended.
+
+    Parameters
+    ----------
+    input_filepath : str, Path
+        The interim directory
+    output_filepath : str, Path
+        The directory holding the combined datasets to append to
+    census, exp : DataFrame
+        The tall census and expenditures data of only the new years
+    kaggle : tuple(DataFrame)
+        The tall kaggle datasets of only the new years
+    partitioned : bool, optional
+        Whether all_data and high_school are saved partitioned by year and
+        district_id. The default is False.
+
+    Returns
+    -------
+    tuple(DataFrame)
+        The full district and school datasets, and the new rows of
+        all_data and high_school.
+
+    """
+    change, coact, enroll, final, frl, remediation, address = kaggle
     
-    high_school = pd.merge(coact_remediation, all_data_high_schools, on=['school_id', 'district_id', 'year'])
+    district = extend_id_dataset(append_path(output_filepath, 'districts.csv'),
+                                 builders.DistrictIDBuilder((change, enroll, final, frl)))
+    school = extend_id_dataset(append_path(output_filepath, 'schools.csv'),
+                               builders.SchoolIDBuilder((change, final)))
     
-    high_school.to_csv(append_path(output_filepath, 'high_school.csv'), index=False)
+    census, exp = find_district_id(district, census, exp)
     
-    return high_school
+    remove_bad_info_datasets = census, exp, change, coact, enroll, final, frl, remediation,
+    updated_datasets = remove_district_and_school_info(remove_bad_info_datasets, district, school)
+    census, exp, change, coact, enroll, final, frl, remediation = updated_datasets
+    
+    # Every join in all_data is within a year, so the new years only depend on new data
+    all_data = merge_all_data(census, exp, change, enroll, final, frl, district, school)
+    high_school = merge_high_school(coact, remediation, all_data)
+    
+    if partitioned:
+        # Only the partitions of the new years are written
+        write_partitioned(all_data.drop('graduation_rate', axis=1), append_path(output_filepath, 'all_data'))
+        write_partitioned(high_school, append_path(output_filepath, 'high_school'))
+    else:
+        append_csv(all_data.drop('graduation_rate', axis=1), append_path(output_filepath, 'all_data.csv'))
+        append_csv(high_school, append_path(output_filepath, 'high_school.csv'))
+    
+    return district, school, all_data, high_school
+
 
+def extend_id_dataset(filepath, builder):
+    """
+    Appends the ids built by builder that are not already saved in filepath
+
+    Returns
+    -------
+    DataFrame
+        The full id dataset.
+
+    """
+    builder.build()
+    existing = pd.read_csv(filepath)
+    id_col = builder.id_cols[0]
+    
+    # Ids may be read as text such as '0010' in one year and as numbers in another
+    ids = builder.id_dataset.assign(**{id_col: pd.to_numeric(builder.id_dataset[id_col], errors='coerce')})
+    ids = ids.dropna(subset=[id_col]).drop_duplicates(id_col)
+    ids[id_col] = ids[id_col].astype('int64')
+    new_ids = ids[~ids[id_col].isin(pd.to_numeric(existing[id_col], errors='coerce'))]
+    append_csv(new_ids, filepath)
+    
+    return pd.concat((existing, new_ids), ignore_index=True)
 
-def find_district_id(district, census, exp):
-    def _find_district_id(df):
-        df['district_name'] = builders.transform_district_name(df['district_name'])
-        return pd.merge(district, df, on='district_name')
+
+def combine_datasets_out_of_core(input_filepath, output_filepath, partitioned=False,
+                                 num_partitions=NUM_PARTITIONS, chunksize=CHUNKSIZE,
+                                 spill_filepath=None):
+    """
+    Builds the same combined datasets as combine_datasets from the tall files
+    in input_filepath without holding them in memory.
+    
+    Every tall dataset is read in chunks and hash-partitioned by district_id
+    into temporary spill files. The joins of all_data and high_school only
+    match rows of the same district, so each partition is joined on its own
+    and its rows are appended to the outputs. Peak memory depends on the size
+    of a partition, not on the number of states and years.
+    
+    Datasets without a district_id, such as remediation, are partitioned by the
+    district of their school_id in the schools dataset. Rows whose district
+    is unknown are dropped, as they are dropped by the joins of combine_datasets.
+    The rows of the outputs are ordered by partition.
+
+    Parameters
+    ----------
+    input_filepath : str, Path
+        The interim directory holding the tall datasets
+    output_filepath : str, Path
+        The directory to save the combined datasets in
+    partitioned : bool, optional
+        Save all_data and high_school partitioned by year and district_id.
+        The default is False.
+    num_partitions : int, optional
+        The number of district_id partitions. The default is NUM_PARTITIONS.
+    chunksize : int, optional
+        The number of rows read at a time. The default is CHUNKSIZE.
+    spill_filepath : str, Path, optional
+        The directory to create the spill files in. The default is None or
+        the system temporary directory.
+
+    Returns
+    -------
+    district, school : DataFrame
+        The id datasets.
+
+    """
+    # The id datasets only need the id columns of the kaggle datasets
+    district = create_district_dataset(input_filepath, output_filepath,
+                                       *[read_tall(input_filepath, name, builders.DistrictIDBuilder.keep_cols)
+                                         for name in ('change', 'enroll', 'final', 'frl')])
+    school = create_school_dataset(input_filepath, output_filepath,
+                                   *[read_tall(input_filepath, name, builders.SchoolIDBuilder.keep_cols)
+                                     for name in ('change', 'final')])
+    school_districts = school.set_index('school_id')['district_id']
+    
+    all_data_filepath = append_path(output_filepath, 'all_data' if partitioned else 'all_data.csv')
+    high_school_filepath = append_path(output_filepath, 'high_school' if partitioned else 'high_school.csv')
+    # The outputs are built up partition by partition
+    for filepath in (all_data_filepath, high_school_filepath):
+        if Path(filepath).is_dir():
+            shutil.rmtree(filepath)
+        elif Path(filepath).exists():
+            Path(filepath).unlink()
+    
+    with tempfile.TemporaryDirectory(dir=spill_filepath) as spill_dir:
+        spill = SpillFiles(spill_dir, num_partitions)
+        
+        for name in TALL_FILENAMES:
+            for chunk in _read_tall_chunks(input_filepath, name, chunksize):
+                if name in ('census', 'exp'):
+                    chunk = match_district_id(district, chunk)
+                    keys = chunk['district_id']
+                elif name in ('enroll', 'frl', 'remediation'):
+                    # The joins use the district of the school, not the dataset's own
+                    keys = chunk['school_id'].map(school_districts)
+                else:
+                    keys = chunk['district_id']
+                
+                chunk = remove_district_and_school_info([chunk], district, school)[0]
+                spill.write(name, chunk, keys)
+        
+        for partition in range(num_partitions):
+            census, exp, change, coact, enroll, final, frl, remediation = [
+                spill.read(name, partition) for name in TALL_FILENAMES]
+            
+            all_data = merge_all_data(census, exp, change, enroll, final, frl, district, school)
+            high_school = merge_high_school(coact, remediation, all_data)
+            all_data = all_data.drop('graduation_rate', axis=1)
+            
+            if partitioned:
+                # Each district is in a single partition, so no files are shared
+                write_partitioned(all_data, all_data_filepath, replace=False)
+                write_partitioned(high_school, high_school_filepath, replace=False)
+            else:
+                append_csv(all_data, all_data_filepath)
+                append_csv(high_school, high_school_filepath)
+    
+    return district, school
+
+
+class SpillFiles:
+    """ Class that hash-partitions datasets into csv files and reads the partitions back """
+    
+    def __init__(self, directory, num_partitions):
+        self.directory = Path(directory)
+        self.num_partitions = num_partitions
+        # The object columns of each dataset, which are read back as object
+        # even in partitions where they are empty
+        self.object_cols = {}
+        # The columns of each dataset, so that empty partitions can be read
+        self.columns = {}
+    
+    
+    def write(self, name, df, keys):
+        """
+        Appends the rows of df to the partitions of their keys. Rows with
+        a missing key are dropped.
+        """
+        self.object_cols.setdefault(name, set()).update(df.columns[df.dtypes == object])
+        self.columns.setdefault(name, list(df.columns))
         
-    return _find_district_id(census), _find_district_id(exp)
+        partitions = self.partition_of(keys)
+        has_key = partitions >= 0
+        for partition, rows in df[has_key].groupby(partitions[has_key]):
+            append_csv(rows, self._filepath(name, partition))
+    
+    
+    def read(self, name, partition):
+        """ Reads a partition of a dataset """
+        filepath = self._filepath(name, partition)
+        if not filepath.exists():
+            return pd.DataFrame(columns=self.columns.get(name, [])).astype(
+                {col: object for col in self.object_cols.get(name, ())})
+        
+        return pd.read_csv(filepath, dtype={col: object for col in self.object_cols[name]})
+    
+    
+    def partition_of(self, keys):
+        """ The partition of each key, or -1 when it is missing """
+        keys = pd.to_numeric(keys, errors='coerce')
+        return (keys % self.num_partitions).fillna(-1).astype(int)
+    
+    
+    def _filepath(self, name, partition):
+        directory = self.directory.joinpath(name)
+        directory.mkdir(exist_ok=True)
+        return directory.joinpath(f'{partition}.csv')
+
+
+def read_tall(input_filepath, name, columns=None, dtype_backend=None):
+    """ 
+    Reads a tall dataset of TALL_FILENAMES, saved as csv or partitioned.
+    The columns keep the numpy types of read_csv unless a dtype_backend is given. Floats are
+    read back exactly as they were made.
+    """
+    filepath = Path(append_path(input_filepath, TALL_FILENAMES[name]))
+    if filepath.with_suffix('').is_dir():
+        return read_partitioned(filepath.with_suffix(''), columns=columns, dtype_backend=dtype_backend)
+    if dtype_backend is None:
+        return pd.read_csv(filepath, usecols=columns, float_precision='round_trip')
+    return pd.read_csv(filepath, usecols=columns, dtype_backend=dtype_backend, float_precision='round_trip')
+
+
+def _read_tall_chunks(input_filepath, name, chunksize, columns=None):
+    """ Yields a tall dataset in chunks, or by partition when it is saved partitioned """
+    filepath = Path(append_path(input_filepath, TALL_FILENAMES[name]))
+    if filepath.with_suffix('').is_dir():
+        return iter_partitioned(filepath.with_suffix(''), columns=columns)
+    return pd.read_csv(filepath, usecols=columns, chunksize=chunksize)
+
+
+def find_district_id(district, census, exp, state=None):
+    return match_district_id(district, census, state), match_district_id(district, exp, state)
+
+
+def match_district_id(district, df, state=None):
+    """ 
+    Adds the district_id of each district_name, dropping unknown districts.
+    The names are normalized with the changes of state, Colorado when None.
+    When both datasets have a state column, districts are matched within their state.
+    """
+    df['district_name'] = builders.transform_district_name(df['district_name'], state or builders.COLORADO)
+    
+    on = ['district_name']
+    if 'state' in district.columns and 'state' in df.columns:
+        on = ['state', 'district_name']
+    return pd.merge(district, df, on=on)
 
 
 def remove_district_and_school_info(datasets, districts, schools):
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""
+Execution engines for the Makers.
+
+The pandas engine runs Maker.transform eagerly and is the reference. The
+polars engine compiles the declarative parts of a Maker, its drop_rows,
+col_map, drop_cols and value_maps, together with the row and column steps of
+the census and Kaggle makers into a Polars lazy plan. Polars optimizes the
+plan and runs it on all cores. The result is given the dtypes the pandas
+engine infers with convert_dtypes, so both engines make equal DataFrames;
+check_engines compares them on the raw data.
+
+Makers whose transform or read has no Polars translation, such as the
+expenditure makers, are run with the pandas engine.
+"""
+import csv
+from functools import partial
+import io
+
+import pandas as pd
+import polars as pl
+
+from src.data import makers
+from src.data.makers import DTYPE_BACKEND, ENGINES
+
+# The strings pd.read_csv reads as missing by default
+PANDAS_NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND',
+                    '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+
+# The bytes read to find the header and line endings of a raw file
+HEADER_BYTES = 1 << 16
+
+# The raw file of each maker with a Polars translation, used by check_engines
+RAW_FILENAMES = {makers.CensusMaker: 'census/saipe{year}.csv',
+                 makers.StateCensusMaker: 'census/saipe{year}.csv',
+                 makers.ChangeMaker: 'kaggle/{year}_1YR_3YR_change.csv',
+                 makers.CoactMaker: 'kaggle/{year}_COACT.csv',
+                 makers.EnrollMaker: 'kaggle/{year}_enrl_working.csv',
+                 makers.FinalMaker: 'kaggle/{year}_final_grade.csv',
+                 makers.FrlMaker: 'kaggle/{year}_k_12_FRL.csv',
+                 makers.RemediationMaker: 'kaggle/{year}_remediation_HS.csv',
+                 makers.AddressMaker: 'kaggle/{year}_school_address.csv'}
+
+
+def make_dataframe(maker, filepath, dtype_backend=DTYPE_BACKEND, engine='pandas'):
+    """
+    Reads and transforms a raw file with the given engine.
+
+    Parameters
+    ----------
+    maker : type
+        The Maker class
+    filepath : str, Path
+        The raw file
+    dtype_backend : String, optional
+        'numpy_nullable' or 'pyarrow'. The default is 'numpy_nullable'.
+    engine : String, optional
+        'pandas' or 'polars'. Makers without a Polars translation are run
+        with pandas. The default is 'pandas'.
+
+    Returns
+    -------
+    DataFrame
+
+    """
+    if engine not in ENGINES:
+        raise ValueError(f'engine must be one of {ENGINES}')
+
+    if engine == 'polars' and supports_polars(maker):
+        return PolarsPlan(maker, dtype_backend).run(filepath)
+
+    df_maker = maker(maker.read(filepath, dtype_backend), dtype_backend)
+    df_maker.transform()
+    return df_maker.df.reset_index(drop=True)
+
+
+def supports_polars(maker):
+    """ Whether the transform and read of maker have a Polars translation """
+    transform_owner = next(cls for cls in maker.mro() if 'transform' in vars(cls))
+    read_owner = next(cls for cls in maker.mro() if 'read' in vars(cls))
+    return transform_owner in POLARS_TRANSFORMS and read_owner is makers.Maker
+
+
+def scan_csv(filepath):
+    """ Scans a csv file with Polars, naming and parsing the columns like pd.read_csv """
+    source = filepath
+    with open(filepath, 'rb') as f:
+        data = f.read(HEADER_BYTES)
+        # Some Kaggle files end their lines with a carriage return only, which
+        # Polars cannot split, so they are scanned from memory with new lines
+        if b'\r' in data:
+            data = (data + f.read()).replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+            source = io.BytesIO(data)
+    header = next(csv.reader(io.StringIO(data.split(b'\n', 1)[0].decode('utf-8-sig'))))
+
+    return pl.scan_csv(source, new_columns=_pandas_names(header), infer_schema_length=None,
+                       null_values=PANDAS_NA_VALUES)
+
+
+
+class PolarsPlan:
+    """ A Polars lazy plan mirroring the transform of a Maker """
+
+    def __init__(self, maker, dtype_backend=DTYPE_BACKEND):
+        # A maker without data holds the declarative parts, including the
+        # col_maps extended in __init__
+        self.spec = maker(None, dtype_backend)
+        self.maker = maker
+        self.dtype_backend = dtype_backend
+        self.lf = None
+        # Maps the columns typed by convert_dtypes to their nullable dtype.
+        # The other columns keep the numpy dtype Polars converts them to.
+        self.dtypes = {}
+
+
+    def run(self, filepath):
+        """ Builds the plan of a raw file, collects it and converts it to pandas """
+        self.lf = scan_csv(filepath)
+        transform_owner = next(cls for cls in self.maker.mro() if 'transform' in vars(cls))
+        for step in POLARS_TRANSFORMS[transform_owner]:
+            step(self)
+
+        return self._to_pandas(self.lf.collect())
+
+
+    def transform_rows(self):
+        """ Drops drop_rows, by their position, and completely empty rows """
+        if self.spec.drop_rows:
+            self.lf = (self.lf.with_row_index('__row')
+                       .filter(~pl.col('__row').is_in(list(self.spec.drop_rows)))
+                       .drop('__row'))
+        self.lf = self.lf.filter(~pl.all_horizontal(pl.all().is_null()))
+
+
+    def transform_cols(self):
+        """ Lowercases, renames and drops columns and infers their dtypes """
+        names = self.lf.collect_schema().names()
+        self.lf = self.lf.rename({name: self.spec.col_map.get(name.lower(), name.lower()) for name in names})
+
+        names = self.lf.collect_schema().names()
+        self.lf = self.lf.drop([col for col in self.spec.drop_cols if col in names])
+        self._infer_dtypes()
+
+
+    def map_values(self):
+        for col, value_map in self.spec.value_maps.items():
+            self.lf = self.lf.with_columns(
+                pl.col(col).cast(pl.Float64).replace_strict([float(key) for key in value_map],
+                                                            list(value_map.values()), default=None))
+            self.dtypes.pop(col, None)
+
+
+    def drop_index(self):
+        """ Drops the first column, which CensusMaker uses as the index """
+        self.lf = self.lf.drop(self.lf.collect_schema().names()[0])
+
+
+    def create_ratio_cols(self):
+        self.lf = self.lf.with_columns(
+            child_pov_ratio=pl.col('est_child_poverty') / pl.col('est_total_child'),
+            child_adult_ratio=pl.col('est_total_child') / pl.col('est_total_pop'))
+        self.dtypes.update(child_pov_ratio='Float64', child_adult_ratio='Float64')
+
+
+    def pad_state(self):
+        self.lf = self.lf.with_columns(pl.col('state').cast(pl.String).str.zfill(2))
+        self.dtypes.pop('state', None)
+
+
+    def convert_ids(self):
+        """ Like KaggleMaker._convert_ids, ids read as text are converted to numbers """
+        for col in ('district_id', 'school_id'):
+            if self._is_string(col):
+                self.lf = self.lf.with_columns(pl.col(col).str.strip_chars().cast(pl.Int64, strict=False))
+                self.dtypes[col] = 'Int64'
+
+
+    def remove_boces(self):
+        if self._is_string('district_name'):
+            self._drop_where(pl.col('district_name').str.to_uppercase().str.contains('BOC', literal=True))
+
+
+    def remove_state_results(self):
+        if self._is_numeric('district_id'):
+            self._drop_where(pl.col('district_id') == 0)
+
+
+    def remove_district_results(self):
+        if self._is_string('school'):
+            self._drop_where(pl.col('school') == 'DISTRICT RESULTS')
+
+
+    def refactor_emh_combined(self):
+        if 'emh_combined' in self.lf.collect_schema():
+            self.lf = self.lf.with_columns(pl.col('emh_combined').is_not_null())
+            self.dtypes.pop('emh_combined', None)
+
+
+    def drop_last_two_rows(self):
+        self.lf = self.lf.filter(pl.int_range(pl.len()) < pl.len() - 2)
+
+
+    def clean_pct_signs(self, col):
+        """ Like KaggleMaker._clean_pct_signs, only string columns are changed """
+        if self._is_string(col):
+            percent = pl.col(col).str.replace_all('%', '', literal=True).str.strip_chars().cast(pl.Float64)
+            # Polars divides by a scalar by multiplying with its inverse, which
+            # can differ from pandas in the last bit, so divide by a column of 100s
+            hundreds = (pl.int_range(pl.len()) * 0 + 100).cast(pl.Float64)
+            self.lf = self.lf.with_columns(percent / hundreds)
+            self.dtypes.pop(col, None)
+
+
+    def _drop_where(self, condition):
+        """ Drops the rows where condition is true, keeping the rows where it is null """
+        self.lf = self.lf.filter(~condition.fill_null(False))
+
+
+    def _is_string(self, col):
+        schema = self.lf.collect_schema()
+        return col in schema and schema[col] == pl.String
+
+
+    def _is_numeric(self, col):
+        schema = self.lf.collect_schema()
+        return col in schema and schema[col].is_numeric()
+
+
+    def _infer_dtypes(self):
+        """ The dtypes convert_dtypes gives the columns at this point of the plan """
+        schema = self.lf.collect_schema()
+        # Floats are converted to integers when all of their values are whole,
+        # and empty columns, read as float by pandas, to Int64
+        checks = [(pl.col(col).is_null() | (pl.col(col) == pl.col(col).round(0))).all().alias(col)
+                  for col, dtype in schema.items() if dtype.is_float()]
+        checks += [pl.col(col).is_null().all().alias(f'{col} empty') for col in schema]
+        results = self.lf.select(checks).collect().row(0, named=True)
+
+        for col, dtype in schema.items():
+            if results[f'{col} empty']:
+                self.dtypes[col] = 'empty'
+            elif dtype.is_integer() or (dtype.is_float() and results[col]):
+                self.dtypes[col] = 'Int64'
+            elif dtype.is_float():
+                self.dtypes[col] = 'Float64'
+            elif dtype == pl.Boolean:
+                self.dtypes[col] = 'boolean'
+            elif dtype == pl.String:
+                self.dtypes[col] = 'string'
+
+
+    def _to_pandas(self, df):
+        """ Converts the collected plan to the dtypes of the pandas engine """
+        import pyarrow as pa
+
+        # Empty columns are read as float by pandas and as null by Arrow
+        backend_dtypes = {'numpy_nullable': {'Int64': 'Int64', 'Float64': 'Float64', 'boolean': 'boolean',
+                                             'string': 'string', 'empty': 'Int64'},
+                          'pyarrow': {'Int64': pd.ArrowDtype(pa.int64()), 'Float64': pd.ArrowDtype(pa.float64()),
+                                      'boolean': pd.ArrowDtype(pa.bool_()), 'string': pd.ArrowDtype(pa.string()),
+                                      'empty': pd.ArrowDtype(pa.null())}}
+
+        df = df.to_pandas()
+        for col, dtype in self.dtypes.items():
+            if col in df.columns:
+                df[col] = df[col].astype(backend_dtypes[self.dtype_backend][dtype])
+        return df
+
+
+# The steps of each Maker.transform, in the order they run in pandas
+MAKER_STEPS = (PolarsPlan.transform_rows, PolarsPlan.transform_cols)
+CENSUS_STEPS = (PolarsPlan.drop_index,) + MAKER_STEPS + (PolarsPlan.create_ratio_cols,)
+KAGGLE_STEPS = MAKER_STEPS + (PolarsPlan.convert_ids, PolarsPlan.remove_boces,
+                              PolarsPlan.remove_state_results, PolarsPlan.remove_district_results,
+                              PolarsPlan.refactor_emh_combined)
+POLARS_TRANSFORMS = {makers.Maker: MAKER_STEPS,
+                     makers.CensusMaker: CENSUS_STEPS,
+                     makers.StateCensusMaker: CENSUS_STEPS + (PolarsPlan.pad_state,),
+                     makers.KaggleMaker: KAGGLE_STEPS,
+                     makers.ChangeMaker: KAGGLE_STEPS + (PolarsPlan.map_values,),
+                     makers.CoactMaker: KAGGLE_STEPS + (PolarsPlan.map_values,),
+                     makers.FrlMaker: KAGGLE_STEPS + (PolarsPlan.drop_last_two_rows,
+                                                      partial(PolarsPlan.clean_pct_signs, col='pct_fr')),
+                     makers.RemediationMaker: KAGGLE_STEPS + (partial(PolarsPlan.clean_pct_signs,
+                                                                      col='pct_remediation'),)}
+
+
+def check_engines(input_filepath, years=(2010, 2011, 2012), dtype_backend=DTYPE_BACKEND):
+    """
+    Compares the pandas and polars engines on the raw files of RAW_FILENAMES.
+
+    Parameters
+    ----------
+    input_filepath : str, Path
+        The raw directory
+    years : tuple(int), optional
+        The years to compare. The default is (2010, 2011, 2012).
+    dtype_backend : String, optional
+        The dtype backend of both engines. The default is 'numpy_nullable'.
+
+    Returns
+    -------
+    list(tuple)
+        The maker name, filename and difference of every file where the
+        engines disagree. Empty when the engines are equal.
+
+    """
+    differences = []
+    for maker, filename in RAW_FILENAMES.items():
+        for year in years:
+            filepath = f'{input_filepath}/{filename.format(year=year)}'
+            expected = make_dataframe(maker, filepath, dtype_backend, 'pandas')
+            result = make_dataframe(maker, filepath, dtype_backend, 'polars')
+            try:
+                pd.testing.assert_frame_equal(result, expected, check_exact=True)
+            except AssertionError as error:
+                differences.append((maker.__name__, filename.format(year=year), str(error)))
+
+    return differences
+
+
+def _pandas_names(header):
+    """ Names empty and duplicate columns like pd.read_csv, e.g. 'Unnamed: 0' and 'name.1' """
+    names = []
+    for i, name in enumerate(header):
+        name = name or f'Unnamed: {i}'
+        original, count = name, 0
+        while name in names:
+            count += 1
+            name = f'{original}.{count}'
+        names.append(name)
+    return names
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""
+Links the school-years of the address dataset into schools that keep one key
+across years.
+
+SchoolIDBuilder keeps one row per school_id, so a school that is given a new
+id, or an id that is reused by a different school, is not followed across
+years. Here every school-year of the AddressMaker output is a record, and
+records of different years are linked when their names and street addresses
+are similar enough.
+
+Comparing every pair of records is quadratic, so candidate pairs only come
+from blocks of records sharing a key: the school_id, the zipcode and house
+number, the district and first distinctive word of the name, and the zipcode
+alone when it has few schools. Blocks over MAX_BLOCK_SIZE are skipped, which
+bounds the pairs by the number of records times MAX_BLOCK_SIZE. Names and
+addresses are compared by the Jaccard similarity of their character trigrams,
+computed for all pairs at once from a sparse trigram matrix.
+
+Pairs are linked from the best score down with a union-find that never joins
+two clusters present in the same year, since one school has one record a year.
+
+    entities = resolve_schools(pd.read_csv('data/interim/kaggle/address_tall.csv'))
+"""
+import re
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from src.data.input_output_functions import append_path
+
+# The file the school entities are saved in, in the interim directory
+ENTITIES_FILENAME = 'school_entities.csv'
+# The columns of the blocks candidate pairs are made from, one pass each
+BLOCKING_PASSES = (('school_id',),
+                   ('zipcode', 'house_number'),
+                   ('district_id', 'name_key'),
+                   ('zipcode',))
+# Blocks with more records are skipped, which keeps the pairs linear in the records
+MAX_BLOCK_SIZE = 50
+# The weights of the name and address similarity in the score of a pair
+NAME_WEIGHT = 0.6
+ADDRESS_WEIGHT = 0.4
+# The score over which records of different school_ids are the same school
+MATCH_THRESHOLD = 0.6
+# The lower score over which records of the same school_id are the same school.
+# Below it both the name and the address changed, and the id was reused.
+SAME_ID_THRESHOLD = 0.3
+# The abbreviations of school names and their expansions
+NAME_ABBREVIATIONS = {'ELEM': 'ELEMENTARY',
+                      'ES': 'ELEMENTARY SCHOOL',
+                      'MS': 'MIDDLE SCHOOL',
+                      'HS': 'HIGH SCHOOL',
+                      'JR': 'JUNIOR',
+                      'SR': 'SENIOR',
+                      'SCH': 'SCHOOL',
+                      'ACAD': 'ACADEMY',
+                      'CTR': 'CENTER',
+                      'INTL': 'INTERNATIONAL',
+                      'PREP': 'PREPARATORY',
+                      'MT': 'MOUNT',
+                      'ST': 'SAINT'}
+# The words of school names that say little about which school it is
+GENERIC_NAME_WORDS = {'THE', 'OF', 'AND', 'AT', 'FOR', 'SCHOOL', 'ELEMENTARY', 'MIDDLE', 'HIGH',
+                      'JUNIOR', 'SENIOR', 'ACADEMY', 'CHARTER', 'CENTER', 'PREPARATORY',
+                      'INTERNATIONAL', 'COMMUNITY', 'EARLY', 'COLLEGE', 'ONLINE'}
+# The street words of addresses and their standard abbreviations
+ADDRESS_ABBREVIATIONS = {'NORTH': 'N', 'NO': 'N',
+                         'SOUTH': 'S', 'SO': 'S',
+                         'EAST': 'E',
+                         'WEST': 'W',
+                         'STREET': 'ST',
+                         'AVENUE': 'AVE', 'AVENUES': 'AVE', 'AV': 'AVE',
+                         'BOULEVARD': 'BLVD',
+                         'DRIVE': 'DR',
+                         'ROAD': 'RD',
+                         'LANE': 'LN',
+                         'COURT': 'CT',
+                         'PLACE': 'PL',
+                         'PARKWAY': 'PKWY', 'PKY': 'PKWY',
+                         'HIGHWAY': 'HWY',
+                         'CIRCLE': 'CIR',
+                         'TERRACE': 'TER',
+                         'TRAIL': 'TRL',
+                         'SUITE': 'STE'}
+
+
+def normalize_name(names):
+    """
+    Normalizes school names for comparison: upper case ASCII letters and
+    digits, '&' spelled AND and the abbreviations of NAME_ABBREVIATIONS
+    expanded, e.g. 'Agate Jr-Sr High Sch' becomes 'AGATE JUNIOR SENIOR HIGH SCHOOL'.
+    """
+    names = _to_ascii_upper(names).str.replace('&', ' AND ', regex=False)
+    return _replace_words(names, NAME_ABBREVIATIONS)
+
+
+def normalize_address(addresses):
+    """
+    Normalizes street addresses for comparison, abbreviating the directions and
+    street types of ADDRESS_ABBREVIATIONS, e.g. '2883 So. Circle Drive' becomes
+    '2883 S CIRCLE DR'. Unknown addresses such as 'TBD' become empty.
+    """
+    addresses = _replace_words(_to_ascii_upper(addresses), ADDRESS_ABBREVIATIONS)
+    return addresses.where(addresses != 'TBD', '')
+
+
+def school_records(address):
+    """
+    Makes the records linked by resolve_schools.
+
+    Parameters
+    ----------
+    address : DataFrame
+        The tall address dataset with school_id, district_id, school, address,
+        zipcode and year
+
+    Returns
+    -------
+    DataFrame
+        One row per school_id and year, with the normalized name and address
+        and the blocking keys name_key and house_number.
+
+    """
+    records = address.dropna(subset=['school_id', 'year'])
+    records = records.drop_duplicates(['school_id', 'year']).sort_values(['year', 'school_id'])
+    records = records[['school_id', 'year', 'district_id', 'school', 'address', 'zipcode']].reset_index(drop=True)
+    # Keep the 5 digit ZIP code of ZIP+4 codes and codes read as numbers
+    records['zipcode'] = records['zipcode'].astype(str).str.extract(r'^(\d{5})', expand=False)
+
+    records['name'] = normalize_name(records['school'].fillna(''))
+    records['street'] = normalize_address(records['address'].fillna(''))
+    records['name_key'] = records['name'].map(_name_key)
+    records['house_number'] = records['street'].str.extract(r'^(\d+)\b', expand=False)
+    return records
+
+
+def candidate_pairs(records, passes=BLOCKING_PASSES, max_block_size=MAX_BLOCK_SIZE):
+    """
+    The pairs of records of different years that share a block in any pass.
+
+    Parameters
+    ----------
+    records : DataFrame
+        The records made by school_records
+    passes : tuple(tuple(String)), optional
+        The columns of the blocks of each pass. Records with a missing key are
+        not blocked in that pass. The default is BLOCKING_PASSES.
+    max_block_size : int, optional
+        Blocks with more records are skipped. The default is MAX_BLOCK_SIZE.
+
+    Returns
+    -------
+    left, right : np.array
+        The positions of the records of each pair, left before right
+
+    """
+    pairs = []
+    for columns in passes:
+        for positions in records.groupby(list(columns), sort=False).indices.values():
+            if 1 < len(positions) <= max_block_size:
+                left, right = np.triu_indices(len(positions), k=1)
+                pairs.append(np.stack((positions[left], positions[right])))
+    if not pairs:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+
+    # Pairs found in several passes are kept once, by their position in an n x n matrix.
+    # Records are sorted by year, so a pair's left record is the earlier one.
+    left, right = np.divmod(np.unique(np.ravel_multi_index(np.concatenate(pairs, axis=1),
+                                                           (len(records), len(records)))), len(records))
+    years = records['year'].to_numpy()
+    different_years = years[left] != years[right]
+    return left[different_years], right[different_years]
+
+
+def score_pairs(records, left, right):
+    """
+    Scores candidate pairs by the trigram similarity of their names and addresses.
+
+    Returns
+    -------
+    DataFrame
+        The left and right positions of each pair, its name_score,
+        address_score and their weighted score, from the best score down.
+
+    """
+    name_score = trigram_similarity(records['name'], left, right)
+    address_score = trigram_similarity(records['street'], left, right)
+    scores = pd.DataFrame({'left': left, 'right': right,
+                           'name_score': name_score, 'address_score': address_score,
+                           'score': NAME_WEIGHT * name_score + ADDRESS_WEIGHT * address_score})
+    return scores.sort_values('score', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def trigram_similarity(strings, left, right):
+    """ The Jaccard similarity of the character trigrams of the strings of each pair, 0 when either is empty """
+    trigrams = trigram_matrix(strings)
+    shared = np.asarray(trigrams[left].multiply(trigrams[right]).sum(axis=1)).ravel()
+    counts = np.asarray(trigrams.sum(axis=1)).ravel()
+    union = counts[left] + counts[right] - shared
+    return np.divide(shared, union, out=np.zeros(len(left)), where=union > 0)
+
+
+def trigram_matrix(strings):
+    """ A sparse matrix with a row per string and a 1 for each distinct trigram of the padded string """
+    vocabulary, rows, cols = {}, [], []
+    for row, string in enumerate(strings):
+        if not string:
+            continue
+        padded = f'  {string} '
+        for trigram in {padded[i:i + 3] for i in range(len(padded) - 2)}:
+            rows.append(row)
+            cols.append(vocabulary.setdefault(trigram, len(vocabulary)))
+    return sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(strings), max(len(vocabulary), 1)))
+
+
+def link_records(records, scores, match_threshold=MATCH_THRESHOLD, same_id_threshold=SAME_ID_THRESHOLD):
+    """
+    Clusters the records by linking the scored pairs from the best score down.
+
+    A pair is linked when its score is over same_id_threshold for records of
+    the same school_id, or over match_threshold otherwise, and its clusters are
+    never present in the same year.
+
+    Returns
+    -------
+    np.array
+        The cluster of each record, the position of one of its records
+
+    """
+    parent = np.arange(len(records))
+    # The years of each cluster as bits, kept at the cluster's root
+    year_codes = pd.factorize(records['year'])[0]
+    years = [1 << int(code) for code in year_codes]
+    school_ids = records['school_id'].to_numpy()
+
+    def find(position):
+        root = position
+        while parent[root] != root:
+            root = parent[root]
+        # Path compression
+        while parent[position] != root:
+            parent[position], position = root, parent[position]
+        return root
+
+    for left, right, score in zip(scores['left'], scores['right'], scores['score']):
+        threshold = same_id_threshold if school_ids[left] == school_ids[right] else match_threshold
+        if score < threshold:
+            continue
+        left_root, right_root = find(left), find(right)
+        if left_root == right_root or years[left_root] & years[right_root]:
+            continue
+        parent[right_root] = left_root
+        years[left_root] |= years[right_root]
+
+    return np.array([find(position) for position in range(len(records))])
+
+
+def resolve_schools(address, match_threshold=MATCH_THRESHOLD, same_id_threshold=SAME_ID_THRESHOLD):
+    """
+    Gives every school-year of the address dataset a key of its school across years.
+
+    Parameters
+    ----------
+    address : DataFrame
+        The tall address dataset made by make_school_address
+    match_threshold, same_id_threshold : float, optional
+        The scores over which records are linked, see link_records
+
+    Returns
+    -------
+    DataFrame
+        school_id, year, district_id, school, zipcode and entity_id, the
+        school_id and year of the earliest record of the school as
+        '{school_id}-{year}'. The key of a school only changes when it is
+        linked to an earlier record.
+
+    """
+    records = school_records(address)
+    left, right = candidate_pairs(records)
+    clusters = link_records(records, score_pairs(records, left, right), match_threshold, same_id_threshold)
+
+    # Records are sorted by year and school_id, so the first of a cluster is its earliest
+    first = pd.Series(np.arange(len(records))).groupby(clusters).transform('min').to_numpy()
+    entities = records[['school_id', 'year', 'district_id', 'school', 'zipcode']].copy()
+    entities['entity_id'] = (records['school_id'].astype('int64').astype(str).to_numpy()[first] + '-'
+                             + records['year'].astype('int64').astype(str).to_numpy()[first])
+    return entities
+
+
+def make_school_entities(address, output_filepath):
+    """ Resolves the schools of the address dataset and saves them as ENTITIES_FILENAME in output_filepath """
+    entities = resolve_schools(address)
+    entities.to_csv(append_path(output_filepath, ENTITIES_FILENAME), index=False)
+    return entities
+
+
+def _to_ascii_upper(strings):
+    """ Upper case ASCII letters, digits, '&' and single spaces, with accents removed """
+    strings = strings.astype(str).str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii')
+    strings = strings.str.upper().str.replace(r'[^A-Z0-9&]+', ' ', regex=True)
+    return strings.str.strip()
+
+
+def _replace_words(strings, replacements):
+    """ Replaces the whole words of strings that are keys of replacements """
+    pattern = re.compile(r'\b(' + '|'.join(map(re.escape, replacements)) + r')\b')
+    strings = strings.str.replace(pattern, lambda match: replacements[match.group(1)], regex=True)
+    return strings.str.replace(r'\s+', ' ', regex=True).str.strip()
+
+
+def _name_key(name):
+    """ The first distinctive word of a normalized name, or its first word when all are generic """
+    words = name.split()
+    distinctive = [word for word in words if word not in GENERIC_NAME_WORDS]
+    return (distinctive or words or [np.nan])[0]
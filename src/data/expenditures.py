@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Single-pass parser for the CDE Comparison of All Program Expenditures sheets.
+
+The sheets are laid out in blocks under a multi-row header:
+
+    ,COUNTY,BOCES,Services,...              <- last header row
+    ,ADAMS,MAPLETON 1,,,,,                  <- block header: county, name
+    $ ,Amount,,"39,962,942",...             <- totals of each category
+    $ ,Per Pupil,"7,193.3 "," 5,556 ",...   <- funded pupil count, per pupil amounts
+    % ,All Funds,,57.6 ,...                 <- share of each category in percent
+
+BOCES blocks have no county and no Per Pupil row. The sheet ends with
+DISTRICT TOTALS, BOCES TOTALS and STATE TOTALS blocks. The parser reads one
+row at a time and only holds the current block, so files of any size, such
+as several yearly sheets exported into a single file, are parsed in constant
+memory.
+"""
+import csv
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import pandas as pd
+
+# The expenditure categories in the order of the value columns
+CATEGORIES = ('instruction', 'support', 'community', 'other', 'sum')
+# The measures of each category
+MEASURES = ('total', 'per_pupil', 'share')
+# The sections a block can belong to
+SECTIONS = ('district', 'boces', 'total')
+# The columns of read_expenditures
+COLUMNS = (['district_name', 'county', 'section', 'year', 'fpc']
+           + [f'{category}_{measure}' for measure in MEASURES for category in CATEGORIES])
+
+# The parser states
+HEADER = 'header'
+BLOCK = 'block'
+
+
+@dataclass
+class ExpenditureRecord:
+    """ The expenditures of a district, BOCES or total block """
+    section: str
+    county: str
+    district_name: str
+    year: int = None
+    # The funded pupil count
+    fpc: float = None
+    # Maps each category to its total, per pupil amount and percent share
+    total: dict = field(default_factory=dict)
+    per_pupil: dict = field(default_factory=dict)
+    share: dict = field(default_factory=dict)
+
+
+    def to_row(self):
+        """ A flat dict with one column per category and measure, such as instruction_total """
+        row = {'district_name': self.district_name, 'county': self.county,
+               'section': self.section, 'year': self.year, 'fpc': self.fpc}
+        for measure in MEASURES:
+            values = getattr(self, measure)
+            for category in CATEGORIES:
+                row[f'{category}_{measure}'] = values.get(category)
+        return row
+
+
+class ExpenditureParser:
+    """ A state machine that turns the rows of an expenditure sheet into records """
+
+    def __init__(self, year=None):
+        self.year = year
+        self.state = HEADER
+        # The block being read
+        self.record = None
+
+
+    def feed(self, row):
+        """
+        Reads a row of the sheet.
+
+        Returns
+        -------
+        ExpenditureRecord
+            The previous block when row starts a new one, otherwise None.
+
+        """
+        cells = [cell.strip() for cell in row] + [''] * (3 + len(CATEGORIES) - len(row))
+        label = cells[1].lower()
+
+        # A header row, which may repeat when several sheets are exported together
+        if cells[2].upper() == 'DISTRICT/':
+            finished = self.close()
+            self.state = HEADER
+            return finished
+        if self.state == HEADER:
+            # The last header row names the county column
+            if cells[1].upper() == 'COUNTY':
+                self.state = BLOCK
+            return None
+
+        # Blank separator rows
+        if not any(cells):
+            return None
+
+        values = [parse_number(cell) for cell in cells[3:3 + len(CATEGORIES)]]
+        if label == 'amount' and self.record is not None:
+            self.record.total = dict(zip(CATEGORIES, values))
+        elif label == 'per pupil' and self.record is not None:
+            self.record.fpc = parse_number(cells[2])
+            self.record.per_pupil = dict(zip(CATEGORIES, values))
+        elif label == 'all funds' and self.record is not None:
+            self.record.share = dict(zip(CATEGORIES, values))
+        else:
+            # A block header starts the next block
+            finished = self.close()
+            self.record = ExpenditureRecord(_section(cells[1], cells[2]), cells[1] or None,
+                                            cells[2] or cells[1], self.year)
+            return finished
+
+        return None
+
+
+    def close(self):
+        """ Returns the block being read, if any, and forgets it """
+        record, self.record = self.record, None
+        return record
+
+
+def parse_expenditures(filepath, year=None, sections=SECTIONS):
+    """
+    Yields a record per block of an expenditure sheet.
+
+    Parameters
+    ----------
+    filepath : str, Path
+        The expenditures csv file
+    year : int, optional
+        The year added to every record. The default is None.
+    sections : tuple(String), optional
+        The sections to yield from 'district', 'boces' and 'total'.
+        The default is SECTIONS or all of them.
+
+    Yields
+    ------
+    ExpenditureRecord
+
+    """
+    parser = ExpenditureParser(year)
+    with open(filepath, newline='', encoding='utf-8-sig') as f:
+        for row in csv.reader(f):
+            record = parser.feed(row)
+            if record is not None and record.section in sections:
+                yield record
+
+    record = parser.close()
+    if record is not None and record.section in sections:
+        yield record
+
+
+def read_expenditures(filepath, year=None, sections=('district',), dtype_backend='numpy_nullable'):
+    """
+    Parses an expenditure sheet into a DataFrame with one row per block.
+    The column types are inferred with the given dtype_backend.
+
+    Returns
+    -------
+    DataFrame
+        The district_name, county, section, year, fpc and the total,
+        per_pupil and share of each category.
+
+    """
+    rows = [record.to_row() for record in parse_expenditures(filepath, year, sections)]
+    return pd.DataFrame(rows, columns=COLUMNS).convert_dtypes(dtype_backend=dtype_backend)
+
+
+def parse_number(cell):
+    """
+    Converts a cell such as '39,962,942', ' 5,556 ' or '(4)' to a number.
+    Empty cells and errors such as '#DIV/0!' are None.
+    """
+    cell = cell.strip().replace(',', '')
+    negative = cell.startswith('(') and cell.endswith(')')
+    if negative:
+        cell = cell[1:-1]
+
+    try:
+        number = float(cell)
+    except ValueError:
+        return None
+
+    if number.is_integer() and '.' not in cell:
+        number = int(number)
+    return -number if negative else number
+
+
+def _section(county, name):
+    """ The section of a block from its header row """
+    if not name and county.upper().endswith('TOTALS'):
+        return 'total'
+    if not county or 'BOCES' in name.upper():
+        return 'boces'
+    return 'district'
+
+
+if __name__ == '__main__':
+    project_dir = Path(__file__).resolve().parents[2]
+    input_filepath = project_dir.joinpath('data/raw/expenditures/expenditures2012.csv')
+
+    print(read_expenditures(input_filepath, 2012))
@@ -1,18 +1,15 @@
 # -*- coding: utf-8 -*-
+"""
+Downloads the raw census and kaggle data.
+
+The network clients are imported when a download starts rather than with
+the module. Some versions of the kaggle package authenticate on import, which
+needs network access and credentials even when nothing is downloaded.
+"""
 from pathlib import Path
 
 # Access environment variables
-from dotenv import load_dotenv
 import os
-load_dotenv()
-
-# Census API
-import requests # to request census data
-from requests import HTTPError
-import pandas as pd # to save api json as csv
-
-# Kaggle API
-from kaggle.api.kaggle_api_extended import KaggleApi
 import zipfile # to unzip all files from kaggle
 
 
@@ -51,7 +48,7 @@ def append_path(path, addition):
     return path.joinpath(addition)
 
 
-def get_census(output_filepath):
+def get_census(output_filepath, state='08', years=CENSUS_YEARS):
     """
     Obtains census data from the its api. 
     For more information, refer to https://api.census.gov/data/timeseries/poverty/saipe/schdist.html
@@ -60,24 +57,35 @@ def get_census(output_filepath):
     ----------
     output_filepath : str, Path
         the directory to save files in.
+    state : String, optional
+        the FIPS code of the state to request. The default is '08' or Colorado.
+    years : tuple(int), optional
+        the years to request. The default is CENSUS_YEARS.
 
     Returns
     -------
     None.
 
     """
+    # Census API
+    import requests # to request census data
+    from requests import HTTPError
+    import pandas as pd # to save api json as csv
+    
     # Census API params
     # find .env automagically by walking up directories until it's found, then
     # load up the .env entries as environment variables
+    _load_dotenv()
 
     url = os.getenv('CENSUS_URL') # url to request saipe info
     key = os.getenv('CENSUS_KEY')
     
-    CENSUS_PARAMS['key'] = key
+    # Copy the params so that states can be requested concurrently
+    params = {**CENSUS_PARAMS, 'in': f'state:{state}', 'key': key}
     # Create a dataframe for each year requested
-    for time in CENSUS_YEARS:
-        CENSUS_PARAMS['time'] = time # establish time parameter
-        with requests.get(url, CENSUS_PARAMS) as response:
+    for time in years:
+        params['time'] = time # establish time parameter
+        with requests.get(url, params) as response:
             try:
                 # check for correct response code
                 response.raise_for_status()
@@ -92,7 +100,32 @@ def get_census(output_filepath):
             
             # catches failed response codes
             except HTTPError:
-                print(f'{time=} request failed with {response.status_code=}')
+                print(f'{state=} {time=} request failed with {response.status_code=}')
+
+
+def get_census_states(output_filepath, states, years=CENSUS_YEARS):
+    """
+    Obtains the census data of several states, saving each state in its own
+    directory named after its FIPS code such as output_filepath/06.
+
+    Parameters
+    ----------
+    output_filepath : str, Path
+        the directory to save the state directories in.
+    states : iterable(String)
+        the FIPS codes of the states to request.
+    years : tuple(int), optional
+        the years to request. The default is CENSUS_YEARS.
+
+    Returns
+    -------
+    None.
+
+    """
+    for state in states:
+        state_filepath = Path(append_path(output_filepath, state))
+        state_filepath.mkdir(parents=True, exist_ok=True)
+        get_census(state_filepath, state, years)
             
         
 def get_kaggle(output_filepath):
@@ -110,6 +143,10 @@ def get_kaggle(output_filepath):
     None.
 
     """
+    # Kaggle API
+    _load_dotenv()
+    from kaggle.api.kaggle_api_extended import KaggleApi
+    
     KAGGLE_key = os.getenv('KAGGLE_key')
     KAGGLE_username = os.getenv('KAGGLE_username')
     # Create a connection to the kaggle api
@@ -125,6 +162,12 @@ def get_kaggle(output_filepath):
         zipref.extractall(output_filepath)
     
 
+def _load_dotenv():
+    """ Loads the .env entries as environment variables, before the kaggle API reads them """
+    from dotenv import load_dotenv
+    load_dotenv()
+    
+
 def main(output_filepath):
     """
     Makes requests to download files and save them in project_dir/data/raw
@@ -5,6 +5,8 @@ Created on Mon Jul 10 20:29:54 2023
 @author: caeley
 """
 from pathlib import Path
+import shutil
+import pandas as pd
 
 def append_path(path, addition):
     """
@@ -68,3 +70,237 @@ def create_filenames(filepath, file_extension='{year}', years=(2010,2011,2012)):
         raise ValueError('{year} must be in the file_extension')
     
     return [append_path(filepath, file_extension.format(year=year)) for year in years]
+
+
+def append_csv(df, filepath):
+    """
+    Appends a DataFrame to a csv file without reading the rows already in it.
+    The columns are aligned to the existing header. When df has columns that
+    are not in the file, the file is rewritten with the union of the columns.
+
+    Parameters
+    ----------
+    df : DataFrame
+        The rows to append
+    filepath : str, Path
+        The csv file. It is created if it does not exist.
+
+    Returns
+    -------
+    None.
+
+    """
+    if not Path(filepath).exists():
+        df.to_csv(filepath, index=False)
+        return
+    
+    header = list(pd.read_csv(filepath, nrows=0).columns)
+    if set(df.columns) - set(header):
+        existing = pd.read_csv(filepath)
+        pd.concat((existing, df)).to_csv(filepath, index=False)
+        return
+    
+    df.reindex(columns=header).to_csv(filepath, mode='a', header=False, index=False)
+
+
+# The directory name used for missing partition values
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+
+def to_numeric(col):
+    """
+    Converts a column to float64. Text numbers such as ' 6,022 ' are converted,
+    other text is missing, and values that are already numbers are kept.
+
+    Parameters
+    ----------
+    col : Series
+        The column to convert
+
+    Returns
+    -------
+    Series
+        The float64 values with the index of col.
+
+    """
+    if pd.api.types.is_object_dtype(col) or pd.api.types.is_string_dtype(col):
+        # Numbers in an object column are written as text first, so they are
+        # not lost by the string methods
+        col = col.astype('string').str.replace(',', '', regex=False).str.strip()
+    return pd.to_numeric(col, errors='coerce').astype('float64')
+
+
+def write_partitioned(df, root, partition_cols=('year', 'district_id'), file_format='csv',
+                      replace=True):
+    """
+    Saves a DataFrame in a Hive-style partitioned layout such as
+    root/year=2011/district_id=880/part.csv. The partition columns are stored
+    in the directory names and not in the files.
+    
+    Only the top-level partitions present in df are rewritten, so saving
+    a single year does not touch the files of the other years.
+
+    Parameters
+    ----------
+    df : DataFrame
+        The DataFrame to save
+    root : str, Path
+        The directory of the partitioned dataset
+    partition_cols : tuple(String), optional
+        The columns to partition by, outermost first. Columns that are not in
+        df are skipped. The default is ('year', 'district_id').
+    file_format : String, optional
+        'csv' or 'parquet'. The default is 'csv'.
+    replace : bool, optional
+        Remove the top-level partitions present in df before writing. When
+        False only the innermost partitions of df are overwritten, which lets
+        df be written in pieces that do not share innermost partitions.
+        The default is True.
+
+    Returns
+    -------
+    None.
+
+    """
+    if file_format not in ('csv', 'parquet'):
+        raise ValueError("file_format must be 'csv' or 'parquet'")
+    partition_cols = [col for col in partition_cols if col in df.columns]
+    if not partition_cols:
+        raise ValueError('df must contain at least one of the partition_cols')
+    
+    root = Path(root)
+    # Remove the partitions that are being replaced
+    if replace:
+        for value in df[partition_cols[0]].drop_duplicates():
+            partition_dir = root.joinpath(_partition_name(partition_cols[0], value))
+            if partition_dir.exists():
+                shutil.rmtree(partition_dir)
+    
+    for values, partition in df.groupby(partition_cols, dropna=False, sort=False):
+        if len(partition_cols) == 1:
+            values = (values[0] if isinstance(values, tuple) else values,)
+        partition_dir = root.joinpath(*[_partition_name(col, value) 
+                                        for col, value in zip(partition_cols, values)])
+        partition_dir.mkdir(parents=True, exist_ok=True)
+        
+        partition = partition.drop(partition_cols, axis=1)
+        if file_format == 'csv':
+            partition.to_csv(partition_dir.joinpath('part.csv'), index=False)
+        else:
+            partition.to_parquet(partition_dir.joinpath('part.parquet'), index=False)
+
+
+def read_partitioned(root, filters=None, columns=None, dtype_backend=None):
+    """
+    Reads a dataset saved by write_partitioned. Directories that do not match
+    the filters are skipped without being read.
+
+    Parameters
+    ----------
+    root : str, Path
+        The directory of the partitioned dataset
+    filters : dict, optional
+        Maps column names to a value or a list of accepted values.
+        The default is None or read every partition.
+    columns : list(String), optional
+        The columns to read. The default is None or all columns.
+    dtype_backend : String, optional
+        The dtype_backend of read_csv. The default is None or numpy types.
+
+    Returns
+    -------
+    DataFrame
+        The matching rows with the partition columns restored.
+
+    """
+    frames = list(iter_partitioned(root, filters, columns, dtype_backend))
+    
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    
+    df = pd.concat(frames, ignore_index=True)
+    if dtype_backend is not None:
+        # The partition columns are restored with numpy types, the read columns keep theirs
+        df = df.convert_dtypes(dtype_backend=dtype_backend, convert_floating=False)
+    if columns is not None:
+        df = df[[col for col in columns if col in df.columns]]
+    return df
+
+
+def iter_partitioned(root, filters=None, columns=None, dtype_backend=None):
+    """
+    Yields the matching rows of each partition of a dataset saved by
+    write_partitioned, so that it can be processed one partition at a time.
+    The parameters are the same as read_partitioned.
+    """
+    filters = {col: values if isinstance(values, (list, tuple, set)) else [values]
+               for col, values in (filters or {}).items()}
+    
+    for partition_file, partition_values in _find_partitions(Path(root), filters, {}):
+        file_columns = None
+        if columns is not None:
+            file_columns = [col for col in columns if col not in partition_values]
+            
+        options = {} if dtype_backend is None else {'dtype_backend': dtype_backend}
+        if partition_file.suffix == '.parquet':
+            df = pd.read_parquet(partition_file, columns=file_columns, **options)
+        else:
+            # Floats are read back exactly as they were written
+            df = pd.read_csv(partition_file, float_precision='round_trip',
+                             usecols=lambda col: file_columns is None or col in file_columns, **options)
+        
+        # Filters on columns inside the files are applied after reading
+        for col, values in filters.items():
+            if col in df.columns:
+                df = df[df[col].isin(values)]
+        for col, value in partition_values.items():
+            df[col] = value
+        yield df
+
+
+def partition_columns(root):
+    """ Returns the partition column names and the file columns of a partitioned dataset """
+    partition_file, partition_values = next(_find_partitions(Path(root), {}, {}))
+    if partition_file.suffix == '.parquet':
+        import pyarrow.parquet as pq
+        file_columns = list(pq.read_schema(partition_file).names)
+    else:
+        file_columns = list(pd.read_csv(partition_file, nrows=0).columns)
+    
+    return list(partition_values), file_columns
+
+
+def _find_partitions(directory, filters, partition_values):
+    """ Yields every data file under directory whose partition values match the filters """
+    for path in sorted(directory.iterdir()):
+        if path.is_file() and path.suffix in ('.csv', '.parquet'):
+            yield path, partition_values
+        elif path.is_dir() and '=' in path.name:
+            col, value = path.name.split('=', 1)
+            value = _parse_partition_value(value)
+            # Partition pruning
+            if col in filters and value not in filters[col]:
+                continue
+            yield from _find_partitions(path, filters, {**partition_values, col: value})
+
+
+def _partition_name(col, value):
+    """ The directory name of a partition """
+    if pd.isna(value):
+        return f'{col}={NULL_PARTITION}'
+    # Whole floats such as district_id 880.0 are written as integers
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return f'{col}={value}'
+
+
+def _parse_partition_value(value):
+    """ Converts a partition directory value back to a number when possible """
+    if value == NULL_PARTITION:
+        return None
+    for converter in (int, float):
+        try:
+            return converter(value)
+        except ValueError:
+            pass
+    return value
@@ -5,13 +5,14 @@ Created on Thu Feb 16 13:02:25 2023
 @author: caeley
 """
 from pathlib import Path
-from makers import DataFrameSet
-import makers
-from combine_datasets import combine_datasets
-from input_output_functions import append_path, create_filenames
+from src.data.makers import DataFrameSet
+from src.data import makers
+from src.data.combine_datasets import combine_datasets, append_combined_datasets
+from src.data.input_output_functions import append_path, create_filenames
 
 
-def make_datasets(input_filepath, output_filepath):
+def make_datasets(input_filepath, output_filepath, years=(2010, 2011, 2012), jobs=1,
+                  partitioned=False, dtype_backend='numpy_nullable', engine='pandas'):
     """
     Transforms raw data into usable data saved as interim
 
@@ -19,6 +20,19 @@ def make_datasets(input_filepath, output_filepath):
     ----------
     output_filepath : str, Path, optional
         The directory to save files in. The default is './'.
+    years : tuple(int), optional
+        The years to transform. The default is (2010, 2011, 2012).
+    jobs : int, optional
+        The number of worker processes per dataset. The default is 1.
+    partitioned : bool, optional
+        Save the tall and combined data partitioned by year and district_id.
+        The default is False.
+    dtype_backend : String, optional
+        'numpy_nullable' or 'pyarrow', the backend of the column types.
+        The default is 'numpy_nullable'.
+    engine : String, optional
+        'pandas' or 'polars', the engine of the makers with a Polars
+        translation. The default is 'pandas'.
 
     Returns
     -------
@@ -26,15 +40,72 @@ def make_datasets(input_filepath, output_filepath):
 
     """
     census = make_census(append_path(input_filepath, 'census'), 
-                      append_path(output_filepath, 'census'))
+                      append_path(output_filepath, 'census'),
+                      years, jobs, partitioned=partitioned, dtype_backend=dtype_backend, engine=engine)
     exp = make_expenditures(append_path(input_filepath, 'expenditures'), 
-                            append_path(output_filepath, 'expenditures'))
+                            append_path(output_filepath, 'expenditures'),
+                            years, jobs, partitioned=partitioned, dtype_backend=dtype_backend, engine=engine)
     kaggle = make_kaggle(append_path(input_filepath,'kaggle'), 
-                     append_path(output_filepath,'kaggle'))
+                     append_path(output_filepath,'kaggle'),
+                     years, jobs, partitioned=partitioned, dtype_backend=dtype_backend, engine=engine)
     
     # Combine datasets
     change, coact, enroll, final, frl, remediation, address = kaggle    
-    combined_datasets = combine_datasets(input_filepath, output_filepath, census, exp, kaggle)
+    combined_datasets = combine_datasets(input_filepath, output_filepath, census, exp, kaggle,
+                                         partitioned=partitioned)
+    
+    return census, exp, kaggle, combined_datasets
+
+
+def append_year(input_filepath, output_filepath, year, jobs=1, partitioned=False,
+                dtype_backend='numpy_nullable', engine='pandas'):
+    """
+    Transforms the raw data of a single new year and appends it to the
+    existing interim data. Only the new year's raw files are read and only its
+    rows of the combined datasets are computed, so the cost does not grow with
+    the number of years already processed.
+
+    Parameters
+    ----------
+    input_filepath : str, Path
+        The raw directory
+    output_filepath : str, Path
+        The interim directory that already holds the earlier years
+    year : int
+        The year to add
+    jobs : int, optional
+        The number of worker processes per dataset. The default is 1.
+    partitioned : bool, optional
+        Whether the interim data is partitioned by year and district_id.
+        The default is False.
+    dtype_backend : String, optional
+        'numpy_nullable' or 'pyarrow', the backend of the column types.
+        The default is 'numpy_nullable'.
+    engine : String, optional
+        'pandas' or 'polars', the engine of the makers with a Polars
+        translation. The default is 'pandas'.
+
+    Returns
+    -------
+    None.
+
+    """
+    years = (year,)
+    census = make_census(append_path(input_filepath, 'census'), 
+                         append_path(output_filepath, 'census'),
+                         years, jobs, append=True, partitioned=partitioned,
+                         dtype_backend=dtype_backend, engine=engine)
+    exp = make_expenditures(append_path(input_filepath, 'expenditures'), 
+                            append_path(output_filepath, 'expenditures'),
+                            years, jobs, append=True, partitioned=partitioned,
+                            dtype_backend=dtype_backend, engine=engine)
+    kaggle = make_kaggle(append_path(input_filepath,'kaggle'), 
+                         append_path(output_filepath,'kaggle'),
+                         years, jobs, append=True, partitioned=partitioned,
+                         dtype_backend=dtype_backend, engine=engine)
+    
+    combined_datasets = append_combined_datasets(input_filepath, output_filepath, census, exp, kaggle,
+                                                 partitioned)
     
     return census, exp, kaggle, combined_datasets
     
@@ -87,7 +158,8 @@ def make_datasets(input_filepath, output_filepath):
 
 
 
-def make_census(input_filepath, output_filepath, years=(2010, 2011, 2012)):
+def make_census(input_filepath, output_filepath, years=(2010, 2011, 2012), jobs=1, append=False,
+                partitioned=False, state=None, dtype_backend='numpy_nullable', engine='pandas'):
     """
     Transforms raw census data into usable tall interim data.
     The input filepath must contain saipe datasets that
@@ -100,26 +172,49 @@ def make_census(input_filepath, output_filepath, years=(2010, 2011, 2012)):
         the directory to obtain files from
     output_filepath : str, Path
         the directory to save files in
+    years : tuple(int), optional
+        the years to transform. The default is (2010, 2011, 2012).
+    jobs : int, optional
+        the number of worker processes. The default is 1.
+    append : bool, optional
+        append the years to the existing tall file instead of overwriting it.
+        The default is False.
+    partitioned : bool, optional
+        save the tall data partitioned by year and district_id instead of as a
+        single file. The default is False.
+    state : String, optional
+        the FIPS code of the state of the files. When given, the state and
+        census district id columns are kept. The default is None.
+    dtype_backend : String, optional
+        'numpy_nullable' or 'pyarrow', the backend of the column types.
+        The default is 'numpy_nullable'.
+    engine : String, optional
+        'pandas' or 'polars', the engine of the makers with a Polars
+        translation. The default is 'pandas'.
 
     Returns
     -------
     None.
     """
     # Input and output locations
-    input_filenames = create_filenames(input_filepath, 'saipe{year}.csv')
-    output_filenames = create_filenames(output_filepath, 'saipe{year}.csv')
+    input_filenames = create_filenames(input_filepath, 'saipe{year}.csv', years)
+    output_filenames = create_filenames(output_filepath, 'saipe{year}.csv', years)
     
     # MakeDatasets
-    dataframes = DataFrameSet(input_filenames, output_filenames, makers.CensusMaker)
+    maker = makers.CensusMaker if state is None else makers.StateCensusMaker
+    dataframes = DataFrameSet(input_filenames, output_filenames, maker, jobs=jobs,
+                              dtype_backend=dtype_backend, engine=engine)
     dataframes.make_dataframes()
     
     tall_filepath = append_path(output_filepath, 'tall_saipe.csv')
-    return dataframes.make_tall(id_col=years, filepath=tall_filepath)
+    return dataframes.make_tall(id_col=years, filepath=tall_filepath, append=append,
+                                partitioned=partitioned)
     
 
 
 
-def make_expenditures(input_filepath, output_filepath, years=(2010, 2011, 2012)):
+def make_expenditures(input_filepath, output_filepath, years=(2010, 2011, 2012), jobs=1, append=False,
+                      partitioned=False, streaming=False, dtype_backend='numpy_nullable', engine='pandas'):
     """
     Transforms all expenditures datasets that must be Comparison of All 
     Program Expenditures (All Funds) directly downloaded from
@@ -132,6 +227,26 @@ def make_expenditures(input_filepath, output_filepath, years=(2010, 2011, 2012))
         the directory to obtain files from
     output_filepath : str, Path
         the directory to save files in
+    years : tuple(int), optional
+        the years to transform. The default is (2010, 2011, 2012).
+    jobs : int, optional
+        the number of worker processes. The default is 1.
+    append : bool, optional
+        append the years to the existing tall file instead of overwriting it.
+        The default is False.
+    partitioned : bool, optional
+        save the tall data partitioned by year and district_id instead of as a
+        single file. The default is False.
+    streaming : bool, optional
+        parse the sheets block by block with ExpenditureBlockMaker, which also
+        keeps the funded pupil count and the share of each category.
+        The default is False.
+    dtype_backend : String, optional
+        'numpy_nullable' or 'pyarrow', the backend of the column types.
+        The default is 'numpy_nullable'.
+    engine : String, optional
+        'pandas' or 'polars', the engine of the makers with a Polars
+        translation. The default is 'pandas'.
 
     Returns
     -------
@@ -139,21 +254,58 @@ def make_expenditures(input_filepath, output_filepath, years=(2010, 2011, 2012))
 
     """
     # Input and output locations    
-    input_filenames = create_filenames(input_filepath, 'expenditures{year}.csv')
-    output_filenames = create_filenames(output_filepath, 'expenditures{year}.csv')
+    input_filenames = create_filenames(input_filepath, 'expenditures{year}.csv', years)
+    output_filenames = create_filenames(output_filepath, 'expenditures{year}.csv', years)
     
     # Make datasets
-    datasets = DataFrameSet(input_filenames, output_filenames, makers.ExpenditureMaker)
+    maker = makers.ExpenditureBlockMaker if streaming else makers.ExpenditureMaker
+    datasets = DataFrameSet(input_filenames, output_filenames, maker, jobs=jobs,
+                            dtype_backend=dtype_backend, engine=engine)
     datasets.make_dataframes()
     
     tall_filepath = append_path(output_filepath, 'tall_expenditures.csv')
-    return datasets.make_tall(id_col=years, filepath=tall_filepath)
+    return datasets.make_tall(id_col=years, filepath=tall_filepath, append=append,
+                              partitioned=partitioned)
+
+
+def make_programs(input_filepath, output_filepath, years=(2010, 2011, 2012), code_cols=('program',)):
+    """
+    Builds the sparse district-year by program code expenditure matrix from the
+    chart of accounts detail files downloaded from
+    https://www.cde.state.co.us/cdefinance/RevExp and saved as programs{year}.csv
+
+    Parameters
+    ----------
+    input_filepath : str, Path
+        the directory to obtain files from
+    output_filepath : str, Path
+        the directory to save the matrix in
+    years : tuple(int), optional
+        the years to read. The default is (2010, 2011, 2012).
+    code_cols : tuple(String), optional
+        the detail columns making up the code of a matrix column, such as
+        ('program', 'object'). The default is ('program',).
+
+    Returns
+    -------
+    ProgramMatrix
+
+    """
+    # scipy is only imported when the program matrix is built
+    from src.data.programs import build_program_matrix
+
+    input_filenames = create_filenames(input_filepath, 'programs{year}.csv', years)
+
+    program_matrix = build_program_matrix(input_filenames, years, code_cols=code_cols)
+    program_matrix.save(output_filepath)
+    return program_matrix
     
     
 
 
 
-def make_kaggle(input_filepath, output_filepath, years=(2010, 2011, 2012)):
+def make_kaggle(input_filepath, output_filepath, years=(2010, 2011, 2012), jobs=1, append=False,
+                partitioned=False, dtype_backend='numpy_nullable', engine='pandas'):
     """
     Transforms each kaggle raw dataset into individual usable tall interim data
     
@@ -163,6 +315,22 @@ def make_kaggle(input_filepath, output_filepath, years=(2010, 2011, 2012)):
         the directory to obtain files from
     output_filepath : str, Path
         the directory to save files in
+    years : tuple(int), optional
+        the years to transform. The default is (2010, 2011, 2012).
+    jobs : int, optional
+        the number of worker processes. The default is 1.
+    append : bool, optional
+        append the years to the existing tall file instead of overwriting it.
+        The default is False.
+    partitioned : bool, optional
+        save the tall data partitioned by year and district_id instead of as a
+        single file. The default is False.
+    dtype_backend : String, optional
+        'numpy_nullable' or 'pyarrow', the backend of the column types.
+        The default is 'numpy_nullable'.
+    engine : String, optional
+        'pandas' or 'polars', the engine of the makers with a Polars
+        translation. The default is 'pandas'.
 
     Returns
     -------
@@ -170,17 +338,18 @@ def make_kaggle(input_filepath, output_filepath, years=(2010, 2011, 2012)):
 
     """
     
-    change = make_1yr_3yr_change(input_filepath, output_filepath)
-    coact = make_coact(input_filepath, output_filepath)
-    enroll = make_enrl_working(input_filepath, output_filepath)
-    final = make_final_grade(input_filepath, output_filepath)
-    frl = make_k_12_frl(input_filepath, output_filepath)
-    remediation = make_remediation(input_filepath, output_filepath)
-    address = make_school_address(input_filepath, output_filepath)
+    change = make_1yr_3yr_change(input_filepath, output_filepath, years, jobs, append, partitioned, dtype_backend, engine)
+    coact = make_coact(input_filepath, output_filepath, years, jobs, append, partitioned, dtype_backend, engine)
+    enroll = make_enrl_working(input_filepath, output_filepath, years, jobs, append, partitioned, dtype_backend, engine)
+    final = make_final_grade(input_filepath, output_filepath, years, jobs, append, partitioned, dtype_backend, engine)
+    frl = make_k_12_frl(input_filepath, output_filepath, years, jobs, append, partitioned, dtype_backend, engine)
+    remediation = make_remediation(input_filepath, output_filepath, years, jobs, append, partitioned, dtype_backend, engine)
+    address = make_school_address(input_filepath, output_filepath, years, jobs, append, partitioned, dtype_backend, engine)
     
     return change, coact, enroll, final, frl, remediation, address
 
-def make_1yr_3yr_change(input_filepath, output_filepath, years=(2010, 2011, 2012)):
+def make_1yr_3yr_change(input_filepath, output_filepath, years=(2010, 2011, 2012), jobs=1, append=False,
+                        partitioned=False, dtype_backend='numpy_nullable', engine='pandas'):
     """
     Transforms 1yr_3yr_change datasets downloaded from the kaggle competition
 
@@ -190,6 +359,22 @@ def make_1yr_3yr_change(input_filepath, output_filepath, years=(2010, 2011, 2012
         The input filepath base to extract data from
     output_filepath : String, Path
         The output filepath base to save data to
+    years : tuple(int), optional
+        the years to transform. The default is (2010, 2011, 2012).
+    jobs : int, optional
+        the number of worker processes. The default is 1.
+    append : bool, optional
+        append the years to the existing tall file instead of overwriting it.
+        The default is False.
+    partitioned : bool, optional
+        save the tall data partitioned by year and district_id instead of as a
+        single file. The default is False.
+    dtype_backend : String, optional
+        'numpy_nullable' or 'pyarrow', the backend of the column types.
+        The default is 'numpy_nullable'.
+    engine : String, optional
+        'pandas' or 'polars', the engine of the makers with a Polars
+        translation. The default is 'pandas'.
 
     Returns
     -------
@@ -197,80 +382,100 @@ def make_1yr_3yr_change(input_filepath, output_filepath, years=(2010, 2011, 2012
 
     """
     
-    input_filenames = create_filenames(input_filepath, '{year}_1YR_3YR_change.csv')
-    output_filenames = create_filenames(output_filepath, '1YR_3YR_change{year}.csv')
+    input_filenames = create_filenames(input_filepath, '{year}_1YR_3YR_change.csv', years)
+    output_filenames = create_filenames(output_filepath, '1YR_3YR_change{year}.csv', years)
     
-    datasets = DataFrameSet(input_filenames, output_filenames, makers.ChangeMaker)
+    datasets = DataFrameSet(input_filenames, output_filenames, makers.ChangeMaker, jobs=jobs,
+                            dtype_backend=dtype_backend, engine=engine)
     datasets.make_dataframes()
     
     tall_filepath = append_path(output_filepath, '1YR_3YR_change_tall.csv')
-    return datasets.make_tall(id_col=years, filepath=tall_filepath)
+    return datasets.make_tall(id_col=years, filepath=tall_filepath, append=append,
+                              partitioned=partitioned)
     
 
-def make_coact(input_filepath, output_filepath, years=(2010, 2011, 2012)):
-    input_filenames = create_filenames(input_filepath, '{year}_COACT.csv')    
-    output_filenames = create_filenames(output_filepath, 'COACT{year}.csv')
+def make_coact(input_filepath, output_filepath, years=(2010, 2011, 2012), jobs=1, append=False,
+               partitioned=False, dtype_backend='numpy_nullable', engine='pandas'):
+    input_filenames = create_filenames(input_filepath, '{year}_COACT.csv', years)    
+    output_filenames = create_filenames(output_filepath, 'COACT{year}.csv', years)
     
-    datasets = DataFrameSet(input_filenames, output_filenames, makers.CoactMaker)
+    datasets = DataFrameSet(input_filenames, output_filenames, makers.CoactMaker, jobs=jobs,
+                            dtype_backend=dtype_backend, engine=engine)
     datasets.make_dataframes()
     
     tall_filepath = append_path(output_filepath, 'COACT_tall.csv')
-    return datasets.make_tall(id_col=years, filepath=tall_filepath)
+    return datasets.make_tall(id_col=years, filepath=tall_filepath, append=append,
+                              partitioned=partitioned)
     
-def make_enrl_working(input_filepath, output_filepath, years=(2010, 2011, 2012)):
-    input_filenames = create_filenames(input_filepath, '{year}_enrl_working.csv')    
-    output_filenames = create_filenames(output_filepath, 'enrl_working{year}.csv')
+def make_enrl_working(input_filepath, output_filepath, years=(2010, 2011, 2012), jobs=1, append=False,
+                      partitioned=False, dtype_backend='numpy_nullable', engine='pandas'):
+    input_filenames = create_filenames(input_filepath, '{year}_enrl_working.csv', years)    
+    output_filenames = create_filenames(output_filepath, 'enrl_working{year}.csv', years)
     
-    datasets = DataFrameSet(input_filenames, output_filenames, makers.EnrollMaker)
+    datasets = DataFrameSet(input_filenames, output_filenames, makers.EnrollMaker, jobs=jobs,
+                            dtype_backend=dtype_backend, engine=engine)
     datasets.make_dataframes()
     
     tall_filepath = append_path(output_filepath, 'enrl_working_tall.csv')
-    return datasets.make_tall(id_col=years, filepath=tall_filepath)
+    return datasets.make_tall(id_col=years, filepath=tall_filepath, append=append,
+                              partitioned=partitioned)
     
 
-def make_final_grade(input_filepath, output_filepath, years=(2010, 2011, 2012)):
-    input_filenames = create_filenames(input_filepath, '{year}_final_grade.csv')      
-    output_filenames = create_filenames(output_filepath, 'final_grade{year}.csv')    
+def make_final_grade(input_filepath, output_filepath, years=(2010, 2011, 2012), jobs=1, append=False,
+                     partitioned=False, dtype_backend='numpy_nullable', engine='pandas'):
+    input_filenames = create_filenames(input_filepath, '{year}_final_grade.csv', years)      
+    output_filenames = create_filenames(output_filepath, 'final_grade{year}.csv', years)    
 
-    datasets = DataFrameSet(input_filenames, output_filenames, makers.FinalMaker)
+    datasets = DataFrameSet(input_filenames, output_filenames, makers.FinalMaker, jobs=jobs,
+                            dtype_backend=dtype_backend, engine=engine)
     datasets.make_dataframes()
     
     tall_filepath = append_path(output_filepath, 'final_grade_tall.csv')
-    return datasets.make_tall(id_col=years, filepath=tall_filepath)
+    return datasets.make_tall(id_col=years, filepath=tall_filepath, append=append,
+                              partitioned=partitioned)
 
 
-def make_k_12_frl(input_filepath, output_filepath, years=(2010, 2011, 2012)):
-    input_filenames = create_filenames(input_filepath, '{year}_k_12_FRL.csv')        
-    output_filenames = create_filenames(output_filepath, 'FRL{year}.csv')
+def make_k_12_frl(input_filepath, output_filepath, years=(2010, 2011, 2012), jobs=1, append=False,
+                  partitioned=False, dtype_backend='numpy_nullable', engine='pandas'):
+    input_filenames = create_filenames(input_filepath, '{year}_k_12_FRL.csv', years)        
+    output_filenames = create_filenames(output_filepath, 'FRL{year}.csv', years)
     
-    datasets = DataFrameSet(input_filenames, output_filenames, makers.FrlMaker)
+    datasets = DataFrameSet(input_filenames, output_filenames, makers.FrlMaker, jobs=jobs,
+                            dtype_backend=dtype_backend, engine=engine)
     datasets.make_dataframes()
     
     tall_filepath = append_path(output_filepath, 'FRL_tall.csv')
-    return datasets.make_tall(id_col=years, filepath=tall_filepath)
+    return datasets.make_tall(id_col=years, filepath=tall_filepath, append=append,
+                              partitioned=partitioned)
 
 
-def make_remediation(input_filepath, output_filepath, years=(2010, 2011, 2012)):
+def make_remediation(input_filepath, output_filepath, years=(2010, 2011, 2012), jobs=1, append=False,
+                     partitioned=False, dtype_backend='numpy_nullable', engine='pandas'):
     
-    input_filenames = create_filenames(input_filepath, '{year}_remediation_HS.csv')      
-    output_filenames = create_filenames(output_filepath, 'remediation{year}.csv')
+    input_filenames = create_filenames(input_filepath, '{year}_remediation_HS.csv', years)      
+    output_filenames = create_filenames(output_filepath, 'remediation{year}.csv', years)
         
-    datasets = DataFrameSet(input_filenames, output_filenames, makers.RemediationMaker)
+    datasets = DataFrameSet(input_filenames, output_filenames, makers.RemediationMaker, jobs=jobs,
+                            dtype_backend=dtype_backend, engine=engine)
     datasets.make_dataframes()
     
     tall_filepath = append_path(output_filepath, 'remediation_tall.csv')
-    return datasets.make_tall(id_col=years, filepath=tall_filepath)
+    return datasets.make_tall(id_col=years, filepath=tall_filepath, append=append,
+                              partitioned=partitioned)
 
 
-def make_school_address(input_filepath, output_filepath, years=(2010, 2011, 2012)):
-    input_filenames = create_filenames(input_filepath, '{year}_school_address.csv')    
-    output_filenames = create_filenames(output_filepath, 'address{year}.csv')
+def make_school_address(input_filepath, output_filepath, years=(2010, 2011, 2012), jobs=1, append=False,
+                        partitioned=False, dtype_backend='numpy_nullable', engine='pandas'):
+    input_filenames = create_filenames(input_filepath, '{year}_school_address.csv', years)    
+    output_filenames = create_filenames(output_filepath, 'address{year}.csv', years)
     
-    datasets = DataFrameSet(input_filenames, output_filenames, makers.AddressMaker)
+    datasets = DataFrameSet(input_filenames, output_filenames, makers.AddressMaker, jobs=jobs,
+                            dtype_backend=dtype_backend, engine=engine)
     datasets.make_dataframes()
     
     tall_filepath = append_path(output_filepath, 'address_tall.csv')
-    return datasets.make_tall(id_col=years, filepath=tall_filepath)
+    return datasets.make_tall(id_col=years, filepath=tall_filepath, append=append,
+                              partitioned=partitioned)
     
 
 
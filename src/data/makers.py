@@ -4,43 +4,96 @@ Created on Sun Jul  9 10:29:27 2023
 
 @author: caeley
 """
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from src.data.input_output_functions import append_csv, to_numeric, write_partitioned
+from src.data.expenditures import read_expenditures
 import numpy as np
 import pandas as pd
+from src.data import shared_frames
 
+# The dtype backends of pd.read_csv and DataFrame.convert_dtypes
+DTYPE_BACKENDS = ('numpy_nullable', 'pyarrow')
+# The default backend, which gives the masked extension arrays such as Int64 and string
+DTYPE_BACKEND = 'numpy_nullable'
+# The engines that can make the dataframes, see the engines module
+ENGINES = ('pandas', 'polars')
 
 class DataFrameSet:
     """ Class to get transform and save sets of dataframes """
     
-    def __init__(self, input_filenames, output_filenames, maker):
+    def __init__(self, input_filenames, output_filenames, maker, jobs=1, dtype_backend=DTYPE_BACKEND,
+                 engine='pandas'):
         if len(input_filenames) != len(output_filenames):
             raise ValueError(f'input_filenames {len(input_filenames)=}',
                              f'is not the same {len(output_filenames)=}')
         if Maker not in maker.mro():
             raise TypeError('maker must be of type Maker')
+        if dtype_backend not in DTYPE_BACKENDS:
+            raise ValueError(f'dtype_backend must be one of {DTYPE_BACKENDS}')
+        if engine not in ENGINES:
+            raise ValueError(f'engine must be one of {ENGINES}')
                  
         self.input_filenames = input_filenames
         self.output_filenames = output_filenames
         self.maker = maker
+        # The number of worker processes used to make the dataframes
+        self.jobs = jobs
+        # The dtype backend used to read and transform the dataframes
+        self.dtype_backend = dtype_backend
+        # The engine that reads and transforms the dataframes
+        self.engine = engine
         # Initialize dataframes as an empty array of dataframes
         self.dataframes = [pd.DataFrame([])] * len(input_filenames)
     
     
     def make_dataframes(self):
-        self._get_dataframes()
-        self._transform_dataframes()
+        if self.engine != 'pandas':
+            self._make_dataframes_with_engine()
+        elif self.jobs > 1:
+            self._make_dataframes_in_processes()
+        else:
+            self._get_dataframes()
+            self._transform_dataframes()
         self._save_dataframes()
     
     
+    def _make_dataframes_in_processes(self):
+        """ 
+        Reads and transforms each dataframe in a worker process. The workers
+        hand the transformed dataframes back through shared memory, so only
+        small handles are pickled.
+        """
+        max_workers = min(self.jobs, len(self.input_filenames))
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            handles = list(executor.map(_make_shared_dataframe,
+                                        self.input_filenames,
+                                        [self.maker] * len(self.input_filenames),
+                                        [self.dtype_backend] * len(self.input_filenames)))
+        
+        for i, handle in enumerate(handles):
+            self.dataframes[i] = shared_frames.receive_dataframe(handle)
+    
+    
+    def _make_dataframes_with_engine(self):
+        """ Makes each dataframe with the engines module. Polars uses every core on its own. """
+        from src.data import engines
+        
+        for i in range(len(self.input_filenames)):
+            self.dataframes[i] = engines.make_dataframe(self.maker, self.input_filenames[i],
+                                                        self.dtype_backend, self.engine)
+    
+    
     def _get_dataframes(self):
         """ Reads in all dataframes from the input_filenames iterable"""
         for i in range(len(self.input_filenames)):
-          self.dataframes[i] = pd.read_csv(self.input_filenames[i])
+          self.dataframes[i] = self.maker.read(self.input_filenames[i], self.dtype_backend)
     
     
     def _transform_dataframes(self):
         """ Transforms all filenames according to the maker class """
         for i in range(len(self.dataframes)):
-            df_maker = self.maker(self.dataframes[i])
+            df_maker = self.maker(self.dataframes[i], self.dtype_backend)
             df_maker.transform()
             # Reset the value to the transformed version
             self.dataframes[i] = df_maker.df
@@ -52,7 +105,34 @@ class DataFrameSet:
             self.dataframes[i].to_csv(self.output_filenames[i], index=False)
             
     
-    def make_tall(self, id_col=(2010,2011,2012), id_name='year', filepath=None):
+    def make_tall(self, id_col=(2010,2011,2012), id_name='year', filepath=None, append=False,
+                  partitioned=False):
+        """
+        Concatenates the dataframes into a single tall dataframe
+
+        Parameters
+        ----------
+        id_col : tuple, optional
+            The value identifying each dataframe. The default is (2010,2011,2012).
+        id_name : String, optional
+            The name of the id column. The default is 'year'.
+        filepath : str, Path, optional
+            Where to save the tall dataframe. The default is None or don't save.
+        append : bool, optional
+            Append to an existing tall file instead of overwriting it.
+            Ids that are already in the file raise a ValueError.
+            The default is False.
+        partitioned : bool, optional
+            Save a directory partitioned by id_name and district_id named after
+            filepath without its suffix instead of a single file. Only the
+            partitions of this set's ids are rewritten. The default is False.
+
+        Returns
+        -------
+        tall_df : DataFrame
+            The tall version of only the dataframes in this set.
+
+        """
         
         # The length of id_col must be equal to the number of datasets provided
         if len(id_col) != len(self.dataframes):
@@ -72,10 +152,35 @@ class DataFrameSet:
             tall_df = pd.concat((tall_df, self.dataframes[i]))
             
         # Save the dataframe when filepath is not None
-        if filepath is not None:
+        if filepath is not None and partitioned:
+            write_partitioned(tall_df, Path(filepath).with_suffix(''), (id_name, 'district_id'))
+        elif filepath is not None and append:
+            self._append_tall(tall_df, id_col, id_name, filepath)
+        elif filepath is not None:
             tall_df.to_csv(filepath, index=False)
             
         return tall_df
+    
+    
+    def _append_tall(self, tall_df, id_col, id_name, filepath):
+        """ Appends the tall dataframe to an existing tall file """
+        # Only the id column is read to check that the ids are new
+        if Path(filepath).exists():
+            existing_ids = pd.read_csv(filepath, usecols=[id_name])[id_name]
+            duplicates = set(existing_ids.unique()) & set(id_col)
+            if duplicates:
+                raise ValueError(f'{id_name} {sorted(duplicates)} already in {filepath}')
+        
+        append_csv(tall_df, filepath)
+
+
+
+def _make_shared_dataframe(input_filename, maker, dtype_backend=DTYPE_BACKEND):
+    """ Worker that reads and transforms one dataframe and places it in shared memory """
+    df_maker = maker(maker.read(input_filename, dtype_backend), dtype_backend)
+    df_maker.transform()
+
+    return shared_frames.share_dataframe(df_maker.df)
 
 
 
@@ -88,9 +193,22 @@ class Maker:
     drop_cols = []
     # How to rename columns
     col_map = {}
+    # Maps columns to the dict mapping their values, unknown values become NaN
+    value_maps = {}
         
-    def __init__(self, dataframe):
+    def __init__(self, dataframe, dtype_backend=DTYPE_BACKEND):
         self.df = dataframe
+        # The backend of the inferred column types
+        self.dtype_backend = dtype_backend
+    
+    
+    @classmethod
+    def read(cls, filepath, dtype_backend=DTYPE_BACKEND):
+        """ Reads a raw file into the dataframe given to the maker """
+        # The default backend keeps the numpy types of read_csv until convert_dtypes
+        if dtype_backend == DTYPE_BACKEND:
+            return pd.read_csv(filepath)
+        return pd.read_csv(filepath, dtype_backend=dtype_backend)
     
     
     def transform(self):
@@ -120,7 +238,13 @@ class Maker:
         # Drop columns
         self.df = self.df.drop(self.drop_cols, axis=1, errors='ignore')
         # Infer Column types
-        self.df = self.df.convert_dtypes()
+        self.df = self.df.convert_dtypes(dtype_backend=self.dtype_backend)
+    
+    
+    def _map_values(self):
+        """ Maps the values of the columns of value_maps """
+        for col, value_map in self.value_maps.items():
+            self.df[col] = self.df[col].map(value_map)
         
         
 
@@ -142,6 +266,19 @@ class CensusMaker(Maker):
     def _create_ratio_cols(self):
         self.df['child_pov_ratio'] = self.df['est_child_poverty'] / self.df['est_total_child']
         self.df['child_adult_ratio'] = self.df['est_total_child'] / self.df['est_total_pop']
+
+
+class StateCensusMaker(CensusMaker):
+    """ A CensusMaker that keeps the state FIPS code and census id of each district """
+    
+    col_map = {**CensusMaker.col_map, 'school district (unified)': 'lea_id'}
+    drop_cols = []
+    
+    def transform(self):
+        super().transform()
+        # The FIPS codes are read as numbers such as 8. Missing codes stay missing instead of becoming '<NA>'
+        state = self.df['state']
+        self.df['state'] = state.astype(str).str.zfill(2).where(state.notna())
        
         
         
@@ -164,6 +301,7 @@ class ExpenditureMaker(Maker):
         self._clean_numbers()
         self._clean_district_name()
         self._extract_data()
+        self._convert_amounts()
         
         
     def _clean_numbers(self):
@@ -172,7 +310,7 @@ class ExpenditureMaker(Maker):
         """
         
         for col in self.df.columns:
-            if self.df[col].dtype == 'string':
+            if is_string(self.df[col]):
                 self.df[col] = self.df[col].str.replace(',','', regex=True)
                 self.df[col] = self.df[col].str.replace('\(','', regex=True)
                 self.df[col] = self.df[col].str.replace('\)','', regex=True)
@@ -215,8 +353,37 @@ class ExpenditureMaker(Maker):
         # Now we can merge them
         merged_df = pd.merge(left=totals, right=per_pupils, on='district_name', suffixes=('_total', '_per_pupil'))
         self.df = pd.merge(left=counties, right=merged_df, on='district_name')
-        self.df = self.df.convert_dtypes()
+        self.df = self.df.convert_dtypes(dtype_backend=self.dtype_backend)
+        
         
+    def _convert_amounts(self):
+        """ Helper function that converts the amounts, text such as ' 5556 ', to numbers """
+        
+        for col in self.df.columns.drop(['district_name', 'county']):
+            self.df[col] = to_numeric(self.df[col])
+        self.df = self.df.convert_dtypes(dtype_backend=self.dtype_backend)
+        
+
+
+class ExpenditureBlockMaker(Maker):
+    """ 
+    Makes the expenditures with the single-pass block parser of the expenditures
+    module instead of reshaping the whole sheet. Besides the totals and per pupil
+    amounts, it keeps the funded pupil count and the share of each category.
+    """
+    
+    # The year is added by make_tall
+    drop_cols = ['section', 'year']
+    
+    
+    @classmethod
+    def read(cls, filepath, dtype_backend=DTYPE_BACKEND):
+        return read_expenditures(filepath, dtype_backend=dtype_backend)
+    
+    
+    def transform(self):
+        self._transform_cols()
+
 
 
 class KaggleMaker(Maker):
@@ -255,6 +422,9 @@ class KaggleMaker(Maker):
         # Perform standard changes
         super().transform()
         
+        # Ids are text such as '0010' in some years
+        self._convert_ids()
+        
         # Remove rows with unecessary information
         self._remove_boces()
         self._remove_state_results()
@@ -268,6 +438,14 @@ class KaggleMaker(Maker):
         # Refactor columns
         self._refactor_emh_combined()
 
+    def _convert_ids(self):
+        """ Converts the district_id and school_id columns read as text to numbers """
+        for col in ('district_id', 'school_id'):
+            if col in self.df.columns and is_string(self.df[col]):
+                ids = pd.to_numeric(self.df[col].str.strip(), errors='coerce').astype('float64')
+                self.df[col] = ids.convert_dtypes(dtype_backend=self.dtype_backend)
+    
+    
     def _refactor_emh_combined(self):
         """ 
         Refactors the EMH Combined column to a true false indicator
@@ -335,22 +513,18 @@ class ChangeMaker(KaggleMaker):
     trend_arrow_map = {1: -1,
                        2: 0,
                        3: 1}
+    value_maps = dict.fromkeys(('achievement_dir', 'growth_dir', 'overall_dir'), trend_arrow_map)
        
-    def __init__(self, dataframe):
-        super().__init__(dataframe)
-        self.col_map.update(self.change_col_map)
+    def __init__(self, dataframe, dtype_backend=DTYPE_BACKEND):
+        super().__init__(dataframe, dtype_backend)
+        # Copy the map so that the shared parent map is not modified
+        self.col_map = {**self.col_map, **self.change_col_map}
     
     
     def transform(self):
         super().transform()
-        self._map_directions()
-        
-        
-    def _map_directions(self):
-        """ Maps the trend direction columns. """
-        
-        for col in ('achievement_dir','growth_dir','overall_dir'):
-            self.df[col] = self.df[col].map(self.trend_arrow_map)
+        # Map the trend direction columns
+        self._map_values()
 
 
 
@@ -363,16 +537,12 @@ class CoactMaker(KaggleMaker):
     readiness_map = {1: 1,
                       2: 0,
                       0: 0}
+    value_maps = dict.fromkeys(('eng_yn', 'math_yn', 'read_yn', 'sci_yn'), readiness_map)
       
     def transform(self):
         super().transform()
-        self._map_readiness()
-        
-        
-    def _map_readiness(self):
-        """ Maps the readiness columns """
-        for col in ('eng_yn','math_yn','read_yn','sci_yn'):
-            self.df[col] = self.df[col].map(self.readiness_map)
+        # Map the readiness columns
+        self._map_values()
 
 
 
@@ -421,9 +591,10 @@ class FinalMaker(KaggleMaker):
                      'write_growth_grade': 'write_growth',
                      'spf_ps_ind_grad_rate': 'graduation_rate'}
     
-    def __init__(self, dataframe):
-        super().__init__(dataframe)
-        self.col_map.update(self.final_col_map)
+    def __init__(self, dataframe, dtype_backend=DTYPE_BACKEND):
+        super().__init__(dataframe, dtype_backend)
+        # Copy the map so that the shared parent map is not modified
+        self.col_map = {**self.col_map, **self.final_col_map}
         
 
 
@@ -433,9 +604,10 @@ class FrlMaker(KaggleMaker):
     
     frl_col_map = {'% free and reduced': 'pct_fr'}
     
-    def __init__(self, dataframe):
-        super().__init__(dataframe)
-        self.col_map.update(self.frl_col_map)
+    def __init__(self, dataframe, dtype_backend=DTYPE_BACKEND):
+        super().__init__(dataframe, dtype_backend)
+        # Copy the map so that the shared parent map is not modified
+        self.col_map = {**self.col_map, **self.frl_col_map}
         
         
     def transform(self):
@@ -463,9 +635,10 @@ class RemediationMaker(KaggleMaker):
     rem_col_map = {'remediation_atleastone_pct2010': 'pct_remediation',
                    'remediation_at_leastone_pct2010': 'pct_remediation'}
     
-    def __init__(self, dataframe):
-        super().__init__(dataframe)
-        self.col_map.update(self.rem_col_map)
+    def __init__(self, dataframe, dtype_backend=DTYPE_BACKEND):
+        super().__init__(dataframe, dtype_backend)
+        # Copy the map so that the shared parent map is not modified
+        self.col_map = {**self.col_map, **self.rem_col_map}
         
         
     def transform(self):
@@ -477,13 +650,23 @@ class RemediationMaker(KaggleMaker):
 
 class AddressMaker(KaggleMaker):
     
-    drop_cols = ['phone', 'physical address']
-    address_col_map = {'physical city': 'city',
+    drop_cols = ['phone']
+    # The street address is kept for matching schools across years
+    address_col_map = {'physical address': 'address',
+                       'physical city': 'city',
                       'physical state': 'state',
                       'physical zipcode': 'zipcode'}
     
-    def __init__(self, dataframe):
-        super().__init__(dataframe)
-        self.col_map.update(self.address_col_map)
-        
-    
+    def __init__(self, dataframe, dtype_backend=DTYPE_BACKEND):
+        super().__init__(dataframe, dtype_backend)
+        # Copy the map so that the shared parent map is not modified
+        self.col_map = {**self.col_map, **self.address_col_map}
+
+
+
+def is_string(col):
+    """ Whether a column has the string dtype of either dtype backend """
+    if isinstance(col.dtype, pd.ArrowDtype):
+        import pyarrow as pa
+        return pa.types.is_string(col.dtype.pyarrow_dtype) or pa.types.is_large_string(col.dtype.pyarrow_dtype)
+    return col.dtype == 'string'
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Sparse district-year by program code expenditure matrix.
+
+The CDE chart of accounts detail files have one row per district, fund,
+location, program, object and amount. Pivoting them gives thousands of codes
+per district-year, most of them empty, so they are kept as a SciPy CSR matrix
+with one row per (district_id, year) and one column per code instead of a
+mostly-NaN DataFrame. The row keys and the codes are saved next to the matrix
+so rows can be sliced by district and year and joined to the all_data keys.
+"""
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# Maps the columns of the CDE detail files to the names used here
+DETAIL_COLUMNS = {'Admin Unit': 'district_id',
+                  'Fund': 'fund',
+                  'Program': 'program',
+                  'Object': 'object',
+                  'Amount': 'amount'}
+# The columns that make up the code of a matrix column
+CODE_COLS = ('program',)
+# The columns identifying a row of the matrix
+KEY_COLS = ['district_id', 'year']
+# The number of rows parsed at a time
+CHUNKSIZE = 200_000
+# The files saved by ProgramMatrix.save
+MATRIX_FILENAME = 'matrix.npz'
+KEYS_FILENAME = 'keys.csv'
+CODES_FILENAME = 'codes.json'
+
+
+class ProgramMatrix:
+    """ Expenditures by district-year rows and program code columns """
+
+    def __init__(self, matrix, keys, codes):
+        """
+        Parameters
+        ----------
+        matrix : sparse matrix
+            The amounts, of shape (len(keys), len(codes))
+        keys : DataFrame
+            The district_id and year of each row
+        codes : list(str)
+            The code of each column
+        """
+        if matrix.shape != (len(keys), len(codes)):
+            raise ValueError(f'{matrix.shape=} does not match {len(keys)=} and {len(codes)=}')
+
+        self.matrix = sparse.csr_matrix(matrix)
+        self.keys = keys[KEY_COLS].reset_index(drop=True)
+        self.codes = list(codes)
+        # Maps each code to its column
+        self.code_index = {code: j for j, code in enumerate(self.codes)}
+
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+
+    def rows(self, district_ids=None, years=None):
+        """ Returns a ProgramMatrix of the rows of the given districts and years """
+        mask = np.ones(len(self), dtype=bool)
+        if district_ids is not None:
+            mask &= self.keys['district_id'].isin(district_ids).to_numpy()
+        if years is not None:
+            mask &= self.keys['year'].isin(years).to_numpy()
+
+        positions = np.flatnonzero(mask)
+        return ProgramMatrix(self.matrix[positions], self.keys.iloc[positions], self.codes)
+
+
+    def columns(self, codes=None, prefix=None):
+        """ Returns a ProgramMatrix of the given codes or the codes starting with prefix """
+        if codes is None:
+            codes = [code for code in self.codes if prefix is None or code.startswith(prefix)]
+        missing = [code for code in codes if code not in self.code_index]
+        if missing:
+            raise KeyError(f'codes {missing} not in the matrix')
+
+        positions = [self.code_index[code] for code in codes]
+        return ProgramMatrix(self.matrix[:, positions], self.keys, codes)
+
+
+    def align(self, keys):
+        """
+        Sparse left join of the matrix to a DataFrame of district_id and year.
+
+        Parameters
+        ----------
+        keys : DataFrame
+            The rows to join to, such as all_data
+
+        Returns
+        -------
+        csr_matrix
+            One row per row of keys in the same order. Keys that are not in
+            the matrix get an empty row.
+
+        """
+        positions = pd.merge(keys[KEY_COLS].reset_index(drop=True).reset_index(),
+                             self.keys.reset_index(), on=KEY_COLS, how='inner',
+                             suffixes=('_left', '_right'))
+        # Selects row index_right of the matrix for row index_left of keys
+        selection = sparse.csr_matrix((np.ones(len(positions)),
+                                       (positions['index_left'], positions['index_right'])),
+                                      shape=(len(keys), len(self)))
+        return selection @ self.matrix
+
+
+    def to_frame(self, keys=None):
+        """
+        A DataFrame with a sparse column per code.
+
+        Parameters
+        ----------
+        keys : DataFrame, optional
+            Join the rows to these keys with align. The default is None or
+            the rows of the matrix.
+
+        """
+        if keys is None:
+            keys, matrix = self.keys, self.matrix
+        else:
+            keys, matrix = keys[KEY_COLS].reset_index(drop=True), self.align(keys)
+
+        values = pd.DataFrame.sparse.from_spmatrix(matrix, columns=self.codes)
+        return pd.concat((keys, values), axis=1)
+
+
+    def save(self, directory):
+        """ Saves the matrix, row keys and codes to a directory """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        sparse.save_npz(directory.joinpath(MATRIX_FILENAME), self.matrix)
+        self.keys.to_csv(directory.joinpath(KEYS_FILENAME), index=False)
+        with open(directory.joinpath(CODES_FILENAME), 'w') as f:
+            json.dump(self.codes, f)
+
+
+    @classmethod
+    def load(cls, directory):
+        """ Loads a directory written by save """
+        directory = Path(directory)
+        with open(directory.joinpath(CODES_FILENAME)) as f:
+            codes = json.load(f)
+
+        return cls(sparse.load_npz(directory.joinpath(MATRIX_FILENAME)),
+                   pd.read_csv(directory.joinpath(KEYS_FILENAME)), codes)
+
+
+
+class ProgramMatrixBuilder:
+    """ Builds a ProgramMatrix from detail files read in chunks """
+
+    def __init__(self, code_cols=CODE_COLS):
+        self.code_cols = list(code_cols)
+        # The dictionaries giving each (district_id, year) its row and each code its column
+        self.row_index = {}
+        self.code_index = {}
+        # The coordinates and amounts of every chunk added
+        self._rows = []
+        self._cols = []
+        self._amounts = []
+
+
+    def add(self, detail):
+        """
+        Adds the amounts of a chunk of a detail file.
+
+        Parameters
+        ----------
+        detail : DataFrame
+            district_id, year, amount and the code_cols, as given by read_detail
+
+        """
+        detail = detail.dropna(subset=KEY_COLS + self.code_cols + ['amount'])
+        codes = detail[self.code_cols[0]].astype(str)
+        for col in self.code_cols[1:]:
+            codes = codes.str.cat(detail[col].astype(str), sep='-')
+        keys = pd.Series(list(zip(detail['district_id'].astype('int64'), detail['year'])),
+                         index=detail.index)
+
+        self._rows.append(_encode(keys, self.row_index))
+        self._cols.append(_encode(codes, self.code_index))
+        self._amounts.append(detail['amount'].to_numpy(dtype=float))
+
+
+    def build(self):
+        """ The ProgramMatrix of every chunk added. Duplicate entries are summed. """
+        shape = (len(self.row_index), len(self.code_index))
+        if self._amounts:
+            matrix = sparse.coo_matrix((np.concatenate(self._amounts),
+                                        (np.concatenate(self._rows), np.concatenate(self._cols))),
+                                       shape=shape).tocsr()
+        else:
+            matrix = sparse.csr_matrix(shape)
+        # Explicit zeros left by amounts that cancel out
+        matrix.eliminate_zeros()
+
+        keys = pd.DataFrame(list(self.row_index), columns=KEY_COLS)
+        return ProgramMatrix(matrix, keys, list(self.code_index))
+
+
+
+def read_detail(filepath, year, col_map=DETAIL_COLUMNS, chunksize=CHUNKSIZE):
+    """
+    Reads a CDE chart of accounts detail file in chunks.
+
+    Parameters
+    ----------
+    filepath : str, Path
+        The detail csv file
+    year : int
+        The year of the file
+    col_map : dict, optional
+        Maps the columns of the file to district_id, amount and the code
+        columns. The default is DETAIL_COLUMNS.
+    chunksize : int, optional
+        The number of rows parsed at a time. The default is CHUNKSIZE.
+
+    Yields
+    ------
+    DataFrame
+        district_id, year, amount and the other columns of col_map. Codes are
+        kept as strings so that leading zeros are not lost.
+
+    """
+    dtype = {col: str for col in col_map}
+    for chunk in pd.read_csv(filepath, usecols=list(col_map), dtype=dtype, chunksize=chunksize):
+        chunk = chunk.rename(columns=col_map)
+        chunk['district_id'] = pd.to_numeric(chunk['district_id'], errors='coerce')
+        # Amounts may be written with thousands separators or in parentheses when negative
+        amount = chunk['amount'].str.strip().str.replace(',', '', regex=False)
+        negative = amount.str.startswith('(') & amount.str.endswith(')')
+        amount = pd.to_numeric(amount.str.strip('()'), errors='coerce')
+        chunk['amount'] = amount.where(~negative, -amount)
+        chunk['year'] = year
+        yield chunk
+
+
+def build_program_matrix(filepaths, years, col_map=DETAIL_COLUMNS, code_cols=CODE_COLS,
+                         chunksize=CHUNKSIZE):
+    """
+    Builds a ProgramMatrix from one detail file per year.
+
+    Returns
+    -------
+    ProgramMatrix
+
+    """
+    builder = ProgramMatrixBuilder(code_cols)
+    for filepath, year in zip(filepaths, years):
+        for chunk in read_detail(filepath, year, col_map, chunksize):
+            builder.add(chunk)
+
+    return builder.build()
+
+
+def _encode(values, index):
+    """ Maps values to integer ids, giving new values the next ids in index """
+    for value in values.unique():
+        if value not in index:
+            index[value] = len(index)
+    return values.map(index).to_numpy(dtype=np.int64)
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Lazy queries over the interim datasets.
+
+A query records projections, filters and joins and only reads data when
+collect() is called. Projections and filters are pushed down to the reader so
+only the needed columns are parsed and only matching rows are kept. Tables saved
+partitioned by write_partitioned only read the partitions that match.
+"""
+from pathlib import Path
+from src.data.input_output_functions import append_path, partition_columns, read_partitioned
+import pandas as pd
+
+# The interim tables that can be scanned by name
+INTERIM_TABLES = {'all_data': 'all_data.csv',
+                  'high_school': 'high_school.csv',
+                  'districts': 'districts.csv',
+                  'schools': 'schools.csv',
+                  'census': 'census/tall_saipe.csv',
+                  'expenditures': 'expenditures/tall_expenditures.csv',
+                  'change': 'kaggle/1YR_3YR_change_tall.csv',
+                  'coact': 'kaggle/COACT_tall.csv',
+                  'enroll': 'kaggle/enrl_working_tall.csv',
+                  'final': 'kaggle/final_grade_tall.csv',
+                  'frl': 'kaggle/FRL_tall.csv',
+                  'remediation': 'kaggle/remediation_tall.csv',
+                  'address': 'kaggle/address_tall.csv',
+                  'school_entities': 'school_entities.csv'}
+
+# The number of rows parsed at a time when scanning csv files
+CHUNKSIZE = 50_000
+
+
+def scan(input_filepath, table):
+    """
+    Creates a lazy query over one of the interim tables.
+
+    Parameters
+    ----------
+    input_filepath : str, Path
+        The interim directory
+    table : str
+        The name of the table in INTERIM_TABLES or a filename relative
+        to input_filepath
+
+    Returns
+    -------
+    LazyQuery
+        A query that reads the whole table when collected.
+
+    """
+    filename = INTERIM_TABLES.get(table, table)
+    filepath = append_path(input_filepath, filename)
+    
+    # Prefer the partitioned version of a table when it exists
+    partitioned_filepath = Path(filepath).with_suffix('')
+    if filename.endswith('.csv') and partitioned_filepath.is_dir():
+        return LazyQuery(partitioned_filepath)
+    
+    return LazyQuery(filepath)
+
+
+class LazyQuery:
+    """ Class that records a query and pushes it down to the reader on collect """
+
+    def __init__(self, filepath, columns=None, filters=None, joins=(), chunksize=CHUNKSIZE):
+        self.filepath = filepath
+        # None selects every column
+        self.columns = None if columns is None else list(columns)
+        # Maps column names to the list of accepted values
+        self.filters = dict(filters or {})
+        # A tuple of (LazyQuery, on, how)
+        self.joins = tuple(joins)
+        self.chunksize = chunksize
+
+
+    def select(self, *columns):
+        """ Returns a new query that only keeps the given columns """
+        return self._replace(columns=columns)
+
+
+    def where(self, **filters):
+        """
+        Returns a new query that only keeps rows matching every filter.
+        Values may be a scalar or a list of accepted values,
+        e.g. where(year=2011, district_id=[880, 900], emh='H')
+        """
+        updated = dict(self.filters)
+        for col, values in filters.items():
+            if isinstance(values, (list, tuple, set, range)):
+                values = list(values)
+            else:
+                values = [values]
+            # Filtering the same column twice keeps the intersection
+            if col in updated:
+                values = [value for value in updated[col] if value in values]
+            updated[col] = values
+
+        return self._replace(filters=updated)
+
+
+    def join(self, other, on, how='inner'):
+        """ Returns a new query joined to another LazyQuery on the given columns """
+        if not isinstance(other, LazyQuery):
+            raise TypeError('other must be of type LazyQuery')
+        if isinstance(on, str):
+            on = [on]
+
+        return self._replace(joins=self.joins + ((other, list(on), how),))
+
+
+    def collect(self):
+        """ Executes the query and returns the resulting DataFrame """
+        available = self._read_header()
+
+        # Filters on this table are pushed to the reader. Filters on join keys are
+        # also pushed to the joined tables so that they read fewer rows.
+        own_filters = {col: values for col, values in self.filters.items() if col in available}
+
+        own_columns = self._needed_columns(available, own_filters)
+        df = self._read(own_columns, own_filters)
+
+        for other, on, how in self.joins:
+            df = pd.merge(df, self._push_down(other, on, available).collect(), on=on, how=how)
+
+        # Any filters that could not be pushed down are applied after the joins
+        remaining = {col: values for col, values in self.filters.items() if col not in own_filters}
+        df = _apply_filters(df, remaining)
+
+        if self.columns is not None:
+            df = df[[col for col in self.columns if col in df.columns]]
+
+        return df.reset_index(drop=True)
+
+
+    def explain(self):
+        """ Returns a string describing what will be read when the query is collected """
+        lines = [f'scan {self.filepath}',
+                 f'  columns: {"*" if self.columns is None else self.columns}',
+                 f'  filters: {self.filters}']
+        for other, on, how in self.joins:
+            lines.append(f'  {how} join on {on}')
+            lines.extend('    ' + line for line in other.explain().splitlines())
+
+        return '\n'.join(lines)
+
+
+    def _replace(self, **changes):
+        """ Returns a copy of the query with the given attributes changed """
+        params = {'filepath': self.filepath,
+                  'columns': self.columns,
+                  'filters': self.filters,
+                  'joins': self.joins,
+                  'chunksize': self.chunksize}
+        params.update(changes)
+        return LazyQuery(**params)
+
+
+    def _push_down(self, other, on, available):
+        """ Pushes the filters and projection of this query into a joined query """
+        other_available = other._output_columns()
+
+        # Join keys are filtered on both sides, other columns only where they live
+        other_filters = {col: values for col, values in self.filters.items()
+                         if col in other_available and (col in on or col not in available)}
+        if other_filters:
+            other = other.where(**other_filters)
+
+        if self.columns is not None:
+            # Columns already read from this table are not read again. Filtered
+            # columns are kept for the filters applied after the join.
+            other = other.select(*[col for col in other_available if col in on or col in other_filters
+                                   or (col in self.columns and col not in available)])
+
+        return other
+
+
+    def _output_columns(self):
+        """ The columns this query will produce """
+        if self.columns is not None:
+            return list(self.columns)
+
+        columns = self._read_header()
+        for other, on, how in self.joins:
+            columns += [col for col in other._output_columns() if col not in columns]
+
+        return columns
+
+
+    def _needed_columns(self, available, own_filters):
+        """ The columns that must be read from this table """
+        if self.columns is None:
+            return None
+
+        needed = set(self.columns) | set(own_filters)
+        for other, on, how in self.joins:
+            needed.update(on)
+
+        # Keep the file order so results look the same as a full read
+        return [col for col in available if col in needed]
+
+
+    def _is_parquet(self):
+        return str(self.filepath).endswith('.parquet')
+
+
+    def _is_partitioned(self):
+        return Path(self.filepath).is_dir()
+
+
+    def _read_header(self):
+        """ Reads only the column names of the table """
+        if self._is_partitioned():
+            partition_cols, file_columns = partition_columns(self.filepath)
+            return partition_cols + file_columns
+        
+        if self._is_parquet():
+            import pyarrow.parquet as pq
+            return list(pq.read_schema(self.filepath).names)
+
+        return list(pd.read_csv(self.filepath, nrows=0).columns)
+
+
+    def _read(self, columns, filters):
+        """ Reads the table with the projection and filters pushed down """
+        if self._is_partitioned():
+            # Partitions that do not match the filters are never opened
+            return read_partitioned(self.filepath, filters, columns)
+        
+        if self._is_parquet():
+            # Parquet statistics let pyarrow skip whole row groups
+            pq_filters = [(col, 'in', values) for col, values in filters.items()] or None
+            return pd.read_parquet(self.filepath, columns=columns, filters=pq_filters)
+
+        # csv files are parsed in chunks and filtered as they are read
+        # so the unfiltered table is never held in memory
+        chunks = [_apply_filters(chunk, filters)
+                  for chunk in pd.read_csv(self.filepath, usecols=columns, chunksize=self.chunksize)]
+
+        return pd.concat(chunks, ignore_index=True)
+
+
+def _apply_filters(df, filters):
+    """ Keeps the rows of df that match every filter """
+    for col, values in filters.items():
+        df = df[df[col].isin(values)]
+
+    return df
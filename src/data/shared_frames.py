@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Hands DataFrames between processes through shared memory.
+
+A worker copies the column buffers of a DataFrame into one
+multiprocessing.shared_memory block and returns a small SharedFrame handle.
+Only the handle is pickled. The parent attaches to the block, rebuilds the
+columns from the buffers and releases the block.
+"""
+from dataclasses import dataclass, field
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import pandas as pd
+
+# Buffers are aligned so that every column can be viewed in place
+ALIGNMENT = 8
+
+# The masked extension arrays and the public constructors that rebuild them
+MASKED_ARRAYS = {'Int': pd.arrays.IntegerArray,
+                 'UInt': pd.arrays.IntegerArray,
+                 'Float': pd.arrays.FloatingArray,
+                 'boolean': pd.arrays.BooleanArray}
+
+
+@dataclass
+class SharedFrame:
+    """ A picklable handle to a DataFrame stored in shared memory """
+    # The name of the shared memory block
+    name: str
+    # The number of rows
+    length: int
+    # A dict per column describing where its buffers live in the block
+    columns: list = field(default_factory=list)
+
+
+def share_dataframe(df):
+    """
+    Copies a DataFrame into a new shared memory block.
+
+    Parameters
+    ----------
+    df : DataFrame
+        The DataFrame to share. The index is not kept.
+
+    Returns
+    -------
+    SharedFrame
+        The handle to pass to receive_dataframe in another process.
+
+    """
+    # Split every column into plain numpy buffers first, so that the size is known
+    layouts = []
+    buffers = []
+    for name in df.columns:
+        layout, col_buffers = _encode_column(df[name])
+        layout['name'] = name
+        layouts.append(layout)
+        buffers.append(col_buffers)
+
+    size = sum(_aligned(buffer.nbytes) for col_buffers in buffers for buffer in col_buffers)
+    # A shared memory block can not be empty
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+
+    offset = 0
+    for layout, col_buffers in zip(layouts, buffers):
+        layout['buffers'] = []
+        for buffer in col_buffers:
+            target = np.ndarray(buffer.shape, dtype=buffer.dtype, buffer=shm.buf, offset=offset)
+            target[...] = buffer
+            layout['buffers'].append((offset, buffer.dtype.str))
+            offset += _aligned(buffer.nbytes)
+
+    handle = SharedFrame(name=shm.name, length=len(df), columns=layouts)
+    # The block stays alive after closing until the receiver unlinks it.
+    # The receiver owns the block, so the creating process stops tracking it
+    # and it is not removed when the worker exits.
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    shm.close()
+
+    return handle
+
+
+def receive_dataframe(handle):
+    """
+    Rebuilds a DataFrame from a SharedFrame and releases its shared memory.
+
+    Parameters
+    ----------
+    handle : SharedFrame
+        The handle returned by share_dataframe
+
+    Returns
+    -------
+    DataFrame
+        The shared DataFrame with a default index.
+
+    """
+    shm = shared_memory.SharedMemory(name=handle.name)
+    try:
+        data = {}
+        for layout in handle.columns:
+            buffers = [np.ndarray(handle.length, dtype=dtype, buffer=shm.buf, offset=offset).copy()
+                       for offset, dtype in layout['buffers']]
+            data[layout['name']] = _decode_column(layout, buffers)
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return pd.DataFrame(data, columns=[layout['name'] for layout in handle.columns])
+
+
+def release(handle):
+    """ Frees the shared memory of a handle that will not be received """
+    shm = shared_memory.SharedMemory(name=handle.name)
+    shm.close()
+    shm.unlink()
+
+
+def _aligned(nbytes):
+    return -(-nbytes // ALIGNMENT) * ALIGNMENT
+
+
+def _masked_kind(dtype):
+    """ The key of MASKED_ARRAYS for a masked extension dtype or None """
+    if not isinstance(dtype, pd.api.extensions.ExtensionDtype):
+        return None
+    for kind in MASKED_ARRAYS:
+        if dtype.name.startswith(kind):
+            return kind
+    return None
+
+
+def _is_arrow_numeric(dtype):
+    """ Whether dtype is an Arrow-backed integer, float or boolean dtype """
+    return isinstance(dtype, pd.ArrowDtype) and dtype.kind in 'biuf'
+
+
+def _encode_column(col):
+    """
+    Splits a column into numpy buffers.
+
+    Returns
+    -------
+    layout : dict
+        How to rebuild the column from its buffers
+    buffers : list(ndarray)
+        The buffers to copy into shared memory
+
+    """
+    dtype = col.dtype
+
+    # Plain numpy columns are copied as they are
+    if isinstance(dtype, np.dtype) and dtype.kind in 'biufcmM':
+        return {'kind': 'numpy'}, [col.to_numpy()]
+
+    # Nullable Int64, Float64 and boolean columns are stored as values and a mask
+    masked_kind = _masked_kind(dtype)
+    if masked_kind is not None:
+        mask = col.isna().to_numpy()
+        values = col.to_numpy(dtype=dtype.numpy_dtype, na_value=0 if masked_kind != 'boolean' else False)
+        return {'kind': 'masked', 'masked_kind': masked_kind, 'dtype': dtype.name}, [values, mask]
+
+    # Arrow-backed numbers and booleans are stored as values and a mask as well
+    if _is_arrow_numeric(dtype):
+        mask = col.isna().to_numpy()
+        numpy_dtype = bool if dtype.kind == 'b' else dtype.numpy_dtype
+        values = col.to_numpy(dtype=numpy_dtype, na_value=False if dtype.kind == 'b' else 0)
+        return {'kind': 'arrow', 'dtype': str(dtype)}, [values, mask]
+
+    # Strings and other objects are dictionary encoded.
+    # Only the dictionary is pickled with the handle.
+    codes, uniques = pd.factorize(col, use_na_sentinel=True)
+    layout = {'kind': 'dictionary', 'dtype': dtype, 'uniques': np.asarray(uniques, dtype=object)}
+    return layout, [codes]
+
+
+def _decode_column(layout, buffers):
+    """ Rebuilds a column from its layout and buffers """
+    if layout['kind'] == 'numpy':
+        return buffers[0]
+
+    if layout['kind'] == 'masked':
+        values, mask = buffers
+        return MASKED_ARRAYS[layout['masked_kind']](values, mask)
+
+    if layout['kind'] == 'arrow':
+        import pyarrow as pa
+
+        values, mask = buffers
+        return pd.arrays.ArrowExtensionArray(pa.array(values, mask=mask))
+
+    codes = buffers[0]
+    # Missing values were given the code -1
+    missing = codes < 0
+    values = layout['uniques'].take(np.where(missing, 0, codes)) if len(layout['uniques']) \
+        else np.empty(len(codes), dtype=object)
+    values[missing] = np.nan
+
+    if layout['dtype'] == 'object':
+        return values
+    return pd.array(values, dtype=layout['dtype'])
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Builds a national census dataset keyed by state and district_id.
+
+Each state is a shard that is made in its own worker process from the census
+files in census/{state}. Colorado's files may also be directly in census/.
+States listed in DISTRICT_ID_FILENAMES are matched to the district ids of a
+saved id dataset, such as the Kaggle ids of Colorado. The other states use the
+census id of each district. The shards are then merged into a single dataset.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from src.data.input_output_functions import append_path, write_partitioned
+from src.data.make_datasets import make_census
+from src.data.combine_datasets import match_district_id
+from src.data import builders
+import pandas as pd
+
+# The FIPS code of every state and DC
+STATE_FIPS = {'01': 'AL', '02': 'AK', '04': 'AZ', '05': 'AR', '06': 'CA', '08': 'CO',
+              '09': 'CT', '10': 'DE', '11': 'DC', '12': 'FL', '13': 'GA', '15': 'HI',
+              '16': 'ID', '17': 'IL', '18': 'IN', '19': 'IA', '20': 'KS', '21': 'KY',
+              '22': 'LA', '23': 'ME', '24': 'MD', '25': 'MA', '26': 'MI', '27': 'MN',
+              '28': 'MS', '29': 'MO', '30': 'MT', '31': 'NE', '32': 'NV', '33': 'NH',
+              '34': 'NJ', '35': 'NM', '36': 'NY', '37': 'NC', '38': 'ND', '39': 'OH',
+              '40': 'OK', '41': 'OR', '42': 'PA', '44': 'RI', '45': 'SC', '46': 'SD',
+              '47': 'TN', '48': 'TX', '49': 'UT', '50': 'VT', '51': 'VA', '53': 'WA',
+              '54': 'WV', '55': 'WI', '56': 'WY'}
+
+# The id datasets in the interim directory that give the district ids of a state
+DISTRICT_ID_FILENAMES = {builders.COLORADO: 'districts.csv'}
+
+# The columns identifying each row of the national dataset
+KEY_COLS = ['state', 'district_id', 'year']
+
+
+def make_states(input_filepath, output_filepath, states=tuple(STATE_FIPS), years=(2010, 2011, 2012),
+                jobs=1, partitioned=False):
+    """
+    Makes the census data of each state in parallel and merges it into a
+    national dataset saved as census/national_saipe.csv.
+
+    Parameters
+    ----------
+    input_filepath : str, Path
+        The raw directory
+    output_filepath : str, Path
+        The interim directory
+    states : iterable(String), optional
+        The FIPS codes of the states. The default is every state.
+    years : tuple(int), optional
+        The years to make. The default is (2010, 2011, 2012).
+    jobs : int, optional
+        The number of worker processes. The default is 1.
+    partitioned : bool, optional
+        Save the national dataset partitioned by state and year.
+        The default is False.
+
+    Returns
+    -------
+    DataFrame
+        The national dataset.
+
+    """
+    states = list(states)
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(states))) as executor:
+            shards = list(executor.map(make_state,
+                                       [input_filepath] * len(states),
+                                       [output_filepath] * len(states),
+                                       states,
+                                       [years] * len(states)))
+    else:
+        shards = [make_state(input_filepath, output_filepath, state, years) for state in states]
+
+    national = merge_states(shards)
+
+    filepath = append_path(output_filepath, 'census/national_saipe.csv')
+    if partitioned:
+        write_partitioned(national, Path(filepath).with_suffix(''), ('state', 'year'))
+    else:
+        national.to_csv(filepath, index=False)
+
+    return national
+
+
+def make_state(input_filepath, output_filepath, state, years=(2010, 2011, 2012)):
+    """
+    Makes the tall census data of a single state in census/{state} and adds
+    its district ids.
+
+    Returns
+    -------
+    DataFrame
+        The state's census data with state, district_id, district_name and year first.
+
+    """
+    state_output_filepath = Path(append_path(output_filepath, f'census/{state}'))
+    state_output_filepath.mkdir(parents=True, exist_ok=True)
+    census = make_census(census_filepath(input_filepath, state), state_output_filepath, years,
+                         state=state)
+
+    id_filename = DISTRICT_ID_FILENAMES.get(state)
+    if id_filename is not None and Path(append_path(output_filepath, id_filename)).exists():
+        district = pd.read_csv(append_path(output_filepath, id_filename))
+        district.insert(0, 'state', state)
+        census = match_district_id(district, census, state)
+    else:
+        census = census.rename(columns={'lea_id': 'district_id'})
+        builder = builders.DistrictIDBuilder((census,), state)
+        builder.build()
+        builder.save(state_output_filepath.joinpath('districts.csv'))
+        census['district_name'] = builder.id_dataset.set_index('district_id')['district_name'].reindex(
+            census['district_id']).to_numpy()
+
+    first_cols = ['state', 'district_id', 'district_name', 'year']
+    return census[first_cols + [col for col in census.columns if col not in first_cols]]
+
+
+def merge_states(shards):
+    """
+    Concatenates the census data of each state.
+
+    Raises
+    ------
+    ValueError
+        A state, district_id and year appears more than once.
+
+    """
+    national = pd.concat(shards, ignore_index=True)
+
+    duplicates = national.duplicated(KEY_COLS, keep=False)
+    if duplicates.any():
+        raise ValueError(f'Duplicate {KEY_COLS} rows:\n{national.loc[duplicates, KEY_COLS]}')
+
+    return national.sort_values(KEY_COLS, ignore_index=True)
+
+
+def census_filepath(input_filepath, state):
+    """ The raw census directory of a state """
+    filepath = append_path(input_filepath, f'census/{state}')
+    if state == builders.COLORADO and not Path(filepath).is_dir():
+        return append_path(input_filepath, 'census')
+    return filepath
+
+
+if __name__ == '__main__':
+    project_dir = Path(__file__).resolve().parents[2]
+    input_filepath = project_dir.joinpath('data/raw')
+    output_filepath = project_dir.joinpath('data/interim')
+
+    make_states(input_filepath, output_filepath, [builders.COLORADO])
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Embedded SQLite warehouse of the combined interim tables.
+
+load_warehouse copies all_data, high_school, districts and schools into a
+single SQLite file next to the interim data and indexes them on school_id,
+district_id and year. Warehouse answers point lookups and filtered aggregates
+from the indexes, so a question about one school or district reads a few
+pages instead of parsing a whole csv file.
+
+    with Warehouse(interim.joinpath(WAREHOUSE_FILENAME)) as warehouse:
+        warehouse.lookup('all_data', school_id=10, year=2012)
+        warehouse.aggregate('all_data', 'pct_fr', by='year', district_id=880)
+"""
+from pathlib import Path
+import sqlite3
+
+import pandas as pd
+
+from src.data.input_output_functions import append_path, iter_partitioned
+from src.data.queries import CHUNKSIZE, INTERIM_TABLES
+
+# The file the warehouse is saved in, in the interim directory
+WAREHOUSE_FILENAME = 'warehouse.sqlite'
+# The interim tables loaded into the warehouse
+WAREHOUSE_TABLES = ('all_data', 'high_school', 'districts', 'schools')
+# The columns indexed in every table that has them
+INDEX_COLS = ('school_id', 'district_id', 'year')
+# Composite indexes for the lookups of one school or district in a year
+COMPOSITE_INDEXES = (('school_id', 'year'), ('district_id', 'year'))
+# The SQL aggregate of each aggregate name
+AGGREGATES = {'mean': 'AVG', 'sum': 'SUM', 'min': 'MIN', 'max': 'MAX', 'count': 'COUNT'}
+
+
+def load_warehouse(input_filepath, database_filepath=None, tables=WAREHOUSE_TABLES, chunksize=CHUNKSIZE):
+    """
+    Loads interim tables into a SQLite database and indexes them.
+
+    Parameters
+    ----------
+    input_filepath : str, Path
+        The interim directory
+    database_filepath : str, Path, optional
+        The database file, which is replaced. The default is None or
+        WAREHOUSE_FILENAME in input_filepath.
+    tables : tuple(String), optional
+        The tables of INTERIM_TABLES to load. The default is WAREHOUSE_TABLES.
+    chunksize : int, optional
+        The number of rows inserted at a time. The default is CHUNKSIZE.
+
+    Returns
+    -------
+    dict
+        The number of rows loaded into each table.
+
+    """
+    if database_filepath is None:
+        database_filepath = append_path(input_filepath, WAREHOUSE_FILENAME)
+    # Build a new file and swap it in, so readers never see a half loaded warehouse
+    building_filepath = Path(f'{database_filepath}.building')
+    building_filepath.unlink(missing_ok=True)
+
+    rows = {}
+    with sqlite3.connect(building_filepath) as connection:
+        for table in tables:
+            rows[table] = 0
+            for chunk in _read_chunks(input_filepath, table, chunksize):
+                chunk.to_sql(table, connection, if_exists='append', index=False)
+                rows[table] += len(chunk)
+            _create_indexes(connection, table)
+        connection.execute('ANALYZE')
+    connection.close()
+
+    building_filepath.replace(database_filepath)
+    return rows
+
+
+class Warehouse:
+    """ Read-only queries against a database made by load_warehouse """
+
+    def __init__(self, filepath):
+        if not Path(filepath).exists():
+            raise FileNotFoundError(f'{filepath} does not exist, run load_warehouse first')
+        self.filepath = filepath
+        self.connection = sqlite3.connect(f'file:{Path(filepath).resolve()}?mode=ro', uri=True)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def close(self):
+        self.connection.close()
+
+
+    def tables(self):
+        """ The names of the tables in the warehouse """
+        rows = self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'").fetchall()
+        return [name for name, in rows]
+
+
+    def columns(self, table):
+        """ The column names of a table """
+        self._check_table(table)
+        return [row[1] for row in self.connection.execute(f'PRAGMA table_info({_quote(table)})')]
+
+
+    def query(self, sql, params=()):
+        """ Runs any SQL query and returns the result as a DataFrame """
+        return pd.read_sql_query(sql, self.connection, params=params)
+
+
+    def lookup(self, table, columns=None, **filters):
+        """
+        Returns the rows of table matching every filter.
+        Values may be a scalar or a list of accepted values,
+        e.g. lookup('all_data', school_id=10, year=[2011, 2012])
+        """
+        select = '*' if columns is None else ', '.join(_quote(col) for col in self._check_columns(table, columns))
+        where, params = self._where(table, filters)
+        return self.query(f'SELECT {select} FROM {_quote(table)}{where}', params)
+
+
+    def aggregate(self, table, values, by=(), how='mean', **filters):
+        """
+        Aggregates columns of the rows matching every filter.
+
+        Parameters
+        ----------
+        table : String
+            The table to aggregate
+        values : String, list(String)
+            The columns to aggregate
+        by : String, list(String), optional
+            The columns to group by. The default is () or a single row.
+        how : String, optional
+            One of AGGREGATES. The default is 'mean'.
+        **filters
+            Filters as in lookup
+
+        Returns
+        -------
+        DataFrame
+            One row per group with the by columns and the aggregated values.
+
+        """
+        if how not in AGGREGATES:
+            raise ValueError(f'how must be one of {tuple(AGGREGATES)}')
+        values = self._check_columns(table, [values] if isinstance(values, str) else values)
+        by = self._check_columns(table, [by] if isinstance(by, str) else by)
+
+        select = [_quote(col) for col in by]
+        select += [f'{AGGREGATES[how]}({_quote(col)}) AS {_quote(col)}' for col in values]
+        where, params = self._where(table, filters)
+        group = f' GROUP BY {", ".join(map(_quote, by))} ORDER BY {", ".join(map(_quote, by))}' if by else ''
+
+        return self.query(f'SELECT {", ".join(select)} FROM {_quote(table)}{where}{group}', params)
+
+
+    def school(self, school_id, year=None, table='all_data'):
+        """ The rows of one school, in one year or all of them """
+        filters = {'school_id': school_id} if year is None else {'school_id': school_id, 'year': year}
+        return self.lookup(table, **filters)
+
+
+    def district(self, district_id, year=None, table='all_data'):
+        """ The rows of one district, in one year or all of them """
+        filters = {'district_id': district_id} if year is None else {'district_id': district_id, 'year': year}
+        return self.lookup(table, **filters)
+
+
+    def explain(self, sql, params=()):
+        """ SQLite's query plan, e.g. to check that a query uses an index """
+        rows = self.connection.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+        return '\n'.join(row[-1] for row in rows)
+
+
+    def _where(self, table, filters):
+        """ The WHERE clause and parameters of the filters """
+        clauses = []
+        params = []
+        for col, values in filters.items():
+            self._check_columns(table, [col])
+            if not isinstance(values, (list, tuple, set, range)):
+                values = [values]
+            values = [_to_sql_value(value) for value in values]
+            clauses.append(f'{_quote(col)} IN ({", ".join("?" * len(values))})')
+            params.extend(values)
+
+        if not clauses:
+            return '', params
+        return ' WHERE ' + ' AND '.join(clauses), params
+
+
+    def _check_table(self, table):
+        if table not in self.tables():
+            raise KeyError(f'table {table} is not in the warehouse')
+
+
+    def _check_columns(self, table, columns):
+        """ Raises a KeyError for unknown columns, which are never put into SQL """
+        available = self.columns(table)
+        missing = [col for col in columns if col not in available]
+        if missing:
+            raise KeyError(f'columns {missing} are not in {table}')
+        return list(columns)
+
+
+def _read_chunks(input_filepath, table, chunksize):
+    """ Yields an interim table in chunks, or by partition when it is saved partitioned """
+    filepath = Path(append_path(input_filepath, INTERIM_TABLES[table]))
+    if filepath.with_suffix('').is_dir():
+        return iter_partitioned(filepath.with_suffix(''))
+    return pd.read_csv(filepath, chunksize=chunksize)
+
+
+def _create_indexes(connection, table):
+    columns = [row[1] for row in connection.execute(f'PRAGMA table_info({_quote(table)})')]
+    indexes = [(col,) for col in INDEX_COLS if col in columns]
+    indexes += [cols for cols in COMPOSITE_INDEXES if all(col in columns for col in cols)]
+
+    for cols in indexes:
+        name = _quote(f'{table}_{"_".join(cols)}')
+        connection.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {_quote(table)} '
+                           f'({", ".join(map(_quote, cols))})')
+
+
+def _quote(name):
+    """ Quotes an identifier for SQLite """
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _to_sql_value(value):
+    """ Converts numpy scalars, which sqlite3 can not bind, to Python values """
+    return value.item() if hasattr(value, 'item') else value
@@ -0,0 +1,529 @@
+# -*- coding: utf-8 -*-
+"""
+Differential checks of alternate implementations against the current ones.
+
+Each target wraps a step of the pipeline whose output must not change: the
+makers, transform_district_name, make_tall, combine_datasets and
+fill_back_forward. The current implementation is the reference. A candidate
+with the same signature is run on the same inputs, the shipped data and
+randomized synthetic inputs, and the outputs are compared with
+compare_outputs, which reports dtype differences and ignores row order.
+benchmarks/equivalence.py runs the targets and reports the time ratios.
+
+As the references are the current code, changing one in place would only
+compare it with itself. freeze_references saves fingerprints of the reference
+outputs on the shipped data and check_references compares the references
+with them, so a change of behaviour shows up until the fingerprints are frozen
+again on purpose.
+
+    results = check_target('transform_district_name', candidate=my_transform_district_name)
+    [result.differences for result in results if result.differences]
+"""
+import copy
+import csv
+from dataclasses import dataclass, field
+from functools import lru_cache
+import hashlib
+from importlib import import_module
+import io
+import json
+from pathlib import Path
+import random
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.data import builders, engines, makers
+from src.data.combine_datasets import TALL_FILENAMES, combine_datasets, read_tall
+from src.features.build_features import PANEL_COLS, fill_back_forward
+
+# The project root
+PROJECT_DIR = Path(__file__).resolve().parents[1]
+# The years of the shipped data
+YEARS = (2010, 2011, 2012)
+# The fingerprints of the reference outputs on the shipped data, written by freeze_references
+GOLDEN_FILEPATH = PROJECT_DIR.joinpath('tests/golden/equivalence.json')
+# The share of fields blanked in synthetic raw files
+BLANK_SHARE = 0.05
+# Words synthetic district names are made of, with the cases transform_district_name handles
+NAME_WORDS = ['Cheyenne', 'County', 'School', 'District', 'RE-5', 'RE1J', 'Cañon', 'City', 'NO 1', 'NO2',
+              '29J', '49JT', 'C113', 'S/D', 'Rural', 'Estes', 'Park', 'R-3', 'Weld', 'Moffat', 'Consolidated',
+              'Schools', 'Northglenn-Thornton', '12', 'Florence', 'Milliken', 'Mc Clave', 'Custer', 'Distr',
+              'Jt.', 'Ñ', 'Élan', ':', '/', '-', '(1)', '  ']
+
+
+@dataclass
+class Case:
+    """ The arguments of one call of a target """
+    name: str
+    args: tuple
+    kwargs: dict = field(default_factory=dict)
+
+
+@dataclass
+class Target:
+    """ A step with a reference implementation and the cases it is checked on """
+    reference: object
+    # Called with the raw and interim directories, returns the cases of the shipped data
+    real_cases: object
+    # Called with a random.Random and a case number, returns a synthetic case
+    synthetic_case: object
+    # The default candidate. The default is None or the reference itself,
+    # which checks that it is deterministic and does not depend on its inputs being mutated.
+    candidate: object = None
+
+
+@dataclass
+class Result:
+    """ The outcome of one case """
+    target: str
+    case: str
+    reference_seconds: float
+    candidate_seconds: float
+    differences: list
+
+
+
+def compare_outputs(expected, actual, rtol=0.0):
+    """
+    Compares two outputs of a target.
+
+    DataFrames and Series are compared by column name and as multisets of
+    rows, so the order of rows and columns does not matter but the dtypes
+    do. Tuples and lists are compared item by item. Exceptions are equal
+    when they are of the same type.
+
+    Parameters
+    ----------
+    expected, actual
+        The reference and candidate outputs
+    rtol : float, optional
+        The relative tolerance of float columns. The default is 0.0 or exact.
+
+    Returns
+    -------
+    list(String)
+        The differences, empty when the outputs are equivalent.
+
+    """
+    if isinstance(expected, BaseException) or isinstance(actual, BaseException):
+        if type(expected) is type(actual):
+            return []
+        return [f'reference gave {_describe(expected)}, candidate gave {_describe(actual)}']
+
+    if isinstance(expected, (tuple, list)):
+        if not isinstance(actual, (tuple, list)) or len(expected) != len(actual):
+            return [f'reference gave {_describe(expected)}, candidate gave {_describe(actual)}']
+        return [f'[{i}] {difference}' for i, (item, other) in enumerate(zip(expected, actual))
+                for difference in compare_outputs(item, other, rtol)]
+
+    if isinstance(expected, pd.Series):
+        if not isinstance(actual, pd.Series):
+            return [f'reference gave {_describe(expected)}, candidate gave {_describe(actual)}']
+        return compare_frames(expected.to_frame('value'), actual.to_frame('value'), rtol)
+
+    if isinstance(expected, pd.DataFrame):
+        if not isinstance(actual, pd.DataFrame):
+            return [f'reference gave {_describe(expected)}, candidate gave {_describe(actual)}']
+        return compare_frames(expected, actual, rtol)
+
+    return [] if expected == actual else [f'reference gave {expected!r}, candidate gave {actual!r}']
+
+
+def compare_frames(expected, actual, rtol=0.0):
+    """ Compares DataFrames by column name, dtype and multiset of rows. See compare_outputs. """
+    differences = []
+    missing = [col for col in expected.columns if col not in actual.columns]
+    extra = [col for col in actual.columns if col not in expected.columns]
+    if missing:
+        differences.append(f'columns missing from the candidate: {missing}')
+    if extra:
+        differences.append(f'columns only in the candidate: {extra}')
+    if len(expected) != len(actual):
+        differences.append(f'{len(expected)} rows in the reference, {len(actual)} in the candidate')
+
+    columns = [col for col in expected.columns if col in actual.columns]
+    for col in columns:
+        if expected[col].dtype != actual[col].dtype:
+            differences.append(f'column {col}: dtype {expected[col].dtype} in the reference, '
+                               f'{actual[col].dtype} in the candidate')
+    if differences:
+        return differences
+
+    try:
+        pd.testing.assert_frame_equal(_sort_rows(actual[columns]), _sort_rows(expected[columns]),
+                                      check_exact=rtol == 0, rtol=rtol or 1e-5)
+    except AssertionError as error:
+        differences.append(str(error))
+    return differences
+
+
+def check_target(name, candidate=None, raw_filepath=None, interim_filepath=None, synthetic=20, seed=0,
+                 repeat=1, rtol=0.0):
+    """
+    Runs the reference and a candidate of a target on its cases.
+
+    Parameters
+    ----------
+    name : String
+        The name of the target in TARGETS
+    candidate : callable, optional
+        The alternate implementation with the signature of the reference.
+        The default is None or the target's default candidate.
+    raw_filepath, interim_filepath : str, Path, optional
+        The directories of the shipped data. The defaults are data/raw and
+        data/interim. Real cases are skipped when their files are missing.
+    synthetic : int, optional
+        The number of synthetic cases. The default is 20.
+    seed : int, optional
+        The seed of the synthetic cases. The default is 0.
+    repeat : int, optional
+        The number of runs of each case to take the best time of. The default is 1.
+    rtol : float, optional
+        The relative tolerance of float columns. The default is 0.0 or exact.
+
+    Returns
+    -------
+    list(Result)
+        One result per case.
+
+    """
+    target = TARGETS[name]
+    candidate = candidate or target.candidate or target.reference
+
+    rng = random.Random(seed)
+    cases = list(_real_cases(name, raw_filepath, interim_filepath))
+    cases += [target.synthetic_case(rng, i) for i in range(synthetic)]
+
+    results = []
+    for case in cases:
+        expected, reference_seconds = _best_run(target.reference, case, repeat)
+        actual, candidate_seconds = _best_run(candidate, case, repeat)
+        results.append(Result(name, case.name, reference_seconds, candidate_seconds,
+                              compare_outputs(expected, actual, rtol)))
+    return results
+
+
+def fingerprint(output):
+    """
+    A digest of an output, equal for outputs that compare_outputs finds
+    equal without a tolerance. DataFrames and Series are hashed with their
+    dtypes, their columns in name order and their rows in _sort_rows order.
+    Lists and tuples give a list of fingerprints and exceptions their type name.
+    """
+    if isinstance(output, BaseException):
+        return type(output).__name__
+    if isinstance(output, (tuple, list)):
+        return [fingerprint(item) for item in output]
+    if isinstance(output, pd.Series):
+        output = output.to_frame('value')
+    if isinstance(output, pd.DataFrame):
+        df = _sort_rows(output[sorted(output.columns, key=str)])
+        dtypes = json.dumps([[str(col), str(dtype)] for col, dtype in df.dtypes.items()])
+        return hashlib.sha256((dtypes + df.to_csv(index=False)).encode('utf-8')).hexdigest()
+    return repr(output)
+
+
+def freeze_references(names=None, raw_filepath=None, interim_filepath=None, golden_filepath=None):
+    """
+    Saves the fingerprints of the reference outputs on the shipped data.
+
+    Parameters
+    ----------
+    names : list(String), optional
+        The targets to freeze. The default is None or every target.
+    raw_filepath, interim_filepath : str, Path, optional
+        The directories of the shipped data. The defaults are data/raw and data/interim.
+    golden_filepath : str, Path, optional
+        The fingerprint file, whose other targets are kept. The default is GOLDEN_FILEPATH.
+
+    Returns
+    -------
+    dict
+        Maps each target to the fingerprints of its cases.
+
+    """
+    golden_filepath = Path(golden_filepath or GOLDEN_FILEPATH)
+    golden = json.loads(golden_filepath.read_text()) if golden_filepath.exists() else {}
+    for name in names or TARGETS:
+        golden[name] = {case.name: fingerprint(_best_run(TARGETS[name].reference, case, 1)[0])
+                        for case in _real_cases(name, raw_filepath, interim_filepath)}
+
+    golden_filepath.parent.mkdir(parents=True, exist_ok=True)
+    golden_filepath.write_text(json.dumps(golden, indent=1, sort_keys=True) + '\n')
+    return golden
+
+
+def check_references(name, raw_filepath=None, interim_filepath=None, golden_filepath=None):
+    """
+    Compares the reference of a target with its frozen fingerprints.
+
+    Parameters
+    ----------
+    name : String
+        The name of the target in TARGETS
+    raw_filepath, interim_filepath : str, Path, optional
+        The directories of the shipped data. The defaults are data/raw and data/interim.
+    golden_filepath : str, Path, optional
+        The fingerprint file. The default is GOLDEN_FILEPATH.
+
+    Returns
+    -------
+    list(String)
+        The cases whose output changed or was never frozen, empty when the
+        reference is unchanged.
+
+    """
+    golden_filepath = Path(golden_filepath or GOLDEN_FILEPATH)
+    golden = json.loads(golden_filepath.read_text()).get(name, {}) if golden_filepath.exists() else {}
+
+    differences = []
+    for case in _real_cases(name, raw_filepath, interim_filepath):
+        if case.name not in golden:
+            differences.append(f'{case.name}: no frozen output')
+        elif fingerprint(_best_run(TARGETS[name].reference, case, 1)[0]) != golden[case.name]:
+            differences.append(f'{case.name}: the reference output changed')
+    return differences
+
+
+def load_candidate(path):
+    """ Imports a candidate given as 'module:function', e.g. 'src.data.fast:transform_district_name' """
+    module_name, _, function_name = path.partition(':')
+    if not function_name:
+        raise ValueError(f'candidate {path} must be given as module:function')
+    return getattr(import_module(module_name), function_name)
+
+
+# Makers
+
+def make_maker(maker, filepath):
+    """ The DataFrame the pandas engine makes from a raw file """
+    return engines.make_dataframe(maker, filepath, engine='pandas')
+
+
+def make_maker_polars(maker, filepath):
+    """ The DataFrame the polars engine makes from a raw file """
+    return engines.make_dataframe(maker, filepath, engine='polars')
+
+
+def _maker_real_cases(raw_filepath, interim_filepath):
+    for maker, filename in engines.RAW_FILENAMES.items():
+        for year in YEARS:
+            filepath = raw_filepath.joinpath(filename.format(year=year))
+            if filepath.exists():
+                yield Case(f'{maker.__name__} {filepath.name}', (maker, filepath))
+
+
+def _maker_synthetic_case(rng, i):
+    """ A raw file of a random maker with its data rows resampled and some fields blanked """
+    maker, filename = rng.choice(list(engines.RAW_FILENAMES.items()))
+    filepath = PROJECT_DIR.joinpath('data/raw', filename.format(year=rng.choice(YEARS)))
+    with open(filepath, newline='', encoding='utf-8', errors='replace') as f:
+        rows = list(csv.reader(io.StringIO(f.read().replace('\r\n', '\n').replace('\r', '\n'))))
+
+    # The header and the rows dropped by position stay at the top, the last two rows at the bottom
+    head = 1 + max(maker.drop_rows, default=-1) + 1
+    body = rows[head:-2]
+    body = [list(row) for row in rng.choices(body, k=rng.randint(1, 2 * len(body)))]
+    for row in body:
+        for j in range(len(row)):
+            if rng.random() < BLANK_SHARE:
+                row[j] = ''
+
+    synthetic_filepath = Path(_synthetic_directory(), f'{maker.__name__}_{i}.csv')
+    with open(synthetic_filepath, 'w', newline='', encoding='utf-8') as f:
+        csv.writer(f).writerows(rows[:head] + body + rows[-2:])
+    return Case(f'synthetic {maker.__name__} {i}', (maker, synthetic_filepath))
+
+
+# transform_district_name
+
+def _district_name_real_cases(raw_filepath, interim_filepath):
+    for year in YEARS:
+        filepath = raw_filepath.joinpath(f'census/saipe{year}.csv')
+        if filepath.exists():
+            names = pd.read_csv(filepath)['SD_NAME']
+            yield Case(f'census {year}', (names,))
+            yield Case(f'census {year} common changes', (names, '06'))
+    if interim_filepath.joinpath('districts.csv').exists():
+        yield Case('districts', (pd.read_csv(interim_filepath.joinpath('districts.csv'))['district_name'],))
+
+
+def _district_name_synthetic_case(rng, i):
+    names = []
+    for _ in range(rng.randint(0, 300)):
+        name = ' '.join(rng.choices(NAME_WORDS, k=rng.randint(1, 6)))
+        names.append(rng.choice([name, name.upper(), name.lower()]) if rng.random() > 0.02 else None)
+    state = rng.choice([builders.COLORADO, builders.COLORADO, '06'])
+    return Case(f'synthetic names {i}', (pd.Series(names, dtype=object), state))
+
+
+# make_tall
+
+def _floats(rng, n, missing=0.1):
+    return [rng.uniform(-100, 100) if rng.random() > missing else np.nan for _ in range(n)]
+
+
+# Makes the columns of synthetic DataFrames, of mixed dtypes and with missing values
+SYNTHETIC_COLUMNS = {'district_id': lambda rng, n: [rng.randint(1, 999) for _ in range(n)],
+                     'school_id': lambda rng, n: pd.array([rng.randint(1, 9999) if rng.random() > 0.1 else None
+                                                           for _ in range(n)], dtype='Int64'),
+                     'value': _floats,
+                     'name': lambda rng, n: [rng.choice(NAME_WORDS) if rng.random() > 0.1 else None
+                                             for _ in range(n)],
+                     'flag': lambda rng, n: [rng.random() > 0.5 for _ in range(n)],
+                     'emh': lambda rng, n: pd.Categorical([rng.choice('EMH') for _ in range(n)])}
+
+
+def make_tall(dataframes, id_col, id_name='year'):
+    """ DataFrameSet.make_tall of a list of DataFrames without saving """
+    dataframe_set = makers.DataFrameSet([None] * len(dataframes), [None] * len(dataframes), makers.Maker)
+    dataframe_set.dataframes = list(dataframes)
+    return dataframe_set.make_tall(id_col=tuple(id_col), id_name=id_name)
+
+
+def _make_tall_real_cases(raw_filepath, interim_filepath):
+    for maker in (makers.CensusMaker, makers.FinalMaker, makers.FrlMaker):
+        filepaths = [raw_filepath.joinpath(engines.RAW_FILENAMES[maker].format(year=year)) for year in YEARS]
+        if all(filepath.exists() for filepath in filepaths):
+            yield Case(f'{maker.__name__} tall', ([make_maker(maker, filepath) for filepath in filepaths], YEARS))
+
+
+def _make_tall_synthetic_case(rng, i):
+    num_dataframes = rng.randint(1, 4)
+    columns = rng.sample(list(SYNTHETIC_COLUMNS), rng.randint(1, len(SYNTHETIC_COLUMNS)))
+    dataframes = []
+    for _ in range(num_dataframes):
+        num_rows = rng.choice([0, 1, rng.randint(2, 100)])
+        # Columns missing from some frames are filled with NaN by concat
+        frame_columns = [col for col in columns if rng.random() > 0.2] or columns[:1]
+        dataframes.append(pd.DataFrame({col: SYNTHETIC_COLUMNS[col](rng, num_rows) for col in frame_columns}))
+    id_col = sorted(rng.sample(range(2000, 2030), num_dataframes))
+    return Case(f'synthetic tall {i}', (dataframes, id_col))
+
+
+# combine_datasets
+
+def combine(census, exp, kaggle):
+    """ combine_datasets writing into a temporary directory """
+    with tempfile.TemporaryDirectory() as directory:
+        return combine_datasets(directory, directory, census, exp, kaggle)
+
+
+@lru_cache(maxsize=1)
+def _combine_inputs(interim_filepath):
+    """ The census, exp and kaggle arguments of combine from the tall interim datasets """
+    datasets = {name: read_tall(interim_filepath, name) for name in TALL_FILENAMES}
+    kaggle = tuple(datasets[name] for name in ('change', 'coact', 'enroll', 'final', 'frl', 'remediation'))
+    return datasets['census'], datasets['exp'], kaggle + (pd.DataFrame(),)
+
+
+def _combine_real_cases(raw_filepath, interim_filepath):
+    if all(interim_filepath.joinpath(filename).exists() for filename in TALL_FILENAMES.values()):
+        yield Case('interim tall datasets', _combine_inputs(interim_filepath))
+
+
+def _combine_synthetic_case(rng, i):
+    """ The interim datasets with their rows shuffled and a random share of them dropped """
+    census, exp, kaggle = _combine_inputs(PROJECT_DIR.joinpath('data/interim'))
+    keep = rng.uniform(0.5, 1.0)
+    seed = rng.randrange(2 ** 32)
+
+    def sample(df):
+        return df.sample(frac=keep, random_state=seed) if len(df) else df
+
+    return Case(f'synthetic combine {i}', (sample(census), sample(exp), tuple(sample(df) for df in kaggle)))
+
+
+# fill_back_forward
+
+def _fill_real_cases(raw_filepath, interim_filepath):
+    filepath = interim_filepath.joinpath('all_data.csv')
+    if filepath.exists():
+        all_data = pd.read_csv(filepath)
+        columns = [col for col in PANEL_COLS if all_data[col].dtype != object]
+        datasets = [all_data[all_data['year'] == year].drop_duplicates(['school_id', 'emh'])
+                    for year in YEARS]
+        yield Case('all_data by year', (datasets, ['school_id', 'emh'], columns))
+
+
+def _fill_synthetic_case(rng, i):
+    columns = ['a', 'b', 'c']
+    datasets = []
+    for _ in range(rng.randint(2, 4)):
+        ids = sorted(rng.sample(range(60), rng.randint(1, 40)))
+        datasets.append(pd.DataFrame({'id': ids, **{col: _floats(rng, len(ids), 0.4) for col in columns}}))
+    return Case(f'synthetic fill {i}', (datasets, ['id'], columns[:rng.randint(1, 3)]))
+
+
+TARGETS = {'makers': Target(make_maker, _maker_real_cases, _maker_synthetic_case, make_maker_polars),
+           'transform_district_name': Target(builders.transform_district_name, _district_name_real_cases,
+                                             _district_name_synthetic_case),
+           'make_tall': Target(make_tall, _make_tall_real_cases, _make_tall_synthetic_case),
+           'combine_datasets': Target(combine, _combine_real_cases, _combine_synthetic_case),
+           'fill_back_forward': Target(fill_back_forward, _fill_real_cases, _fill_synthetic_case)}
+
+
+def _real_cases(name, raw_filepath=None, interim_filepath=None):
+    """ The cases of a target on the shipped data, from data/raw and data/interim by default """
+    raw_filepath = Path(raw_filepath or PROJECT_DIR.joinpath('data/raw'))
+    interim_filepath = Path(interim_filepath or PROJECT_DIR.joinpath('data/interim'))
+    return TARGETS[name].real_cases(raw_filepath, interim_filepath)
+
+
+def _best_run(function, case, repeat):
+    """ The output of function on fresh copies of the case and its best time in seconds """
+    times = []
+    for _ in range(repeat):
+        args, kwargs = copy.deepcopy(case.args), copy.deepcopy(case.kwargs)
+        start = time.perf_counter()
+        try:
+            output = function(*args, **kwargs)
+        except Exception as error:
+            output = error
+        times.append(time.perf_counter() - start)
+    return output, min(times)
+
+
+def _sort_rows(df):
+    """
+    The rows of df in an order that only depends on their values. Rows are
+    ordered by their other columns first and then by the values of their float
+    columns, so floats that differ within rtol keep the same order.
+    """
+    df = df.reset_index(drop=True)
+    floats = [col for col in df.columns if pd.api.types.is_float_dtype(df[col])]
+    others = df.drop(columns=floats)
+
+    keys = pd.DataFrame({f'float {i}': df[col] for i, col in enumerate(floats)}, index=df.index)
+    if len(others.columns):
+        # Missing values hash alike whether they are None, NaN or NA
+        text = others.astype(object).where(others.notna(), '').astype(str)
+        keys.insert(0, 'others', pd.util.hash_pandas_object(text, index=False))
+    if not len(keys.columns):
+        return df
+    order = keys.sort_values(list(keys.columns), kind='stable', na_position='last').index
+    return df.take(order).reset_index(drop=True)
+
+
+def _describe(output):
+    if isinstance(output, BaseException):
+        return f'{type(output).__name__}: {output}'
+    if isinstance(output, (pd.DataFrame, pd.Series)):
+        return f'{type(output).__name__} of shape {output.shape}'
+    if isinstance(output, (tuple, list)):
+        return f'{type(output).__name__} of {len(output)} items'
+    return repr(output)
+
+
+_SYNTHETIC_DIRECTORY = None
+
+
+def _synthetic_directory():
+    """ A temporary directory for the synthetic raw files, removed at exit """
+    global _SYNTHETIC_DIRECTORY
+    if _SYNTHETIC_DIRECTORY is None:
+        _SYNTHETIC_DIRECTORY = tempfile.TemporaryDirectory()
+    return _SYNTHETIC_DIRECTORY.name
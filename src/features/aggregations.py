@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Enrollment-weighted aggregates of school-level columns by group.
+
+School rates such as pct_fr or pct_hisp describe a school's students, so the
+rate of a district, county or the state is their mean weighted by enrollment
+(the total column of EnrollMaker). groupby.apply with weights calls Python
+once per group; here the group keys are factorized once into integer codes
+and every statistic is a np.bincount over those codes, for all columns at
+once.
+
+    groups = Groups(all_data, ['county', 'year'])
+    weighted_mean(all_data, groups, ['pct_fr', 'school_grade'])
+    weighted_stats(all_data, ['district_id', 'year'], ['pct_fr'], stats=('mean', 'std', 'share'))
+"""
+import numpy as np
+import pandas as pd
+
+from src.data.input_output_functions import to_numeric
+
+# The enrollment column the rates are weighted by
+WEIGHT = 'total'
+# The statistics computed by weighted_stats
+STATS = ('mean', 'var', 'std', 'sum', 'weight', 'count', 'share')
+# The student subgroups of all_data and the columns of their share of a school's students
+SUBGROUP_COLS = {'American Indian': 'pct_amind',
+                 'Asian': 'pct_asian',
+                 'Black': 'pct_black',
+                 'Hispanic': 'pct_hisp',
+                 'White': 'pct_white',
+                 'Pacific Islander': 'pct_pi',
+                 'Two or more': 'pct_2ormore',
+                 'Free or reduced lunch': 'pct_fr'}
+
+
+class Groups:
+    """ The group of each row of a DataFrame as integer codes, factorized once and reused """
+
+    def __init__(self, df, by=()):
+        """
+        Parameters
+        ----------
+        df : DataFrame
+            The rows to group
+        by : String, list(String), optional
+            The columns to group by. Rows with a missing key are left out,
+            as in groupby. The default is () or a single group of every row.
+        """
+        self.by = [by] if isinstance(by, str) else list(by)
+        if not self.by:
+            self.codes = np.zeros(len(df), dtype=np.int64)
+            self.keys = pd.DataFrame(index=range(1))
+            return
+
+        # Factorize each column, then the combination of their codes
+        col_codes, uniques = [], []
+        for col in self.by:
+            codes, values = pd.factorize(df[col], sort=True)
+            col_codes.append(codes)
+            uniques.append(values)
+        valid = np.logical_and.reduce([codes >= 0 for codes in col_codes])
+        combined = np.full(len(df), -1, dtype=np.int64)
+        combined[valid] = np.ravel_multi_index([codes[valid] for codes in col_codes],
+                                               [len(values) for values in uniques])
+
+        group_ids, combinations = pd.factorize(combined[valid], sort=True)
+        self.codes = combined
+        self.codes[valid] = group_ids
+        positions = np.unravel_index(combinations, [len(values) for values in uniques])
+        self.keys = pd.DataFrame({col: values.take(position) for col, values, position
+                                  in zip(self.by, uniques, positions)})
+
+
+    def __len__(self):
+        return len(self.keys)
+
+
+    def sum(self, values):
+        """ The sum of each group of a 1d array, with rows outside every group left out """
+        valid = self.codes >= 0
+        return np.bincount(self.codes[valid], weights=values[valid], minlength=len(self))
+
+
+    def broadcast(self, group_values):
+        """ The value of each row's group, NaN for rows outside every group """
+        values = np.full(len(self.codes), np.nan)
+        valid = self.codes >= 0
+        values[valid] = group_values[self.codes[valid]]
+        return values
+
+
+
+def weighted_stats(df, by, columns, weight=WEIGHT, stats=('mean',)):
+    """
+    Weighted statistics of many columns by group.
+
+    Parameters
+    ----------
+    df : DataFrame
+        One row per school, such as all_data
+    by : String, list(String), Groups
+        The columns to group by, or their Groups when they are reused
+    columns : String, list(String)
+        The columns to aggregate. Text numbers are converted to numbers.
+    weight : String, array, optional
+        The weight column or the weights of each row. Rows with a missing
+        value or weight are left out of that column's statistics.
+        The default is WEIGHT or enrollment.
+    stats : tuple(String), optional
+        The statistics of STATS to compute for each column:
+            mean: the weighted mean
+            var, std: the weighted variance and standard deviation, treating
+                weights as the number of students with the value
+            sum: the weighted sum, e.g. the number of students of a subgroup
+                when the column is the subgroup's share
+            weight: the total weight of the rows with a value
+            count: the number of rows with a value
+            share: the group's weight as a share of the weight of all groups
+        The default is ('mean',).
+
+    Returns
+    -------
+    DataFrame
+        The group keys and a column per column and statistic, named
+        {col}_{stat} or only col when a single statistic is asked for.
+
+    """
+    unknown = [stat for stat in stats if stat not in STATS]
+    if unknown:
+        raise ValueError(f'stats {unknown} must be in {STATS}')
+    columns = [columns] if isinstance(columns, str) else list(columns)
+    groups = by if isinstance(by, Groups) else Groups(df, by)
+    weights = to_numeric(df[weight]).to_numpy() if isinstance(weight, str) else np.asarray(weight, dtype=float)
+
+    results = {}
+    for col in columns:
+        values = to_numeric(df[col]).to_numpy()
+        present = ~(np.isnan(values) | np.isnan(weights))
+        w = np.where(present, weights, 0.0)
+        x = np.where(present, values, 0.0)
+
+        total_weight = groups.sum(w)
+        weighted_sum = groups.sum(w * x)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = weighted_sum / total_weight
+            column_stats = {'mean': mean, 'sum': weighted_sum, 'weight': total_weight,
+                            'count': groups.sum(present.astype(float)),
+                            'share': total_weight / total_weight.sum()}
+            if 'var' in stats or 'std' in stats:
+                # Two passes, the squared deviations from the group means, to avoid cancellation
+                deviation = np.where(present, x - groups.broadcast(mean), 0.0)
+                column_stats['var'] = groups.sum(w * deviation ** 2) / total_weight
+                column_stats['std'] = np.sqrt(column_stats['var'])
+
+        for stat in stats:
+            results[col if len(stats) == 1 else f'{col}_{stat}'] = column_stats[stat]
+
+    return pd.concat((groups.keys, pd.DataFrame(results)), axis=1)
+
+
+def weighted_mean(df, by, columns, weight=WEIGHT):
+    """ The weighted mean of each column by group, see weighted_stats """
+    return weighted_stats(df, by, columns, weight, stats=('mean',))
+
+
+def weighted_var(df, by, columns, weight=WEIGHT):
+    """ The weighted variance of each column by group, see weighted_stats """
+    return weighted_stats(df, by, columns, weight, stats=('var',))
+
+
+def weight_shares(df, by, weight=WEIGHT, within=()):
+    """
+    The share of the weight of each group, such as a district's share of the
+    state's students, within the groups of the columns of within.
+    """
+    within = [within] if isinstance(within, str) else list(within)
+    by = [by] if isinstance(by, str) else list(by)
+    groups = Groups(df, by)
+    weights = np.nan_to_num(to_numeric(df[weight]).to_numpy())
+    totals = groups.keys.copy()
+    totals[weight] = groups.sum(weights)
+
+    parent_totals = totals.groupby(within)[weight].transform('sum') if within else totals[weight].sum()
+    totals['share'] = totals[weight] / parent_totals
+    return totals
+
+
+def subgroup_means(df, by, columns, subgroups=SUBGROUP_COLS, weight=WEIGHT):
+    """
+    The mean of each column over the students of each subgroup, such as the
+    mean school grade of the school attended by a Hispanic student.
+
+    Each school is weighted by its number of students in the subgroup,
+    enrollment times the subgroup's share. The groups are factorized once
+    for every subgroup.
+
+    Returns
+    -------
+    DataFrame
+        The group keys, a subgroup column and the mean of each column,
+        including 'All students'.
+
+    """
+    groups = Groups(df, by)
+    enrollment = to_numeric(df[weight]).to_numpy()
+    weights = {'All students': enrollment}
+    weights.update({name: enrollment * to_numeric(df[col]).to_numpy() for name, col in subgroups.items()})
+
+    means = []
+    for name, subgroup_weights in weights.items():
+        subgroup = weighted_stats(df, groups, columns, subgroup_weights)
+        subgroup.insert(len(groups.by), 'subgroup', name)
+        means.append(subgroup)
+    return pd.concat(means, ignore_index=True)
@@ -1,7 +1,24 @@
+from pathlib import Path
+import numpy as np
 import pandas as pd
+from src.data.input_output_functions import read_partitioned, to_numeric, write_partitioned
 
 NO_FILL = ['school', 'school_id', 'district_name', 'district_id']
 
+# The columns identifying a school-year in the panel
+PANEL_KEYS = ['school_id', 'district_id', 'emh', 'year']
+# The columns to derive panel features from
+PANEL_COLS = ['school_grade',
+              'read_achievement',
+              'math_achievement',
+              'write_achievement',
+              'science_achievement',
+              'overall_weighted_growth',
+              'pct_fr',
+              'child_pov_ratio',
+              'sum_per_pupil',
+              'total']
+
 def fill_back_forward(datasets, merge_on, columns):
     """
     Fills na values in datasets by backfilling from the most recent observations
@@ -165,3 +182,133 @@ def fill_back_forward(datasets, merge_on, columns):
     return extract_datasets(merged_df, merged_on=merge_on,
                             num_datasets = len(datasets), 
                             all_columns = datasets[0].columns)
+
+
+
+def build_panel_features(df, columns=PANEL_COLS, entity='school_id', group='district_id',
+                         time='year', window=2):
+    """
+    Derives per-school panel features from a tall dataset such as all_data.
+    Every feature is computed for all columns at once from groupby shifts over
+    the data sorted by entity and time, without looping over schools.
+    
+    A school's series is keyed on the entity and the other PANEL_KEYS in df,
+    such as emh, so a school with elementary and middle rows has one series
+    for each. For each column the features are
+        {col}_lag: the value of the previous year
+        {col}_delta: the change from the previous year
+        {col}_rolling: the mean over the last window years, leaving out the
+            years the school has no row for
+        {col}_district_z: the z-score within the district and year
+
+    Parameters
+    ----------
+    df : DataFrame
+        A tall dataset with one row per entity, emh and time
+    columns : list(String), optional
+        The columns to derive features from. The default is PANEL_COLS.
+    entity : String, optional
+        The column identifying a school. The default is 'school_id'.
+    group : String, optional
+        The column to compute relative z-scores within. The default is 'district_id'.
+    time : String, optional
+        The time column. The default is 'year'.
+    window : int, optional
+        The number of years in the rolling mean. The default is 2.
+
+    Returns
+    -------
+    DataFrame
+        The keys, the original columns and the derived float32 features,
+        sorted by entity, emh and time.
+
+    """
+    keys = [col for col in PANEL_KEYS if col in df.columns and col not in (entity, group, time)]
+    panel = df[[entity, group, time] + keys + list(columns)].copy()
+    panel = panel.dropna(subset=[entity])
+    for col in columns:
+        panel[col] = to_numeric(panel[col]).astype(np.float32)
+    
+    # Repeated rows of a series in a year are averaged, so that every series
+    # has at most one row per year. A missing emh is a series of its own.
+    series = [entity] + keys
+    panel = panel.groupby(series + [time], as_index=False, sort=True, dropna=False).agg(
+        {group: 'first', **{col: 'mean' for col in columns}})
+    
+    values = panel[columns]
+    entities = panel.groupby(series, sort=False, dropna=False)
+    
+    # The previous row is only the previous year when no year is missing
+    consecutive = (panel[time] - entities[time].shift(1)) == 1
+    lag = entities[columns].shift(1).where(consecutive, np.nan)
+    
+    # The mean of the rows of the last window years. The row k back is one of
+    # them unless a gap puts it further back.
+    window_values = [values]
+    for k in range(1, window):
+        in_window = (panel[time] - entities[time].shift(k)) < window
+        window_values.append(entities[columns].shift(k).where(in_window, np.nan))
+    counts = sum(frame.notna().astype(np.float32) for frame in window_values)
+    rolling = sum(frame.fillna(0) for frame in window_values) / counts.replace(0, np.nan)
+    
+    groups = panel.groupby([group, time], sort=False)[columns]
+    mean = groups.transform('mean')
+    std = groups.transform('std').replace(0, np.nan)
+    
+    features = [panel[[entity, group, time] + keys + list(columns)],
+                lag.add_suffix('_lag'),
+                (values - lag).add_suffix('_delta'),
+                rolling.add_suffix('_rolling'),
+                ((values - mean) / std).add_suffix('_district_z')]
+    
+    panel = pd.concat(features, axis=1)
+    feature_cols = panel.columns.difference([entity, group, time] + keys)
+    panel[feature_cols] = panel[feature_cols].astype(np.float32)
+    
+    return panel
+
+
+def save_features(features, root, file_format='parquet'):
+    """
+    Saves the feature table partitioned by year. Parquet keeps the column
+    types, so the clustering and hypothesis testing code can read it directly.
+    """
+    write_partitioned(features, root, partition_cols=('year',), file_format=file_format)
+
+
+def load_features(root, columns=None, years=None):
+    """
+    Loads the feature table saved by save_features.
+
+    Parameters
+    ----------
+    root : str, Path
+        The directory of the feature table
+    columns : list(String), optional
+        The columns to read. The default is None or all columns.
+    years : list(int), optional
+        The years to read. The default is None or all years.
+
+    Returns
+    -------
+    DataFrame
+
+    """
+    filters = None if years is None else {'year': list(years)}
+    return read_partitioned(root, filters=filters, columns=columns)
+
+
+def main(input_filepath, output_filepath, file_format='parquet'):
+    all_data = pd.read_csv(Path(input_filepath).joinpath('all_data.csv'))
+    features = build_panel_features(all_data)
+    save_features(features, Path(output_filepath).joinpath('features'), file_format)
+    
+    return features
+
+
+if __name__ == '__main__':
+    project_dir = Path(__file__).resolve().parents[2]
+    input_filepath = project_dir.joinpath('data/interim')
+    output_filepath = project_dir.joinpath('data/processed')
+    
+    main(input_filepath, output_filepath)
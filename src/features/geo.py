@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Locates schools by the centroid of their ZIP code and indexes them for
+nearest-neighbour and radius queries.
+
+The ZIP centroids are read from the offline table data/raw/geo/zip_centroids.csv.
+Locations are indexed as points on the unit sphere in a KD-tree, where the
+straight-line (chord) distance orders points the same way as the great-circle
+distance.
+"""
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+# The mean radius of the earth
+EARTH_RADIUS_KM = 6371.0088
+
+
+def load_zip_centroids(filepath):
+    """ Loads the offline ZIP code centroid table """
+    centroids = pd.read_csv(filepath, dtype={'zipcode': str})
+    return centroids[['zipcode', 'latitude', 'longitude']]
+
+
+def locate_schools(address, centroids):
+    """
+    Joins the schools of the AddressMaker output to their ZIP code centroids.
+
+    Parameters
+    ----------
+    address : DataFrame
+        The tall address dataset with school_id, district_id, zipcode and year
+    centroids : DataFrame
+        The table returned by load_zip_centroids
+
+    Returns
+    -------
+    DataFrame
+        One row per school from its most recent address, with its latitude and
+        longitude. Schools whose ZIP code is unknown are dropped.
+
+    """
+    schools = address.dropna(subset=['school_id', 'zipcode'])
+    schools = schools.sort_values('year').drop_duplicates('school_id', keep='last')
+
+    schools = schools[['school_id', 'district_id', 'school', 'city', 'zipcode']].copy()
+    # Keep the 5 digit ZIP code of ZIP+4 codes and codes read as numbers
+    schools['zipcode'] = schools['zipcode'].astype(str).str.extract(r'^(\d{5})', expand=False)
+
+    return pd.merge(schools, centroids, on='zipcode').reset_index(drop=True)
+
+
+class SchoolIndex:
+    """ A spatial index over school locations """
+
+    def __init__(self, schools):
+        """
+        Parameters
+        ----------
+        schools : DataFrame
+            Schools with latitude and longitude, such as the output of locate_schools
+        """
+        self.schools = schools.reset_index(drop=True)
+        self.tree = cKDTree(_to_unit_vectors(self.schools['latitude'].to_numpy(),
+                                             self.schools['longitude'].to_numpy()))
+
+
+    def query_nearest(self, latitude, longitude, k=5):
+        """
+        Finds the k nearest schools to one or many points.
+
+        Returns
+        -------
+        distances : ndarray
+            The distances in km, of shape (points, k)
+        positions : ndarray
+            The row positions of the schools in self.schools
+
+        """
+        k = min(k, len(self.schools))
+        chords, positions = self.tree.query(_to_unit_vectors(latitude, longitude), k=k)
+        return _chord_to_km(chords), positions
+
+
+    def query_radius(self, latitude, longitude, radius_km):
+        """
+        Finds the schools within radius_km of one or many points.
+
+        Returns
+        -------
+        list(ndarray)
+            The row positions in self.schools of the schools within radius_km
+            of each point
+
+        """
+        points = _to_unit_vectors(latitude, longitude)
+        neighbours = self.tree.query_ball_point(points, _km_to_chord(radius_km))
+        return [np.asarray(positions, dtype=np.int64) for positions in neighbours]
+
+
+    def nearest(self, latitude, longitude, k=5):
+        """ Returns the k nearest schools to a point with their distance_km """
+        _check_single_point(latitude, longitude)
+        distances, positions = self.query_nearest(latitude, longitude, k)
+        nearest = self.schools.iloc[np.atleast_1d(positions[0])].copy()
+        nearest['distance_km'] = np.atleast_1d(distances[0])
+        return nearest
+
+
+    def within(self, latitude, longitude, radius_km):
+        """ Returns the schools within radius_km of a point with their distance_km """
+        _check_single_point(latitude, longitude)
+        positions = self.query_radius(latitude, longitude, radius_km)[0]
+        within = self.schools.iloc[positions].copy()
+        within['distance_km'] = haversine_km(latitude, longitude,
+                                             within['latitude'].to_numpy(),
+                                             within['longitude'].to_numpy())
+        return within.sort_values('distance_km')
+
+
+    def neighbourhood_mean(self, values, radius_km, include_self=False):
+        """
+        Computes, for every school, the mean of values over the schools within
+        radius_km, e.g. the neighbourhood average of pct_fr.
+
+        Parameters
+        ----------
+        values : Series
+            Values indexed by school_id. Missing values are ignored.
+        radius_km : float
+            The neighbourhood radius
+        include_self : bool, optional
+            Whether a school is part of its own neighbourhood. The default is False.
+
+        Returns
+        -------
+        Series
+            The neighbourhood mean indexed by school_id.
+
+        """
+        adjacency = self.adjacency(radius_km, include_self)
+
+        aligned = values.reindex(self.schools['school_id']).to_numpy(dtype=np.float64)
+        present = ~np.isnan(aligned)
+        totals = adjacency @ np.where(present, aligned, 0)
+        counts = adjacency @ present.astype(np.float64)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = totals / counts
+        return pd.Series(means, index=self.schools['school_id'], name=f'{values.name}_within_{radius_km}km')
+
+
+    def adjacency(self, radius_km, include_self=False):
+        """ The sparse matrix linking every pair of schools within radius_km """
+        pairs = self.tree.query_pairs(_km_to_chord(radius_km), output_type='ndarray')
+        rows = np.concatenate((pairs[:, 0], pairs[:, 1]))
+        cols = np.concatenate((pairs[:, 1], pairs[:, 0]))
+
+        n = len(self.schools)
+        adjacency = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n))
+        if include_self:
+            adjacency = adjacency + sparse.identity(n, format='csr')
+        return adjacency
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """ The great-circle distance in km between points given in degrees """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def _check_single_point(latitude, longitude):
+    """ Raises a ValueError unless latitude and longitude are a single point """
+    if np.size(latitude) != 1 or np.size(longitude) != 1:
+        raise ValueError('latitude and longitude must be a single point, use the query_* methods for many points')
+
+
+def _to_unit_vectors(latitude, longitude):
+    """ Converts degrees to points on the unit sphere """
+    lat = np.radians(np.atleast_1d(np.asarray(latitude, dtype=np.float64)))
+    lon = np.radians(np.atleast_1d(np.asarray(longitude, dtype=np.float64)))
+    return np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+
+
+def _km_to_chord(distance_km):
+    return 2 * np.sin(distance_km / (2 * EARTH_RADIUS_KM))
+
+
+def _chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(chord, 0, 2) / 2)
+
+
+def main(raw_filepath, input_filepath, output_filepath):
+    """ Saves the location of every school to school_locations.csv """
+    centroids = load_zip_centroids(Path(raw_filepath).joinpath('geo/zip_centroids.csv'))
+    address = pd.read_csv(Path(input_filepath).joinpath('kaggle/address_tall.csv'))
+
+    schools = locate_schools(address, centroids)
+    schools.to_csv(Path(output_filepath).joinpath('school_locations.csv'), index=False)
+
+    return schools
+
+
+if __name__ == '__main__':
+    project_dir = Path(__file__).resolve().parents[2]
+    raw_filepath = project_dir.joinpath('data/raw')
+    input_filepath = project_dir.joinpath('data/interim')
+    output_filepath = project_dir.joinpath('data/processed')
+
+    main(raw_filepath, input_filepath, output_filepath)
@@ -0,0 +1,400 @@
+# -*- coding: utf-8 -*-
+"""
+Permutation and bootstrap tests of the effect of expenditures on performance.
+
+Resamples are drawn as index matrices and the test statistics of a whole chunk
+of resamples are computed with matrix operations. Chunks bound the memory used,
+the random generator is seeded, and the resamples can be sharded over worker
+processes with independent seeds.
+
+Supported statistics
+--------------------
+correlation
+    The Pearson correlation of x and y
+mean_difference
+    The mean of y where x is true minus the mean of y where x is false
+regression
+    The coefficient of x when y is regressed on x and the covariates
+"""
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from src.data.input_output_functions import to_numeric
+
+STATISTICS = ('correlation', 'mean_difference', 'regression')
+
+# The expenditure columns from ExpenditureMaker._extract_data
+SPENDING_COLS = ['instruction_total', 'support_total', 'community_total', 'other_total', 'sum_total',
+                 'instruction_per_pupil', 'support_per_pupil', 'community_per_pupil',
+                 'other_per_pupil', 'sum_per_pupil']
+# The performance columns of all_data
+PERFORMANCE_COLS = ['school_grade', 'read_achievement', 'math_achievement', 'write_achievement',
+                    'science_achievement', 'overall_weighted_growth']
+
+# The number of resamples computed at once
+CHUNK_SIZE = 1000
+
+
+@dataclass
+class TestResult:
+    """ The result of a permutation or bootstrap test """
+    statistic: str
+    observed: float
+    pvalue: float
+    n_resamples: int
+    # The statistic of every resample
+    distribution: np.ndarray
+    # The percentile confidence interval of a bootstrap test
+    confidence_interval: tuple = None
+
+
+def district_year_table(all_data, performance_cols=PERFORMANCE_COLS, spending_cols=SPENDING_COLS):
+    """
+    Aggregates all_data to one row per district and year, the level the
+    expenditures are reported at. Performance is averaged over the schools of
+    the district, and spending is the same for every school of a district.
+
+    Parameters
+    ----------
+    all_data : DataFrame
+        The combined dataset
+    performance_cols : list(String), optional
+        The columns to average. The default is PERFORMANCE_COLS.
+    spending_cols : list(String), optional
+        The expenditure columns. The default is SPENDING_COLS.
+
+    Returns
+    -------
+    DataFrame
+        One row per district_id and year.
+
+    """
+    df = all_data[['district_id', 'year'] + list(performance_cols) + list(spending_cols)].copy()
+    for col in list(performance_cols) + list(spending_cols):
+        df[col] = to_numeric(df[col])
+
+    aggregations = {col: 'mean' for col in performance_cols}
+    aggregations.update({col: 'first' for col in spending_cols})
+
+    return df.groupby(['district_id', 'year'], as_index=False).agg(aggregations)
+
+
+def permutation_test(x, y, statistic='correlation', covariates=None, strata=None,
+                     n_resamples=10_000, alternative='two-sided', chunk_size=CHUNK_SIZE,
+                     seed=0, jobs=1):
+    """
+    Tests whether y depends on x by permuting y.
+
+    Parameters
+    ----------
+    x : array-like
+        The explanatory values, such as per-pupil spending. Must be boolean
+        for the mean_difference statistic.
+    y : array-like
+        The outcome, such as school_grade
+    statistic : String, optional
+        One of STATISTICS. The default is 'correlation'.
+    covariates : array-like, optional
+        Columns to control for with the regression statistic. The residuals
+        of y are permuted (Freedman-Lane). The default is None.
+    strata : array-like, optional
+        Labels such as the year. y is only permuted within each stratum.
+        The default is None.
+    n_resamples : int, optional
+        The number of permutations. The default is 10_000.
+    alternative : String, optional
+        'two-sided', 'greater' or 'less'. The default is 'two-sided'.
+    chunk_size : int, optional
+        The number of permutations computed at once. The default is CHUNK_SIZE.
+    seed : int, optional
+        The seed of the random generator. The default is 0.
+    jobs : int, optional
+        The number of worker processes. The default is 1.
+
+    Returns
+    -------
+    TestResult
+
+    """
+    x, y, covariates, strata = _prepare(x, y, statistic, covariates, strata)
+    # The data is sorted by stratum so that each stratum is a contiguous block
+    order = np.argsort(strata, kind='stable')
+    x, y, strata = x[order], y[order], strata[order]
+    if covariates is not None:
+        covariates = covariates[order]
+
+    kernel = _PermutationKernel(x, y, statistic, covariates)
+    observed = kernel(np.arange(len(y))[np.newaxis, :])[0]
+
+    distribution = _run_shards(_permutation_shard, (kernel, strata, chunk_size),
+                               n_resamples, seed, jobs)
+
+    return TestResult(statistic, observed, _permutation_pvalue(observed, distribution, alternative),
+                      n_resamples, distribution)
+
+
+def bootstrap_test(x, y, statistic='correlation', covariates=None, strata=None,
+                   n_resamples=10_000, confidence_level=0.95, chunk_size=CHUNK_SIZE,
+                   seed=0, jobs=1):
+    """
+    Estimates the distribution of a statistic by resampling rows with replacement.
+
+    The parameters are the same as permutation_test. Rows are resampled within
+    each stratum. The p-value is found by inverting the percentile interval,
+    i.e. it is the smallest two-sided level at which the interval excludes 0.
+
+    Returns
+    -------
+    TestResult
+        With the percentile confidence interval.
+
+    """
+    x, y, covariates, strata = _prepare(x, y, statistic, covariates, strata)
+    kernel = _BootstrapKernel(x, y, statistic, covariates)
+    observed = kernel(np.arange(len(y))[np.newaxis, :])[0]
+
+    distribution = _run_shards(_bootstrap_shard, (kernel, strata, chunk_size),
+                               n_resamples, seed, jobs)
+
+    valid = distribution[~np.isnan(distribution)]
+    tail = (1 - confidence_level) / 2
+    interval = tuple(np.quantile(valid, [tail, 1 - tail]))
+    pvalue = min(1.0, 2 * min(np.mean(valid <= 0), np.mean(valid >= 0)))
+
+    return TestResult(statistic, observed, pvalue, n_resamples, distribution, interval)
+
+
+def spending_effects(table, spending_cols, performance_col='school_grade', method='permutation',
+                     statistic='correlation', strata_col='year', **test_params):
+    """
+    Runs a test of every spending column against a performance column over
+    district×year groups, permuting or resampling within each year.
+
+    Parameters
+    ----------
+    table : DataFrame
+        A table such as the one returned by district_year_table or the
+        feature table from build_features.load_features
+    spending_cols : list(String)
+        The expenditure columns to test
+    performance_col : String, optional
+        The outcome. The default is 'school_grade'.
+    method : String, optional
+        'permutation' or 'bootstrap'. The default is 'permutation'.
+    statistic : String, optional
+        One of STATISTICS. The default is 'correlation'.
+    strata_col : String, optional
+        The column to stratify by. The default is 'year'.
+    **test_params
+        Passed on to the test
+
+    Returns
+    -------
+    DataFrame
+        The observed statistic and p-value of each spending column.
+
+    """
+    test = permutation_test if method == 'permutation' else bootstrap_test
+
+    rows = []
+    for col in spending_cols:
+        df = table[[col, performance_col, strata_col]].dropna()
+        result = test(df[col], df[performance_col], statistic=statistic,
+                      strata=df[strata_col], **test_params)
+        rows.append({'spending': col, 'performance': performance_col, 'statistic': statistic,
+                     'observed': result.observed, 'pvalue': result.pvalue, 'n': len(df)})
+
+    return pd.DataFrame(rows)
+
+
+def _prepare(x, y, statistic, covariates, strata):
+    """ Validates the inputs and converts them to float arrays """
+    if statistic not in STATISTICS:
+        raise ValueError(f'statistic must be one of {STATISTICS}')
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if x.shape != y.shape or x.ndim != 1:
+        raise ValueError('x and y must be one dimensional and of the same length')
+    if np.isnan(x).any() or np.isnan(y).any():
+        raise ValueError('x and y must not contain missing values')
+
+    if statistic == 'mean_difference' and not np.isin(x, (0, 1)).all():
+        raise ValueError('x must be boolean for the mean_difference statistic')
+
+    if covariates is not None:
+        if statistic != 'regression':
+            raise ValueError('covariates are only supported by the regression statistic')
+        covariates = np.asarray(covariates, dtype=np.float64).reshape(len(y), -1)
+
+    if strata is None:
+        strata = np.zeros(len(y), dtype=np.int64)
+    else:
+        strata = pd.factorize(np.asarray(strata))[0]
+
+    return x, y, covariates, strata
+
+
+def _design(x, covariates):
+    """ The design matrix of an intercept, x and the covariates """
+    columns = [np.ones_like(x), x]
+    if covariates is not None:
+        columns.extend(covariates.T)
+    return np.column_stack(columns)
+
+
+class _PermutationKernel:
+    """
+    Maps a (resamples, n) matrix of permutations of y to the statistic of each
+    permutation. Everything that does not depend on the permutation is computed
+    once here. It is a class so that it can be sent to worker processes.
+    """
+
+    def __init__(self, x, y, statistic, covariates):
+        self.statistic = statistic
+        n = len(y)
+
+        if statistic == 'correlation':
+            self.x = (x - x.mean()) / (x.std() * n)
+            self.y = (y - y.mean()) / y.std()
+        elif statistic == 'mean_difference':
+            self.x = x.astype(bool)
+            self.y = y
+            self.n1 = self.x.sum()
+            self.n0 = n - self.n1
+            self.total = y.sum()
+        else:
+            # By Frisch-Waugh-Lovell, the coefficient of x is the slope of the
+            # residuals of y on the residuals of x after removing the covariates
+            base = np.ones((n, 1)) if covariates is None else np.column_stack([np.ones(n), covariates])
+            residual_x = x - base @ np.linalg.lstsq(base, x, rcond=None)[0]
+            self.y = y - base @ np.linalg.lstsq(base, y, rcond=None)[0]
+            self.x = residual_x / (residual_x @ residual_x)
+
+
+    def __call__(self, indices):
+        if self.statistic == 'mean_difference':
+            group_sum = self.y[indices] @ self.x
+            return group_sum / self.n1 - (self.total - group_sum) / self.n0
+
+        # The correlation and the regression coefficient are both a dot product
+        return self.y[indices] @ self.x
+
+
+
+class _BootstrapKernel:
+    """ Maps a (resamples, n) matrix of resampled row indices to the statistic of each resample """
+
+    def __init__(self, x, y, statistic, covariates):
+        self.statistic = statistic
+        self.x = x
+        self.y = y
+        if statistic == 'mean_difference':
+            self.x = x.astype(bool)
+        elif statistic == 'regression':
+            self.design = _design(x, covariates)
+
+
+    def __call__(self, indices):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if self.statistic == 'correlation':
+                return self._correlation(indices)
+            if self.statistic == 'mean_difference':
+                return self._mean_difference(indices)
+            return self._regression(indices)
+
+
+    def _correlation(self, indices):
+        xb = self.x[indices]
+        yb = self.y[indices]
+        xb = xb - xb.mean(axis=1, keepdims=True)
+        yb = yb - yb.mean(axis=1, keepdims=True)
+        return (xb * yb).sum(axis=1) / np.sqrt((xb**2).sum(axis=1) * (yb**2).sum(axis=1))
+
+
+    def _mean_difference(self, indices):
+        gb = self.x[indices]
+        yb = self.y[indices]
+        n1 = gb.sum(axis=1)
+        return (yb * gb).sum(axis=1) / n1 - (yb * ~gb).sum(axis=1) / (indices.shape[1] - n1)
+
+
+    def _regression(self, indices):
+        # Solve the normal equations of every resample at once
+        db = self.design[indices]
+        yb = self.y[indices]
+        gram = np.einsum('rnp,rnq->rpq', db, db)
+        moment = np.einsum('rnp,rn->rp', db, yb)
+
+        coefficients = np.full(moment.shape, np.nan)
+        # Resamples that drew a single value of x have no unique solution
+        solvable = np.linalg.matrix_rank(gram) == gram.shape[1]
+        coefficients[solvable] = np.linalg.solve(gram[solvable], moment[solvable][..., np.newaxis])[..., 0]
+        return coefficients[:, 1]
+
+
+def _permutation_shard(kernel, strata, chunk_size, n_resamples, seed):
+    """ Computes n_resamples permuted statistics. The data must be sorted by strata. """
+    rng = np.random.default_rng(seed)
+    distribution = np.empty(n_resamples)
+    n = len(strata)
+
+    for start in range(0, n_resamples, chunk_size):
+        size = min(chunk_size, n_resamples - start)
+        # Sorting random keys offset by the stratum permutes within each stratum
+        keys = rng.random((size, n)) + strata
+        indices = np.argsort(keys, axis=1)
+        distribution[start:start + size] = kernel(indices)
+
+    return distribution
+
+
+def _bootstrap_shard(kernel, strata, chunk_size, n_resamples, seed):
+    """ Computes n_resamples bootstrap statistics, resampling within each stratum """
+    rng = np.random.default_rng(seed)
+    distribution = np.empty(n_resamples)
+
+    # The rows and size of each stratum
+    order = np.argsort(strata, kind='stable')
+    counts = np.bincount(strata)
+    offsets = np.repeat(np.concatenate(([0], np.cumsum(counts)[:-1])), counts)
+    sizes = np.repeat(counts, counts)
+
+    for start in range(0, n_resamples, chunk_size):
+        size = min(chunk_size, n_resamples - start)
+        # Each position draws a row from the stratum it belongs to
+        draws = (rng.random((size, len(strata))) * sizes).astype(np.int64) + offsets
+        distribution[start:start + size] = kernel(order[draws])
+
+    return distribution
+
+
+def _run_shards(shard, args, n_resamples, seed, jobs):
+    """ Splits the resamples over jobs processes with independent seeds """
+    seeds = np.random.SeedSequence(seed).spawn(max(jobs, 1))
+    sizes = [len(part) for part in np.array_split(np.arange(n_resamples), len(seeds))]
+
+    if jobs <= 1:
+        return shard(*args, sizes[0], seeds[0])
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(shard, *args, size, shard_seed)
+                   for size, shard_seed in zip(sizes, seeds)]
+        return np.concatenate([future.result() for future in futures])
+
+
+def _permutation_pvalue(observed, distribution, alternative):
+    """ The permutation p-value, counting the observed statistic as one of the resamples """
+    if alternative == 'greater':
+        extreme = distribution >= observed
+    elif alternative == 'less':
+        extreme = distribution <= observed
+    elif alternative == 'two-sided':
+        extreme = np.abs(distribution) >= abs(observed)
+    else:
+        raise ValueError("alternative must be 'two-sided', 'greater' or 'less'")
+
+    return (extreme.sum() + 1) / (len(distribution) + 1)
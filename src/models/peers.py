@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+Finds comparable schools: the schools of the same year and level with the
+nearest lunch share, enrollment and district poverty, optionally only those
+with better growth.
+
+Each school-year is a standardized vector of PEER_FEATURES. The vectors are
+split into blocks by year and emh, so a filtered query only searches its own
+block. A block is searched exactly with a BallTree, or, when it has more than
+IVF_MIN_ROWS rows, with an inverted file: the vectors are clustered with
+k-means and a query only compares the vectors of its n_probe nearest clusters.
+peer_groups queries every school of a block at once.
+
+    index = PeerIndex(pd.read_csv('data/interim/all_data.csv'))
+    index.peers(school_id=10, year=2012, k=5, better_growth=True)
+"""
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+
+from src.data.input_output_functions import to_numeric
+from src.models.train_model import fit_kmeans, standardize
+
+# The features that make schools comparable. total is compared on a log scale.
+PEER_FEATURES = ['pct_fr', 'total', 'child_pov_ratio']
+# The growth peers are asked to beat
+GROWTH = 'overall_weighted_growth'
+# The columns a block is made of, a query only compares schools of the same block
+BLOCK_COLS = ['year', 'emh']
+# The columns identifying a school-year and describing it in the results
+INFO_COLS = ['school_id', 'school', 'district_id', 'district_name', 'year', 'emh']
+# Blocks with more rows than this are searched with an inverted file instead of a BallTree.
+# On the three PEER_FEATURES a BallTree is still about 5 times faster at 200,000 rows.
+IVF_MIN_ROWS = 1_000_000
+# The clusters of an inverted file searched per query
+N_PROBE = 8
+
+
+class IVFIndex:
+    """ An approximate nearest-neighbour index searching only the clusters nearest a query """
+
+    def __init__(self, X, n_lists=None, n_probe=N_PROBE, random_state=0):
+        """
+        Parameters
+        ----------
+        X : ndarray
+            The standardized float32 vectors
+        n_lists : int, optional
+            The number of clusters. The default is None or about sqrt(len(X)).
+        n_probe : int, optional
+            The number of clusters searched per query. The default is N_PROBE.
+        """
+        self.X = X
+        n_lists = n_lists or max(1, int(np.sqrt(len(X))))
+        self.n_probe = min(n_probe, n_lists)
+        self.model = fit_kmeans(X, n_lists, random_state=random_state)
+        self.centers = self.model.cluster_centers_.astype(np.float32)
+
+        # The rows of each cluster, sorted by cluster
+        labels = self.model.predict(X)
+        self.order = np.argsort(labels, kind='stable')
+        self.starts = np.searchsorted(labels[self.order], np.arange(len(self.centers) + 1))
+
+
+    def query(self, Q, k):
+        """ The distances and row positions of the k nearest rows to each query, padded with inf and -1 """
+        distances = np.full((len(Q), k), np.inf)
+        positions = np.full((len(Q), k), -1, dtype=np.int64)
+
+        center_distances = _squared_distances(Q, self.centers)
+        probes = np.argsort(center_distances, axis=1)[:, :self.n_probe]
+        for i, (q, clusters) in enumerate(zip(Q, probes)):
+            candidates = np.concatenate([self.order[self.starts[c]:self.starts[c + 1]] for c in clusters])
+            candidate_distances = np.sqrt(_squared_distances(q[None, :], self.X[candidates])[0])
+            nearest = np.argsort(candidate_distances, kind='stable')[:k]
+            distances[i, :len(nearest)] = candidate_distances[nearest]
+            positions[i, :len(nearest)] = candidates[nearest]
+        return distances, positions
+
+
+
+class _BallTreeIndex:
+    """ The exact search of a block, with the interface of IVFIndex """
+
+    def __init__(self, X):
+        self.tree = BallTree(X)
+        self.size = len(X)
+
+
+    def query(self, Q, k):
+        distances = np.full((len(Q), k), np.inf)
+        positions = np.full((len(Q), k), -1, dtype=np.int64)
+        found = min(k, self.size)
+        if found:
+            distances[:, :found], positions[:, :found] = self.tree.query(Q, k=found)
+        return distances, positions
+
+
+
+class PeerIndex:
+    """ The standardized peer vectors of every school-year, searched by block """
+
+    def __init__(self, all_data, features=PEER_FEATURES, method='auto', n_lists=None, n_probe=N_PROBE):
+        """
+        Parameters
+        ----------
+        all_data : DataFrame
+            One row per school-year and level. Rows missing a feature, the
+            school_id or emh are left out, and only the first row of each
+            school, year and emh is kept.
+        features : list(String), optional
+            The features compared. The default is PEER_FEATURES.
+        method : String, optional
+            'exact' for BallTrees, 'ivf' for inverted files, or 'auto' to use
+            inverted files for blocks larger than IVF_MIN_ROWS. The default is 'auto'.
+        n_lists, n_probe : int, optional
+            The parameters of IVFIndex.
+        """
+        if method not in ('auto', 'exact', 'ivf'):
+            raise ValueError("method must be 'auto', 'exact' or 'ivf'")
+        self.features = list(features)
+
+        schools = all_data.dropna(subset=['school_id', 'emh'])
+        schools = schools.drop_duplicates(['school_id'] + BLOCK_COLS)
+        info_cols = [col for col in INFO_COLS if col in schools.columns]
+        values = pd.DataFrame({col: to_numeric(schools[col]) for col in self.features + [GROWTH]},
+                              index=schools.index)
+        complete = values[self.features].notna().all(axis=1)
+        self.schools = pd.concat((schools.loc[complete, info_cols], values[complete]), axis=1)
+        self.schools = self.schools.sort_values(BLOCK_COLS + ['school_id']).reset_index(drop=True)
+        self.schools['school_id'] = self.schools['school_id'].astype(np.int64)
+
+        self.X = self._transform(self.schools[self.features].to_numpy(dtype=np.float32))
+        self.mean, self.std = standardize(self.X)
+
+        # The row positions and search index of each block
+        self.blocks = {}
+        for key, positions in self.schools.groupby(BLOCK_COLS, sort=True).indices.items():
+            X = self.X[positions]
+            if method == 'ivf' or (method == 'auto' and len(positions) > IVF_MIN_ROWS):
+                searcher = IVFIndex(X, n_lists, n_probe)
+            else:
+                searcher = _BallTreeIndex(X)
+            self.blocks[key] = (positions, searcher)
+        # The row of each school, year and level, and the rows of each school and year
+        self.rows = {}
+        self.year_rows = {}
+        for i, (school_id, year, emh) in enumerate(zip(self.schools['school_id'], self.schools['year'],
+                                                       self.schools['emh'])):
+            self.rows[(school_id, year, emh)] = i
+            self.year_rows.setdefault((school_id, year), []).append(i)
+
+
+    def peers(self, school_id, year, emh=None, k=10, better_growth=False):
+        """
+        The k schools most comparable to a school in the same year and level.
+
+        Parameters
+        ----------
+        school_id : int
+            The school
+        year : int
+            The year of the school to compare
+        emh : String, optional
+            The level, needed when the school has several in the year.
+            The default is None or the school's only level.
+        k : int, optional
+            The number of peers. The default is 10.
+        better_growth : bool, optional
+            Only return peers with a higher GROWTH than the school. The default is False.
+
+        Returns
+        -------
+        DataFrame
+            The peers with their distance, nearest first.
+
+        """
+        row = self._row(school_id, year, emh)
+        school = self.schools.iloc[row]
+        minimum_growth = school[GROWTH] if better_growth else None
+        if better_growth and np.isnan(minimum_growth):
+            raise ValueError(f'school {school_id} has no {GROWTH} in {year}')
+
+        block = tuple(school[col] for col in BLOCK_COLS)
+        distances, positions = self._search(block, self.X[[row]], k, exclude=np.array([row]),
+                                            minimum_growth=None if minimum_growth is None
+                                            else np.array([minimum_growth]))
+        found = positions[0] >= 0
+        peers = self.schools.iloc[positions[0][found]].copy()
+        peers['distance'] = distances[0][found]
+        return peers.reset_index(drop=True)
+
+
+    def nearest(self, values, year, emh, k=10):
+        """ The k school-years of a block nearest to raw feature values, given as a dict by feature """
+        vector = self._transform(np.array([[values[col] for col in self.features]], dtype=np.float32))
+        vector = (vector - self.mean) / self.std
+
+        distances, positions = self._search((year, emh), vector, k)
+        found = positions[0] >= 0
+        nearest = self.schools.iloc[positions[0][found]].copy()
+        nearest['distance'] = distances[0][found]
+        return nearest.reset_index(drop=True)
+
+
+    def peer_groups(self, k=10, better_growth=False):
+        """
+        The k peers of every school-year, searched a block at a time.
+
+        Returns
+        -------
+        DataFrame
+            school_id, year, emh, rank, peer_school_id and distance, one row per peer.
+
+        """
+        groups = []
+        for block, (positions, searcher) in self.blocks.items():
+            growth = self.schools[GROWTH].to_numpy()[positions] if better_growth else None
+            distances, peer_positions = self._search(block, self.X[positions], k, exclude=positions,
+                                                     minimum_growth=growth)
+            found = peer_positions >= 0
+            query_rows = np.repeat(positions, k).reshape(-1, k)[found]
+            groups.append(pd.DataFrame({'school_id': self.schools['school_id'].to_numpy()[query_rows],
+                                        'year': block[0], 'emh': block[1],
+                                        'rank': np.tile(np.arange(1, k + 1), (len(positions), 1))[found],
+                                        'peer_school_id': self.schools['school_id'].to_numpy()[peer_positions[found]],
+                                        'distance': distances[found]}))
+
+        # Schools with few better-growth peers in their block have fewer than k rows
+        return pd.concat(groups, ignore_index=True)
+
+
+    def _transform(self, X):
+        """ The feature values on the scale they are compared on, enrollment as its log """
+        X = np.ascontiguousarray(X)
+        if 'total' in self.features:
+            j = self.features.index('total')
+            X[:, j] = np.log1p(X[:, j])
+        return X
+
+
+    def _row(self, school_id, year, emh):
+        if emh is not None:
+            if (school_id, year, emh) not in self.rows:
+                raise KeyError(f'school {school_id} has no {emh} row with every feature in {year}')
+            return self.rows[(school_id, year, emh)]
+
+        rows = self.year_rows.get((school_id, year), [])
+        if not rows:
+            raise KeyError(f'school {school_id} has no row with every feature in {year}')
+        if len(rows) > 1:
+            raise ValueError(f'school {school_id} has several levels in {year}, give emh')
+        return rows[0]
+
+
+    def _search(self, block, Q, k, exclude=None, minimum_growth=None):
+        """
+        The k nearest rows of a block to each query vector.
+
+        exclude gives a row to leave out of each query's results, such as the
+        school itself, and minimum_growth a growth each result must beat.
+        The search is widened until k rows pass the filters or the block is exhausted.
+
+        Returns
+        -------
+        distances, positions : ndarray
+            Of shape (len(Q), k), padded with inf and -1. The positions are rows of self.schools.
+
+        """
+        if block not in self.blocks:
+            raise KeyError(f'no schools with every feature in {dict(zip(BLOCK_COLS, block))}')
+        positions, searcher = self.blocks[block]
+        growth = self.schools[GROWTH].to_numpy()[positions]
+
+        distances = np.full((len(Q), k), np.inf)
+        results = np.full((len(Q), k), -1, dtype=np.int64)
+        pending = np.arange(len(Q))
+        width = k + 1
+        while len(pending):
+            width = min(width, len(positions))
+            found_distances, found = searcher.query(Q[pending], width)
+            keep = found >= 0
+            if exclude is not None:
+                keep &= positions[np.maximum(found, 0)] != exclude[pending][:, None]
+            if minimum_growth is not None:
+                keep &= growth[np.maximum(found, 0)] > minimum_growth[pending][:, None]
+
+            done = (keep.sum(axis=1) >= k) | (width == len(positions))
+            for i in np.flatnonzero(done):
+                selected = np.flatnonzero(keep[i])[:k]
+                distances[pending[i], :len(selected)] = found_distances[i, selected]
+                results[pending[i], :len(selected)] = positions[found[i, selected]]
+            pending = pending[~done]
+            width *= 4
+
+        return distances, results
+
+
+def _squared_distances(Q, X):
+    """ The squared euclidean distances between the rows of Q and X """
+    return np.maximum((Q ** 2).sum(axis=1)[:, None] - 2 * Q @ X.T + (X ** 2).sum(axis=1)[None, :], 0)
+
+
+def main(input_filepath, output_filepath, k=10):
+    """ Saves the k peers with better growth of every school-year to school_peers.csv """
+    index = PeerIndex(pd.read_csv(Path(input_filepath).joinpath('all_data.csv')))
+    peers = index.peer_groups(k, better_growth=True)
+    peers.to_csv(Path(output_filepath).joinpath('school_peers.csv'), index=False)
+    return peers
+
+
+if __name__ == '__main__':
+    project_dir = Path(__file__).resolve().parents[2]
+    input_filepath = project_dir.joinpath('data/interim')
+    output_filepath = project_dir.joinpath('data/processed')
+
+    print(main(input_filepath, output_filepath))
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Scores school-year rows with a model trained by train_model.
+
+Models are loaded from models/ once per process and cached. Rows are read and
+scored in vectorized batches from a file or stdin, and the predictions are
+written as csv to a file or stdout. pandas and the model libraries are only
+imported when the first batch is scored, so that --help returns immediately.
+
+Example
+-------
+From the project root:
+
+    python -m src.models.predict_model --model school_grade < data/interim/all_data.csv
+"""
+import argparse
+from functools import lru_cache
+from pathlib import Path
+import pickle
+import sys
+import time
+
+# The directory holding the trained models
+MODEL_DIR = Path(__file__).resolve().parents[2].joinpath('models')
+# The number of rows scored at a time
+BATCH_SIZE = 10_000
+# The id columns of the output, written as integers
+ID_COLS = ['school_id', 'district_id', 'year']
+# An example of the usage shown by --help
+USAGE_EXAMPLE = 'python -m src.models.predict_model --model school_grade < data/interim/all_data.csv'
+
+
+@lru_cache(maxsize=None)
+def load_predictor(model):
+    """
+    Loads a model saved by train_model.train_regressor. Each model is only
+    read from disk once per process.
+
+    Parameters
+    ----------
+    model : str
+        The name of a model in MODEL_DIR such as 'school_grade', or a path to
+        a pickled model
+
+    Returns
+    -------
+    dict
+        The model with its features and target.
+
+    """
+    filepath = Path(model)
+    if not filepath.exists():
+        filepath = MODEL_DIR.joinpath(f'{model}.pkl')
+
+    with open(filepath, 'rb') as f:
+        return pickle.load(f)
+
+
+def read_batches(source, batch_size=BATCH_SIZE):
+    """ Yields DataFrames of batch_size rows from a csv file or file object """
+    import pandas as pd
+
+    yield from pd.read_csv(source, chunksize=batch_size)
+
+
+def predict_batch(model_info, batch):
+    """
+    Scores a batch of rows.
+
+    Parameters
+    ----------
+    model_info : dict
+        The model returned by load_predictor
+    batch : DataFrame
+        The rows to score. They must contain the model's features.
+
+    Returns
+    -------
+    DataFrame
+        The train_model.KEY_COLS of the batch and a prediction column named after the target.
+
+    """
+    import numpy as np
+    from src.data.input_output_functions import to_numeric
+    from src.models.train_model import KEY_COLS
+
+    features = model_info['features']
+    missing = set(features) - set(batch.columns)
+    if missing:
+        raise ValueError(f'The rows are missing the features {sorted(missing)}')
+
+    X = np.empty((len(batch), len(features)), dtype=np.float32)
+    for j, col in enumerate(features):
+        # Some numbers are stored as text such as ' 6022 '
+        X[:, j] = to_numeric(batch[col])
+
+    predictions = batch[[col for col in KEY_COLS if col in batch.columns]].copy()
+    # Ids with missing values are read as floats, write them as integers
+    for col in predictions.columns.intersection(ID_COLS):
+        predictions[col] = to_numeric(predictions[col]).astype('Int64')
+    predictions[f"predicted_{model_info['target']}"] = model_info['model'].predict(X)
+
+    return predictions
+
+
+def predict(model, source, output, batch_size=BATCH_SIZE):
+    """
+    Scores every row of source and writes the predictions to output.
+
+    Parameters
+    ----------
+    model : str
+        The model name or path given to load_predictor
+    source : str, Path or file object
+        The csv rows to score
+    output : str, Path or file object
+        Where to write the predictions as csv
+    batch_size : int, optional
+        The number of rows scored at a time. The default is BATCH_SIZE.
+
+    Returns
+    -------
+    int
+        The number of rows scored.
+
+    """
+    model_info = load_predictor(model)
+
+    num_rows = 0
+    for batch in read_batches(source, batch_size):
+        predictions = predict_batch(model_info, batch)
+        predictions.to_csv(output, index=False, header=(num_rows == 0),
+                           mode='w' if num_rows == 0 else 'a')
+        num_rows += len(batch)
+
+    return num_rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Predict per-school outcomes from school-year rows.',
+                                     epilog=f'example, from the project root: {USAGE_EXAMPLE}')
+    parser.add_argument('--model', default='school_grade',
+                        help='model name in models/ or path to a model (default: school_grade)')
+    parser.add_argument('--input', default='-', help='csv file to score, - for stdin (default: -)')
+    parser.add_argument('--output', default='-', help='csv file to write, - for stdout (default: -)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help=f'rows scored at a time (default: {BATCH_SIZE})')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='report the throughput in rows/second on stderr')
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.input == '-' else args.input
+    output = sys.stdout if args.output == '-' else args.output
+
+    start = time.perf_counter()
+    # Loading the model is timed separately from scoring
+    load_predictor(args.model)
+    loaded = time.perf_counter()
+    num_rows = predict(args.model, source, output, args.batch_size)
+    end = time.perf_counter()
+
+    if args.benchmark:
+        print(f'loaded model in {loaded - start:.3f}s, '
+              f'scored {num_rows} rows in {end - loaded:.3f}s '
+              f'({num_rows / max(end - loaded, 1e-9):,.0f} rows/second)', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
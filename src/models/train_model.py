@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""
+Clusters school-years by performance, demographics and spending.
+
+The feature matrix is read in chunks into a single float32 array that is
+standardized in place and shared by every run of the k sweep. Each model is
+trained with MiniBatchKMeans.partial_fit over batches of that array, so no
+float64 copy is made per k.
+"""
+from pathlib import Path
+import pickle
+
+import numpy as np
+import pandas as pd
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.ensemble import HistGradientBoostingRegressor
+from sklearn.metrics import silhouette_score
+from src.data.input_output_functions import iter_partitioned, partition_columns, to_numeric
+
+# The columns that identify a school-year
+KEY_COLS = ['school_id', 'district_id', 'year', 'emh']
+# The features used to cluster school-years
+FEATURES = ['school_grade',
+            'read_achievement',
+            'math_achievement',
+            'write_achievement',
+            'science_achievement',
+            'overall_weighted_growth',
+            'pct_fr',
+            'child_pov_ratio',
+            'sum_per_pupil']
+
+# The number of rows read at a time
+CHUNKSIZE = 100_000
+# The number of rows given to each partial_fit call
+BATCH_SIZE = 4096
+# The number of rows used to estimate the silhouette score
+SILHOUETTE_SAMPLE = 10_000
+
+
+def load_feature_matrix(filepath, features=FEATURES, key_cols=KEY_COLS, chunksize=CHUNKSIZE):
+    """
+    Reads the features of a combined dataset such as all_data.csv or
+    high_school.csv into a float32 matrix. Rows missing any feature are dropped.
+
+    Parameters
+    ----------
+    filepath : str, Path
+        The csv file to read, or a partitioned directory such as the
+        feature table saved by build_features.save_features
+    features : list(String), optional
+        The feature columns. The default is FEATURES.
+    key_cols : list(String), optional
+        The columns identifying each row. Missing key columns are skipped.
+        The default is KEY_COLS.
+    chunksize : int, optional
+        The number of rows read at a time. The default is CHUNKSIZE.
+
+    Returns
+    -------
+    X : ndarray
+        A C-contiguous float32 array of shape (rows, len(features))
+    keys : DataFrame
+        The key columns of each row of X
+
+    """
+    if Path(filepath).is_dir():
+        header = sum(partition_columns(filepath), [])
+    else:
+        header = pd.read_csv(filepath, nrows=0).columns
+    key_cols = [col for col in key_cols if col in header]
+
+    matrices = []
+    keys = []
+    for chunk in _read_chunks(filepath, key_cols + list(features), chunksize):
+        values = np.empty((len(chunk), len(features)), dtype=np.float32)
+        for j, col in enumerate(features):
+            values[:, j] = to_numeric(chunk[col])
+
+        complete = ~np.isnan(values).any(axis=1)
+        matrices.append(values[complete])
+        keys.append(chunk.loc[complete, key_cols])
+
+    X = np.ascontiguousarray(np.concatenate(matrices))
+    return X, pd.concat(keys, ignore_index=True).convert_dtypes()
+
+
+def standardize(X):
+    """
+    Standardizes the columns of X in place.
+
+    Returns
+    -------
+    mean, std : ndarray
+        The float32 statistics used, so that new rows can be transformed the same way.
+
+    """
+    # Accumulate in float64 for accuracy, without copying X
+    mean = X.mean(axis=0, dtype=np.float64).astype(np.float32)
+    std = X.std(axis=0, dtype=np.float64).astype(np.float32)
+    # Constant columns are left centred instead of divided by zero
+    std[std == 0] = 1
+
+    X -= mean
+    X /= std
+
+    return mean, std
+
+
+def fit_kmeans(X, k, batch_size=BATCH_SIZE, n_epochs=3, random_state=0):
+    """
+    Trains a MiniBatchKMeans model with partial_fit over batches of X.
+    partial_fit initializes the centres once, from the first batch.
+
+    Parameters
+    ----------
+    X : ndarray
+        The standardized float32 matrix
+    k : int
+        The number of clusters
+    batch_size : int, optional
+        The number of rows per partial_fit call. The default is BATCH_SIZE.
+    n_epochs : int, optional
+        The number of passes over X. The default is 3.
+    random_state : int, optional
+        The seed for the initialization and the batch order. The default is 0.
+
+    Returns
+    -------
+    MiniBatchKMeans
+        The trained model.
+
+    Raises
+    ------
+    ValueError
+        X has fewer rows than k, so no batch could initialize the centres.
+
+    """
+    if len(X) < k:
+        raise ValueError(f'{k=} is larger than the {len(X)} rows')
+
+    model = MiniBatchKMeans(n_clusters=k, batch_size=batch_size, random_state=random_state)
+    rng = np.random.default_rng(random_state)
+    # The first batch must contain at least k rows
+    batch_size = max(batch_size, k)
+
+    for epoch in range(n_epochs):
+        # Batches are visited in a random order, but each is a view of X
+        starts = rng.permutation(np.arange(0, len(X), batch_size))
+        for start in starts:
+            batch = X[start:start + batch_size]
+            if len(batch) >= k or hasattr(model, 'cluster_centers_'):
+                model.partial_fit(batch)
+
+    return model
+
+
+def predict_chunked(model, X, batch_size=CHUNKSIZE):
+    """
+    Assigns clusters to X in chunks.
+
+    Returns
+    -------
+    labels : ndarray
+        The cluster of each row
+    inertia : float
+        The sum of squared distances of each row to its cluster centre
+
+    """
+    labels = np.empty(len(X), dtype=np.int32)
+    inertia = 0.0
+    for start in range(0, len(X), batch_size):
+        batch = X[start:start + batch_size]
+        labels[start:start + batch_size] = model.predict(batch)
+        inertia -= model.score(batch)
+
+    return labels, inertia
+
+
+def sweep_k(X, ks=range(2, 11), random_state=0, **fit_params):
+    """
+    Trains one model per k on the same standardized matrix.
+
+    Parameters
+    ----------
+    X : ndarray
+        The standardized float32 matrix
+    ks : iterable(int), optional
+        The numbers of clusters to try. The default is range(2, 11).
+    random_state : int, optional
+        The seed used for every model and the silhouette sample. The default is 0.
+    **fit_params
+        Passed on to fit_kmeans
+
+    Returns
+    -------
+    results : DataFrame
+        The inertia and sampled silhouette score of each k
+    models : dict
+        Maps each k to its trained model
+
+    """
+    rng = np.random.default_rng(random_state)
+    sample = rng.choice(len(X), size=min(len(X), SILHOUETTE_SAMPLE), replace=False)
+    sample.sort()
+    X_sample = X[sample]
+
+    rows = []
+    models = {}
+    for k in ks:
+        model = fit_kmeans(X, k, random_state=random_state, **fit_params)
+        labels, inertia = predict_chunked(model, X)
+
+        sample_labels = labels[sample]
+        silhouette = np.nan
+        if len(np.unique(sample_labels)) > 1:
+            silhouette = silhouette_score(X_sample, sample_labels)
+
+        rows.append({'k': k, 'inertia': inertia, 'silhouette': silhouette})
+        models[k] = model
+
+    return pd.DataFrame(rows), models
+
+
+def train_regressor(filepath, target, features=FEATURES, model_filepath=None, random_state=0):
+    """
+    Trains a model that predicts target from features, such as school_grade
+    from all_data.csv or pct_remediation from high_school.csv.
+
+    Parameters
+    ----------
+    filepath : str, Path
+        The csv file to train on
+    target : String
+        The column to predict
+    features : list(String), optional
+        The feature columns. The target is removed if it is one of them.
+        The default is FEATURES.
+    model_filepath : str, Path, optional
+        Where to save the model. The default is None or don't save.
+    random_state : int, optional
+        The seed of the model. The default is 0.
+
+    Returns
+    -------
+    dict
+        The model with its features and target, in the format of save_model.
+
+    """
+    features = [col for col in features if col != target]
+    X, keys = load_feature_matrix(filepath, features + [target])
+    
+    model = HistGradientBoostingRegressor(random_state=random_state)
+    model.fit(X[:, :-1], X[:, -1])
+    
+    model_info = {'model': model, 'features': features, 'target': target}
+    if model_filepath is not None:
+        with open(model_filepath, 'wb') as f:
+            pickle.dump(model_info, f)
+    
+    return model_info
+
+
+def save_assignments(keys, labels, filepath):
+    """ Saves the cluster of each school-year so that it can be reused """
+    assignments = keys.copy()
+    assignments['cluster'] = labels
+    assignments.to_csv(filepath, index=False)
+
+    return assignments
+
+
+def load_assignments(filepath):
+    """ Loads the cluster assignments saved by save_assignments """
+    return pd.read_csv(filepath)
+
+
+def save_model(model, mean, std, features, filepath):
+    """ Saves a model with the statistics needed to standardize new rows """
+    with open(filepath, 'wb') as f:
+        pickle.dump({'model': model, 'mean': mean, 'std': std, 'features': list(features)}, f)
+
+
+def load_model(filepath):
+    """ Loads a model saved by save_model """
+    with open(filepath, 'rb') as f:
+        return pickle.load(f)
+
+
+def _read_chunks(filepath, columns, chunksize):
+    """ Yields the columns of a csv file in chunks, or of a partitioned directory by partition """
+    if Path(filepath).is_dir():
+        return iter_partitioned(filepath, columns=columns)
+    return pd.read_csv(filepath, usecols=columns, chunksize=chunksize)
+
+
+def main(input_filepath, output_filepath, model_filepath, ks=range(2, 11)):
+    """
+    Clusters all_data, saves the model with the best silhouette score and
+    the cluster of every school-year. Also trains the school_grade and
+    pct_remediation models used by predict_model.
+
+    Parameters
+    ----------
+    input_filepath : str, Path
+        The interim directory
+    output_filepath : str, Path
+        The directory to save the cluster assignments in
+    model_filepath : str, Path
+        The directory to save the model in
+    ks : iterable(int), optional
+        The numbers of clusters to try. The default is range(2, 11).
+
+    Returns
+    -------
+    DataFrame
+        The results of the k sweep.
+
+    """
+    X, keys = load_feature_matrix(Path(input_filepath).joinpath('all_data.csv'))
+    mean, std = standardize(X)
+
+    results, models = sweep_k(X, ks)
+    best_k = int(results.loc[results['silhouette'].idxmax(), 'k'])
+
+    labels, _ = predict_chunked(models[best_k], X)
+    save_assignments(keys, labels, Path(output_filepath).joinpath('school_clusters.csv'))
+    save_model(models[best_k], mean, std, FEATURES, Path(model_filepath).joinpath('kmeans.pkl'))
+    
+    train_regressor(Path(input_filepath).joinpath('all_data.csv'), 'school_grade',
+                    model_filepath=Path(model_filepath).joinpath('school_grade.pkl'))
+    train_regressor(Path(input_filepath).joinpath('high_school.csv'), 'pct_remediation',
+                    model_filepath=Path(model_filepath).joinpath('pct_remediation.pkl'))
+
+    return results
+
+
+if __name__ == '__main__':
+    project_dir = Path(__file__).resolve().parents[2]
+    input_filepath = project_dir.joinpath('data/interim')
+    output_filepath = project_dir.joinpath('data/processed')
+    model_filepath = project_dir.joinpath('models')
+
+    print(main(input_filepath, output_filepath, model_filepath))
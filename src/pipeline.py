@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+Runs any subset of the pipeline stages from the project root.
+
+    python -m src                              # every stage but fetch and warehouse
+    python -m src census combine --jobs 4
+    python -m src --cache --format partitioned
+    python -m src --dry-run
+
+The stages run in pipeline order whatever order they are given in. A stage
+that runs after census, expenditures or kaggle in the same call reuses their
+DataFrames, otherwise it reads their tall files. A report of the time and
+rows written by each stage is printed at the end.
+
+Only the standard library is imported up front. The stage modules, and with
+them pandas and the network clients, are imported when a stage runs, so
+--help and --dry-run start quickly. benchmarks/import_time.py checks this.
+"""
+import argparse
+from dataclasses import dataclass, field
+from pathlib import Path
+import time
+
+# The project root
+PROJECT_DIR = Path(__file__).resolve().parents[1]
+# Every stage in pipeline order
+STAGES = ('fetch', 'census', 'expenditures', 'kaggle', 'combine', 'entities', 'features', 'warehouse')
+# The stages run when none are given
+DEFAULT_STAGES = STAGES[1:-1]
+# The names of the kaggle datasets in the order returned by make_kaggle
+KAGGLE_NAMES = ('change', 'coact', 'enroll', 'final', 'frl', 'remediation', 'address')
+# The raw and tall filenames of the kaggle datasets, in the order of KAGGLE_NAMES
+RAW_KAGGLE_FILES = ('1YR_3YR_change', 'COACT', 'enrl_working', 'final_grade', 'k_12_FRL',
+                    'remediation_HS', 'school_address')
+TALL_KAGGLE_FILES = ('1YR_3YR_change', 'COACT', 'enrl_working', 'final_grade', 'FRL',
+                     'remediation', 'address')
+# The number of functions listed per stage by --profile
+PROFILE_LINES = 15
+# The dtype backends of the makers, as in makers.DTYPE_BACKENDS
+DTYPE_BACKENDS = ('numpy_nullable', 'pyarrow')
+# The engines of the makers, as in makers.ENGINES
+ENGINES = ('pandas', 'polars')
+
+
+@dataclass
+class StageResult:
+    """ The outcome of a stage for the report """
+    stage: str
+    status: str
+    seconds: float = 0.0
+    # Maps each dataset written to its number of rows
+    rows: dict = field(default_factory=dict)
+    profile: str = ''
+
+
+def run_fetch(options, context):
+    from src.data import get_raw_data
+
+    get_raw_data.main(options.raw)
+    return {}
+
+
+def run_census(options, context):
+    from src.data.make_datasets import make_census
+
+    context['census'] = make_census(options.raw.joinpath('census'), options.interim.joinpath('census'),
+                                    options.years, options.jobs, partitioned=options.partitioned,
+                                    dtype_backend=options.dtype_backend, engine=options.engine)
+    return {'census': len(context['census'])}
+
+
+def run_expenditures(options, context):
+    from src.data.make_datasets import make_expenditures
+
+    context['exp'] = make_expenditures(options.raw.joinpath('expenditures'),
+                                       options.interim.joinpath('expenditures'),
+                                       options.years, options.jobs, partitioned=options.partitioned,
+                                       dtype_backend=options.dtype_backend, engine=options.engine)
+    return {'expenditures': len(context['exp'])}
+
+
+def run_kaggle(options, context):
+    from src.data.make_datasets import make_kaggle
+
+    kaggle = make_kaggle(options.raw.joinpath('kaggle'), options.interim.joinpath('kaggle'),
+                         options.years, options.jobs, partitioned=options.partitioned,
+                         dtype_backend=options.dtype_backend, engine=options.engine)
+    context.update(zip(KAGGLE_NAMES, kaggle))
+    return {name: len(df) for name, df in zip(KAGGLE_NAMES, kaggle)}
+
+
+def run_combine(options, context):
+    import pandas as pd
+    from src.data.combine_datasets import combine_datasets, read_tall
+
+    # Datasets made earlier in this run are not read again, the others are read with the dtypes
+    # of the makers so the combined datasets do not depend on which stages ran
+    datasets = {name: context[name] if name in context
+                else read_tall(options.interim, name, dtype_backend=options.dtype_backend)
+                for name in ('census', 'exp') + KAGGLE_NAMES[:-1]}
+    kaggle = tuple(datasets[name] for name in KAGGLE_NAMES[:-1]) + (pd.DataFrame(),)
+
+    district, school, all_data, high_school = combine_datasets(options.interim, options.interim,
+                                                               datasets['census'], datasets['exp'],
+                                                               kaggle, partitioned=options.partitioned)
+    context['all_data'] = all_data
+    return {'districts': len(district), 'schools': len(school),
+            'all_data': len(all_data), 'high_school': len(high_school)}
+
+
+def run_entities(options, context):
+    import pandas as pd
+    from src.data.entities import make_school_entities
+    from src.data.input_output_functions import read_partitioned
+
+    if 'address' in context:
+        address = context['address']
+    elif options.partitioned:
+        address = read_partitioned(options.interim.joinpath('kaggle/address_tall'))
+    else:
+        address = pd.read_csv(options.interim.joinpath('kaggle/address_tall.csv'))
+
+    return {'school_entities': len(make_school_entities(address, options.interim))}
+
+
+def run_features(options, context):
+    import pandas as pd
+    from src.data.input_output_functions import read_partitioned
+    from src.features.build_features import build_panel_features, save_features
+
+    if 'all_data' in context:
+        all_data = context['all_data'].drop('graduation_rate', axis=1, errors='ignore')
+    elif options.partitioned:
+        all_data = read_partitioned(options.interim.joinpath('all_data'))
+    else:
+        all_data = pd.read_csv(options.interim.joinpath('all_data.csv'), dtype_backend=options.dtype_backend)
+
+    features = build_panel_features(all_data)
+    save_features(features, options.processed.joinpath('features'))
+    return {'features': len(features)}
+
+
+def run_warehouse(options, context):
+    from src.data.warehouse import load_warehouse
+
+    return load_warehouse(options.interim)
+
+
+RUNNERS = {'fetch': run_fetch,
+           'census': run_census,
+           'expenditures': run_expenditures,
+           'kaggle': run_kaggle,
+           'combine': run_combine,
+           'entities': run_entities,
+           'features': run_features,
+           'warehouse': run_warehouse}
+
+
+def stage_files(stage, options):
+    """
+    The files a stage reads and writes, used by --cache.
+
+    Returns
+    -------
+    inputs, outputs : list(Path)
+
+    """
+    raw, interim, processed = options.raw, options.interim, options.processed
+    tall = (lambda path: interim.joinpath(path).with_suffix('')) if options.partitioned else interim.joinpath
+    raw_census = [raw.joinpath(f'census/saipe{year}.csv') for year in options.years]
+    raw_kaggle = [raw.joinpath(f'kaggle/{year}_{name}.csv') for year in options.years
+                  for name in RAW_KAGGLE_FILES]
+    tall_kaggle = [tall(f'kaggle/{name}_tall.csv') for name in TALL_KAGGLE_FILES]
+
+    files = {'fetch': ([], raw_census + raw_kaggle),
+             'census': (raw_census, [tall('census/tall_saipe.csv')]),
+             'expenditures': ([raw.joinpath(f'expenditures/expenditures{year}.csv') for year in options.years],
+                              [tall('expenditures/tall_expenditures.csv')]),
+             'kaggle': (raw_kaggle, tall_kaggle),
+             'combine': ([tall('census/tall_saipe.csv'), tall('expenditures/tall_expenditures.csv')]
+                         + tall_kaggle[:-1],
+                         [interim.joinpath('districts.csv'), interim.joinpath('schools.csv'),
+                          tall('all_data.csv'), tall('high_school.csv')]),
+             'entities': ([tall_kaggle[-1]], [interim.joinpath('school_entities.csv')]),
+             'features': ([tall('all_data.csv')], [processed.joinpath('features')]),
+             'warehouse': ([tall('all_data.csv'), tall('high_school.csv'), interim.joinpath('districts.csv'),
+                            interim.joinpath('schools.csv')], [interim.joinpath('warehouse.sqlite')])}
+    return files[stage]
+
+
+def is_cached(stage, options):
+    """ Whether every output of a stage is newer than all of its inputs """
+    inputs, outputs = stage_files(stage, options)
+    if not all(path.exists() for path in outputs):
+        return False
+
+    input_times = [_modified_time(path, max) for path in inputs if path.exists()]
+    output_times = [_modified_time(path, min) for path in outputs]
+    return not input_times or max(input_times) <= min(output_times)
+
+
+def run_pipeline(options):
+    """
+    Runs the selected stages in pipeline order.
+
+    Parameters
+    ----------
+    options : Namespace
+        The parsed command line options
+
+    Returns
+    -------
+    list(StageResult)
+        The outcome of each stage.
+
+    """
+    context = {}
+    results = []
+    for stage in [stage for stage in STAGES if stage in options.stages]:
+        if options.cache and is_cached(stage, options):
+            results.append(StageResult(stage, 'cached'))
+            continue
+        if options.dry_run:
+            results.append(StageResult(stage, 'would run'))
+            continue
+
+        profiler = None
+        if options.profile:
+            import cProfile
+            profiler = cProfile.Profile()
+        start = time.perf_counter()
+        if profiler is not None:
+            rows = profiler.runcall(RUNNERS[stage], options, context)
+        else:
+            rows = RUNNERS[stage](options, context)
+        seconds = time.perf_counter() - start
+
+        results.append(StageResult(stage, 'ran', seconds, rows, _format_profile(profiler)))
+
+    return results
+
+
+def format_report(results):
+    """ A table of the status, time and rows of each stage """
+    lines = [f"{'stage':<14}{'status':<11}{'seconds':>9}  rows"]
+    for result in results:
+        rows = ', '.join(f'{name}={count:,}' for name, count in result.rows.items())
+        lines.append(f'{result.stage:<14}{result.status:<11}{result.seconds:>9.2f}  {rows}')
+    lines.append(f"{'total':<25}{sum(result.seconds for result in results):>9.2f}")
+    return '\n'.join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m src',
+                                     description='Run stages of the Colorado education data pipeline.')
+    parser.add_argument('stages', nargs='*', metavar='stage',
+                        help=f"stages to run, from {', '.join(STAGES)} "
+                             f"(default: {' '.join(DEFAULT_STAGES)})")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='worker processes per dataset (default: 1)')
+    parser.add_argument('--cache', action='store_true',
+                        help='skip stages whose outputs are newer than their inputs')
+    parser.add_argument('--format', choices=('csv', 'partitioned'), default='csv',
+                        help='save the tall and combined data as csv files or partitioned '
+                             'by year and district_id (default: csv)')
+    parser.add_argument('--dtype-backend', choices=DTYPE_BACKENDS, default=DTYPE_BACKENDS[0],
+                        help='the column types of the made datasets, pandas masked arrays '
+                             'or Arrow (default: numpy_nullable)')
+    parser.add_argument('--engine', choices=ENGINES, default=ENGINES[0],
+                        help='make the census and kaggle datasets with pandas or a Polars '
+                             'lazy plan; --jobs only applies to pandas (default: pandas)')
+    parser.add_argument('--profile', action='store_true',
+                        help='print the most expensive functions of each stage; '
+                             'worker processes are not profiled')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='list the stages that would run without running them')
+    parser.add_argument('--years', type=int, nargs='+', default=[2010, 2011, 2012],
+                        help='years to make (default: 2010 2011 2012)')
+    parser.add_argument('--raw', type=Path, default=PROJECT_DIR.joinpath('data/raw'),
+                        help='raw data directory (default: data/raw)')
+    parser.add_argument('--interim', type=Path, default=PROJECT_DIR.joinpath('data/interim'),
+                        help='interim data directory (default: data/interim)')
+    parser.add_argument('--processed', type=Path, default=PROJECT_DIR.joinpath('data/processed'),
+                        help='processed data directory (default: data/processed)')
+
+    options = parser.parse_args(argv)
+    unknown = [stage for stage in options.stages if stage not in STAGES]
+    if unknown:
+        parser.error(f"unknown stages {', '.join(unknown)}, choose from {', '.join(STAGES)}")
+    options.stages = options.stages or list(DEFAULT_STAGES)
+    options.years = tuple(options.years)
+    options.partitioned = options.format == 'partitioned'
+    return options
+
+
+def main(argv=None):
+    options = parse_args(argv)
+
+    for directory in (options.interim.joinpath('census'), options.interim.joinpath('expenditures'),
+                      options.interim.joinpath('kaggle'), options.processed):
+        directory.mkdir(parents=True, exist_ok=True)
+
+    results = run_pipeline(options)
+
+    print(format_report(results))
+    for result in results:
+        if result.profile:
+            print(f'\n{result.stage} profile\n{result.profile}')
+
+
+def _modified_time(path, reduce):
+    """ The modification time of a file, or the newest or oldest file in a directory """
+    if path.is_dir():
+        return reduce((child.stat().st_mtime for child in path.rglob('*') if child.is_file()),
+                      default=path.stat().st_mtime)
+    return path.stat().st_mtime
+
+
+def _format_profile(profiler):
+    if profiler is None:
+        return ''
+    import io
+    import pstats
+
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILE_LINES)
+    return stream.getvalue().strip()
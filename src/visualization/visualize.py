@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Renders the standard report figures into reports/figures.
+
+Each figure is described by a plot spec and drawn from a small aggregate of
+all_data. Figures are cached by a hash of their aggregate and spec, so that
+regenerating the report only redraws the figures whose data or spec changed.
+Figures are drawn on an Agg canvas without pyplot, so drawing them leaves the
+caller's matplotlib backend alone. Stale figures may be drawn in a process
+pool, whose workers use the non-interactive Agg backend.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+from pathlib import Path
+
+import pandas as pd
+
+from src.data.input_output_functions import to_numeric
+from src.features.aggregations import subgroup_means
+
+# The file recording the hash each figure was drawn from
+CACHE_FILENAME = '.figure_cache.json'
+
+# The standard report figures. aggregate names a function in AGGREGATES.
+FIGURE_SPECS = [
+    {'name': 'performance_over_time',
+     'aggregate': 'performance_by_year_emh',
+     'kind': 'line', 'x': 'year', 'y': 'school_grade', 'hue': 'emh',
+     'title': 'Mean school grade by year and level',
+     'xlabel': 'Year', 'ylabel': 'Mean school grade'},
+    {'name': 'performance_by_district',
+     'aggregate': 'performance_by_district',
+     'kind': 'barh', 'x': 'district_name', 'y': 'school_grade',
+     'title': 'Districts with the highest and lowest mean school grade',
+     'xlabel': 'Mean school grade', 'ylabel': ''},
+    {'name': 'district_poverty_and_frl',
+     'aggregate': 'district_year',
+     'kind': 'scatter', 'x': 'child_pov_ratio', 'y': 'pct_fr', 'hue': 'year',
+     'title': 'Child poverty and free or reduced lunch by district',
+     'xlabel': 'Child poverty ratio', 'ylabel': 'Students with free or reduced lunch'},
+    {'name': 'district_spending_and_poverty',
+     'aggregate': 'district_year',
+     'kind': 'scatter', 'x': 'child_pov_ratio', 'y': 'sum_per_pupil', 'hue': 'year',
+     'title': 'Spending per pupil and child poverty by district',
+     'xlabel': 'Child poverty ratio', 'ylabel': 'Spending per pupil ($)'},
+    {'name': 'district_spending_and_performance',
+     'aggregate': 'district_year',
+     'kind': 'scatter', 'x': 'sum_per_pupil', 'y': 'school_grade', 'hue': 'year',
+     'title': 'Spending per pupil and mean school grade by district',
+     'xlabel': 'Spending per pupil ($)', 'ylabel': 'Mean school grade'},
+    {'name': 'performance_by_subgroup',
+     'aggregate': 'subgroup_performance',
+     'kind': 'line', 'x': 'year', 'y': 'school_grade', 'hue': 'subgroup',
+     'title': 'Mean school grade of the students of each subgroup',
+     'xlabel': 'Year', 'ylabel': 'Enrollment-weighted mean school grade'},
+]
+
+
+def performance_by_year_emh(all_data):
+    """ The mean school grade of each level in each year """
+    return all_data.groupby(['year', 'emh'], as_index=False)['school_grade'].mean()
+
+
+def performance_by_district(all_data, n=10):
+    """ The n districts with the highest and lowest mean school grade """
+    means = all_data.groupby('district_name', as_index=False)['school_grade'].mean()
+    means = means.dropna().sort_values('school_grade')
+    return pd.concat((means.head(n), means.tail(n))).drop_duplicates()
+
+
+def district_year(all_data):
+    """ One row per district and year with its poverty, lunch, spending and performance """
+    df = all_data[['district_id', 'year', 'child_pov_ratio', 'pct_fr', 'sum_per_pupil', 'school_grade']].copy()
+    df['sum_per_pupil'] = to_numeric(df['sum_per_pupil'])
+
+    return df.groupby(['district_id', 'year'], as_index=False).agg(
+        {'child_pov_ratio': 'first', 'sum_per_pupil': 'first', 'pct_fr': 'mean', 'school_grade': 'mean'})
+
+
+def subgroup_performance(all_data):
+    """ The mean school grade of the students of each subgroup in each year, weighted by enrollment """
+    return subgroup_means(all_data, 'year', ['school_grade'])
+
+
+AGGREGATES = {'performance_by_year_emh': performance_by_year_emh,
+              'performance_by_district': performance_by_district,
+              'district_year': district_year,
+              'subgroup_performance': subgroup_performance}
+
+
+def render_figures(all_data, output_filepath, specs=FIGURE_SPECS, jobs=1, force=False):
+    """
+    Draws the figures whose aggregate or spec changed since they were last drawn.
+
+    Parameters
+    ----------
+    all_data : DataFrame
+        The combined dataset
+    output_filepath : str, Path
+        The directory to save the figures in
+    specs : list(dict), optional
+        The figures to draw. The default is FIGURE_SPECS.
+    jobs : int, optional
+        The number of worker processes. The default is 1.
+    force : bool, optional
+        Redraw every figure. The default is False.
+
+    Returns
+    -------
+    list(String)
+        The names of the figures that were drawn.
+
+    """
+    output_filepath = Path(output_filepath)
+    cache = _load_cache(output_filepath)
+
+    # Each aggregate is computed once even when several figures use it
+    aggregates = {}
+    stale = []
+    for spec in specs:
+        if spec['aggregate'] not in aggregates:
+            aggregates[spec['aggregate']] = AGGREGATES[spec['aggregate']](all_data)
+        aggregate = aggregates[spec['aggregate']]
+
+        key = figure_hash(aggregate, spec)
+        filepath = output_filepath.joinpath(spec['name'] + '.png')
+        if force or cache.get(spec['name']) != key or not filepath.exists():
+            stale.append((spec, aggregate, filepath, key))
+
+    if jobs > 1 and len(stale) > 1:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_use_agg) as executor:
+            list(executor.map(draw_figure, *zip(*[(spec, aggregate, filepath)
+                                                  for spec, aggregate, filepath, key in stale])))
+    else:
+        for spec, aggregate, filepath, key in stale:
+            draw_figure(spec, aggregate, filepath)
+
+    for spec, aggregate, filepath, key in stale:
+        cache[spec['name']] = key
+    _save_cache(output_filepath, cache)
+
+    return [spec['name'] for spec, aggregate, filepath, key in stale]
+
+
+def figure_hash(aggregate, spec):
+    """ A hash of the data and spec of a figure """
+    digest = hashlib.sha256()
+    digest.update(pd.util.hash_pandas_object(aggregate, index=False).to_numpy().tobytes())
+    digest.update(','.join(map(str, aggregate.columns)).encode())
+    digest.update(json.dumps(spec, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def draw_figure(spec, aggregate, filepath):
+    """ Draws a single figure on an Agg canvas and saves it """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(8, 5))
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+
+    groups = [(None, aggregate)]
+    if spec.get('hue'):
+        groups = aggregate.groupby(spec['hue'])
+
+    for label, group in groups:
+        if spec['kind'] == 'line':
+            ax.plot(group[spec['x']], group[spec['y']], marker='o', label=label)
+        elif spec['kind'] == 'scatter':
+            ax.scatter(group[spec['x']], group[spec['y']], alpha=0.6, label=label)
+        elif spec['kind'] == 'barh':
+            ax.barh(group[spec['x']].astype(str), group[spec['y']], label=label)
+        else:
+            raise ValueError(f"Unknown plot kind {spec['kind']}")
+
+    if spec['kind'] == 'line':
+        # Years and other discrete x values are labelled as they are
+        ax.set_xticks(sorted(aggregate[spec['x']].dropna().unique()))
+
+    ax.set_title(spec['title'])
+    ax.set_xlabel(spec['xlabel'])
+    ax.set_ylabel(spec['ylabel'])
+    if spec.get('hue'):
+        ax.legend(title=spec['hue'])
+
+    fig.tight_layout()
+    fig.savefig(filepath, dpi=100)
+
+
+def _use_agg():
+    """ Sets the non-interactive backend in a worker process """
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def _load_cache(output_filepath):
+    cache_filepath = output_filepath.joinpath(CACHE_FILENAME)
+    if not cache_filepath.exists():
+        return {}
+    with open(cache_filepath) as f:
+        return json.load(f)
+
+
+def _save_cache(output_filepath, cache):
+    with open(output_filepath.joinpath(CACHE_FILENAME), 'w') as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+
+
+def main(input_filepath, output_filepath, jobs=1):
+    all_data = pd.read_csv(Path(input_filepath).joinpath('all_data.csv'))
+    return render_figures(all_data, output_filepath, jobs=jobs)
+
+
+if __name__ == '__main__':
+    project_dir = Path(__file__).resolve().parents[2]
+    input_filepath = project_dir.joinpath('data/interim')
+    output_filepath = project_dir.joinpath('reports/figures')
+
+    print(main(input_filepath, output_filepath))
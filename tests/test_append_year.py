@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from pathlib import Path
+import warnings
+
+import pandas as pd
+import pytest
+
+from src.data import builders
+from src.data.combine_datasets import extend_id_dataset, read_tall
+from src.data.make_datasets import append_year, make_datasets
+
+RAW = Path(__file__).resolve().parents[1].joinpath('data/raw')
+
+
+@pytest.fixture(scope='module')
+def interim(tmp_path_factory):
+    """ The interim data of 2010 and 2011 with 2012 appended """
+    interim = tmp_path_factory.mktemp('interim')
+    for subdirectory in ('census', 'expenditures', 'kaggle'):
+        interim.joinpath(subdirectory).mkdir()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', FutureWarning)
+        make_datasets(RAW, interim, years=(2010, 2011))
+        append_year(RAW, interim, 2012)
+    return interim
+
+
+def test_appended_ids_are_unique(interim):
+    districts = pd.read_csv(interim.joinpath('districts.csv'))
+    schools = pd.read_csv(interim.joinpath('schools.csv'))
+
+    assert districts['district_id'].notna().all()
+    assert districts['district_id'].is_unique
+    assert schools['school_id'].notna().all()
+    assert schools['school_id'].is_unique
+
+
+def test_appending_a_year_twice(interim):
+    districts = pd.read_csv(interim.joinpath('districts.csv'))
+    frl = read_tall(interim, 'frl')
+
+    # The tall files refuse a year they already have
+    with pytest.raises(ValueError), warnings.catch_warnings():
+        warnings.simplefilter('ignore', FutureWarning)
+        append_year(RAW, interim, 2012)
+
+    # and the ids of the year are not added again
+    extend_id_dataset(interim.joinpath('districts.csv'),
+                      builders.DistrictIDBuilder((frl[frl['year'] == 2012],)))
+    pd.testing.assert_frame_equal(pd.read_csv(interim.joinpath('districts.csv')), districts)
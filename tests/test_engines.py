@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from pathlib import Path
+import warnings
+
+import polars as pl
+import pytest
+
+from src.data import engines, makers
+
+RAW = Path(__file__).resolve().parents[1].joinpath('data/raw')
+
+
+@pytest.mark.parametrize('dtype_backend', makers.DTYPE_BACKENDS)
+def test_engines_are_equal_on_the_raw_data(dtype_backend):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', FutureWarning)
+        assert engines.check_engines(RAW, dtype_backend=dtype_backend) == []
+
+
+@pytest.mark.parametrize('filename', ['census/saipe2010.csv', 'kaggle/2010_k_12_FRL.csv'])
+def test_raw_files_are_scanned_lazily(filename):
+    # Files ending their lines with a carriage return only are scanned from memory
+    lf = engines.scan_csv(RAW.joinpath(filename))
+
+    assert isinstance(lf, pl.LazyFrame)
+    assert 'SCAN' in lf.explain()
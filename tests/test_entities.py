@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data.entities import MATCH_THRESHOLD, SAME_ID_THRESHOLD, link_records, resolve_schools
+
+COLUMNS = ['school_id', 'year', 'district_id', 'school', 'address', 'zipcode']
+# Records of the address dataset of Jefferson County R-1 schools in Wheat Ridge
+ADDRESS = pd.DataFrame([
+    (8272, 2010, 1420, 'Stevens Elementary School', '4001 Reed Street', 80033),
+    (8272, 2011, 1420, 'STEVENS ELEMENTARY SCHOOL', '4001 REED STREET', 80033),
+    (8223, 2012, 1420, 'STEVENS ELEMENTARY SCHOOL', '4001 REED STREET', 80033),
+    (9506, 2010, 1420, 'Wheat Ridge Middle School', '7101 West 38th Avenue', 80033),
+    (9506, 2011, 1420, 'WHEAT RIDGE MIDDLE SCHOOL', '7101 WEST 38TH AVENUE', 80033),
+    (9515, 2012, 1420, 'WHEAT RIDGE 5-8', '7101 WEST 38TH AVENUE', 80033),
+    (9514, 2010, 1420, 'Wheat Ridge High School', '9505 West 32nd Avenue', 80033),
+    (9514, 2011, 1420, 'WHEAT RIDGE HIGH SCHOOL', '9505 WEST 32ND AVENUE', '80033-5200'),
+    (9514, 2012, 1420, 'WHEAT RIDGE HIGH SCHOOL', '9505 WEST 32ND AVENUE', 80033),
+], columns=COLUMNS)
+
+
+def entity_ids(entities):
+    return entities.set_index(['school_id', 'year'])['entity_id']
+
+
+def test_new_school_ids_are_linked():
+    entities = entity_ids(resolve_schools(ADDRESS))
+
+    assert entities[8223, 2012] == entities[8272, 2010] == '8272-2010'
+    # The middle school renamed and given a new id keeps its address
+    assert entities[9515, 2012] == entities[9506, 2011] == '9506-2010'
+    # The high school of the same zipcode is not linked to either
+    assert set(entities.loc[9514]) == {'9514-2010'}
+
+
+def test_reused_school_id():
+    # The same id with a new name and a new address is a different school
+    reused = pd.DataFrame([(9514, 2013, 1420, 'Everitt Middle School', '3900 Kipling Street', 80033)],
+                          columns=COLUMNS)
+    entities = entity_ids(resolve_schools(pd.concat([ADDRESS, reused], ignore_index=True)))
+
+    assert entities[9514, 2013] == '9514-2013'
+    assert entities[9514, 2012] == '9514-2010'
+
+
+def test_same_school_id_has_the_lower_threshold():
+    records = pd.DataFrame({'school_id': [1, 1, 2], 'year': [2010, 2011, 2011]})
+    score = (SAME_ID_THRESHOLD + MATCH_THRESHOLD) / 2
+    scores = pd.DataFrame({'left': [0, 0], 'right': [1, 2], 'score': [score, score]})
+
+    clusters = link_records(records, scores)
+
+    assert clusters[0] == clusters[1]
+    assert clusters[2] == 2
+
+
+def test_clusters_of_the_same_year_are_never_merged():
+    # Two schools of 2011 both matching one school of 2010, and one of 2012
+    # matching the second, which would join them through either link
+    records = pd.DataFrame({'school_id': [1, 2, 3, 4], 'year': [2010, 2011, 2011, 2012]})
+    scores = pd.DataFrame({'left': [0, 0, 2, 1], 'right': [1, 2, 3, 3], 'score': [0.9, 0.8, 0.8, 0.7]})
+
+    clusters = link_records(records, scores)
+
+    assert clusters[0] == clusters[1]
+    assert clusters[2] == clusters[3]
+    assert clusters[0] != clusters[2]
+
+
+@pytest.mark.parametrize('threshold', [MATCH_THRESHOLD, SAME_ID_THRESHOLD])
+def test_scores_under_the_threshold_are_not_linked(threshold):
+    school_ids = [1, 1] if threshold == SAME_ID_THRESHOLD else [1, 2]
+    records = pd.DataFrame({'school_id': school_ids, 'year': [2010, 2011]})
+    scores = pd.DataFrame({'left': [0], 'right': [1], 'score': [np.nextafter(threshold, 0)]})
+
+    np.testing.assert_array_equal(link_records(records, scores), [0, 1])
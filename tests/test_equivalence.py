@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import json
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.equivalence import TARGETS, check_references, compare_frames, freeze_references
+
+
+def test_rtol_ignores_row_order():
+    rng = np.random.default_rng(0)
+    expected = pd.DataFrame({'name': rng.choice(list('abc'), 200),
+                             'value': rng.normal(size=200),
+                             'share': pd.array(rng.normal(size=200), dtype='Float64')})
+    expected.loc[::7, 'value'] = np.nan
+    actual = expected.assign(value=expected['value'] * (1 + 1e-12),
+                             share=expected['share'] * (1 + 1e-12)).sample(frac=1, random_state=1)
+
+    assert compare_frames(expected, actual, rtol=1e-6) == []
+    assert compare_frames(expected, actual) != []
+
+
+@pytest.mark.parametrize('name', list(TARGETS))
+def test_references_match_their_frozen_outputs(name):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', FutureWarning)
+        assert check_references(name) == []
+
+
+def test_changed_reference_is_reported(tmp_path):
+    golden_filepath = tmp_path.joinpath('equivalence.json')
+    golden = freeze_references(['transform_district_name'], golden_filepath=golden_filepath)
+    case = next(iter(golden['transform_district_name']))
+    golden['transform_district_name'][case] = 'changed'
+    golden_filepath.write_text(json.dumps(golden))
+
+    assert check_references('transform_district_name', golden_filepath=golden_filepath) == \
+        [f'{case}: the reference output changed']
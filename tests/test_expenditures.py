@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from src.data.expenditures import parse_expenditures, parse_number, read_expenditures
+
+HEADER = ''',,DISTRICT/,,Total,,,
+,,,Instruction,Support,Community,Other,Total
+,COUNTY,BOCES,Services,Services,Services,Expenditures,Expenditures
+,,,,,,,
+'''
+# Two sheets exported into one file, each starting with the multi-row header
+SHEETS = HEADER + '''\
+,ADAMS,MAPLETON 1,,,,,
+$ ,Amount,,"38,592,373","25,709,054","779,878","4,153,285","69,234,590"
+$ ,Per Pupil,"7,193.3 ","5,081","3,385",103,547,"9,115"
+% ,All Funds,,55.7 ,37.1 ,1.1 ,6.0 ,100.0
+,,,,,,,
+,,EAST CENTRAL BOCES,,,,,
+$ ,Amount,,"4,577,721","3,329,919",0,0,"7,907,641"
+,,,,,,,
+% ,All Funds,,57.9 ,42.1 ,0.0 ,0.0 ,100.0
+,,,,,,,
+,DISTRICT/CSI TOTALS,,,,,,
+$ ,Amount,,"38,592,373","25,709,054","779,878","4,153,285","69,234,590"
+$ ,Per Pupil,," 5,081 "," 3,385 ", 103 , 547 ," 9,115 "
+% ,All Funds,,55.7 ,37.1 ,1.1 ,6.0 ,100.0
+''' + HEADER + '''\
+,ADAMS,ADAMS 12 FIVE STAR,,,,,
+$ ,Amount,,"221,051,769","120,585,070","1,335,918","51,372,445","394,345,203"
+$ ,Per Pupil,,"5,347","2,917",32,"1,243","9,538"
+% ,All Funds,,56.1 ,30.6 ,0.3 ,13.0 ,100.0
+,,,,,,,
+,STATE TOTALS,,,,,,
+$ ,Amount,,"4,504,313,607","3,263,032,668","49,439,334","2,228,947,063","10,045,732,673"
+'''
+
+
+@pytest.fixture
+def sheets(tmp_path):
+    filepath = tmp_path.joinpath('expenditures.csv')
+    filepath.write_text(SHEETS, encoding='utf-8')
+    return filepath
+
+
+def test_blocks_of_concatenated_sheets(sheets):
+    records = list(parse_expenditures(sheets, 2012))
+
+    assert [(record.section, record.county, record.district_name) for record in records] == [
+        ('district', 'ADAMS', 'MAPLETON 1'),
+        ('boces', None, 'EAST CENTRAL BOCES'),
+        ('total', 'DISTRICT/CSI TOTALS', 'DISTRICT/CSI TOTALS'),
+        ('district', 'ADAMS', 'ADAMS 12 FIVE STAR'),
+        ('total', 'STATE TOTALS', 'STATE TOTALS')]
+    assert all(record.year == 2012 for record in records)
+
+    mapleton = records[0]
+    assert mapleton.fpc == 7193.3
+    assert mapleton.total['sum'] == 69234590
+    assert mapleton.per_pupil == {'instruction': 5081, 'support': 3385, 'community': 103,
+                                  'other': 547, 'sum': 9115}
+    assert mapleton.share['instruction'] == 55.7
+
+
+def test_boces_block_without_per_pupil_row(sheets):
+    boces = next(record for record in parse_expenditures(sheets) if record.section == 'boces')
+
+    assert boces.total['sum'] == 7907641
+    assert boces.per_pupil == {}
+    assert boces.fpc is None
+    assert boces.share['support'] == 42.1
+
+
+def test_totals_blocks(sheets):
+    totals = list(parse_expenditures(sheets, sections=('total',)))
+
+    assert [record.district_name for record in totals] == ['DISTRICT/CSI TOTALS', 'STATE TOTALS']
+    assert totals[0].per_pupil['sum'] == 9115
+    # The last block of the file is returned when the file ends
+    assert totals[1].total['sum'] == 10045732673
+
+
+def test_read_expenditures_keeps_the_districts(sheets):
+    df = read_expenditures(sheets, 2012)
+
+    assert df['district_name'].tolist() == ['MAPLETON 1', 'ADAMS 12 FIVE STAR']
+    assert df['sum_per_pupil'].tolist() == [9115, 9538]
+    assert df['fpc'].isna().tolist() == [False, True]
+
+
+@pytest.mark.parametrize('cell, number', [('(4)', -4), ('#DIV/0!', None), (' 5,556 ', 5556),
+                                          ('7,193.3 ', 7193.3), ('', None)])
+def test_parse_number(cell, number):
+    assert parse_number(cell) == number
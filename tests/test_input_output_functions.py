@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+
+from src.data.input_output_functions import to_numeric
+
+
+def test_to_numeric_keeps_numbers_in_object_columns():
+    col = pd.Series([1, ' 6,022 ', None, 'n/a', 2.5], dtype=object)
+
+    np.testing.assert_array_equal(to_numeric(col).to_numpy(), [1.0, 6022.0, np.nan, np.nan, 2.5])
+
+
+def test_to_numeric_of_nullable_columns():
+    assert to_numeric(pd.Series([' 5556 ', None], dtype='string')).tolist()[0] == 5556.0
+    assert to_numeric(pd.Series([3, None], dtype='Int64')).dtype == np.float64
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.models.peers import GROWTH, PEER_FEATURES, PeerIndex
+
+K = 5
+
+
+@pytest.fixture(scope='module')
+def all_data():
+    """ Two years of elementary and middle schools, ids 41 to 60 having both levels """
+    rng = np.random.default_rng(0)
+    frames = []
+    for year in (2011, 2012):
+        for emh, ids in (('E', range(1, 61)), ('M', range(41, 101))):
+            n = len(ids)
+            frames.append(pd.DataFrame({'school_id': list(ids), 'year': year, 'emh': emh,
+                                        'pct_fr': rng.uniform(0, 1, n),
+                                        'total': rng.integers(50, 3000, n),
+                                        'child_pov_ratio': rng.uniform(0, 0.5, n),
+                                        GROWTH: rng.uniform(0, 100, n)}))
+    all_data = pd.concat(frames, ignore_index=True)
+    # Text numbers are converted and rows missing a feature are left out
+    all_data['total'] = all_data['total'].astype(object)
+    all_data.loc[0, 'total'] = f" {all_data.loc[0, 'total']:,} "
+    all_data.loc[1, 'pct_fr'] = np.nan
+    return all_data
+
+
+def brute_force(all_data, school_id, year, emh, k, better_growth=False):
+    """ The ids of the k nearest schools of the block by a full scan """
+    schools = all_data.assign(total=pd.to_numeric(all_data['total'].astype(str).str.replace(',', '')))
+    schools = schools.dropna(subset=PEER_FEATURES).reset_index(drop=True)
+    X = schools[PEER_FEATURES].to_numpy(dtype=float)
+    X[:, PEER_FEATURES.index('total')] = np.log1p(X[:, PEER_FEATURES.index('total')])
+    X = (X - X.mean(axis=0)) / X.std(axis=0)
+
+    row = schools.index[(schools['school_id'] == school_id) & (schools['year'] == year)
+                        & (schools['emh'] == emh)][0]
+    candidates = (schools['year'] == year) & (schools['emh'] == emh) & (schools.index != row)
+    if better_growth:
+        candidates &= schools[GROWTH] > schools.loc[row, GROWTH]
+    distances = np.sqrt(((X[candidates.to_numpy()] - X[row]) ** 2).sum(axis=1))
+    return schools.loc[candidates, 'school_id'].to_numpy()[np.argsort(distances)[:k]].tolist()
+
+
+@pytest.mark.parametrize('method, options', [('exact', {}), ('ivf', {'n_lists': 4, 'n_probe': 4})])
+def test_peers_match_brute_force(all_data, method, options):
+    index = PeerIndex(all_data, method=method, **options)
+
+    for school_id, emh in ((5, 'E'), (50, 'E'), (50, 'M'), (99, 'M')):
+        for better_growth in (False, True):
+            peers = index.peers(school_id, 2012, emh, k=K, better_growth=better_growth)
+            assert peers['school_id'].tolist() == brute_force(all_data, school_id, 2012, emh, K, better_growth)
+
+
+def test_peer_groups_match_brute_force(all_data):
+    groups = PeerIndex(all_data).peer_groups(k=K, better_growth=True)
+
+    assert not groups.empty
+    for (school_id, year, emh), group in groups.groupby(['school_id', 'year', 'emh']):
+        assert group.sort_values('rank')['peer_school_id'].tolist() == \
+            brute_force(all_data, school_id, year, emh, K, better_growth=True)
+    # School 2, missing a feature in 2011, is neither queried nor a peer
+    assert 2 not in set(groups.loc[(groups['year'] == 2011) & (groups['emh'] == 'E'), 'school_id'])
+    assert 2 not in set(groups.loc[(groups['year'] == 2011) & (groups['emh'] == 'E'), 'peer_school_id'])
+
+
+def test_emh_is_needed_for_schools_with_several_levels(all_data):
+    index = PeerIndex(all_data)
+
+    with pytest.raises(ValueError, match='give emh'):
+        index.peers(50, 2012)
+    assert len(index.peers(50, 2012, 'M', k=K)) == K
+    # A school with one level in the year does not need it
+    assert len(index.peers(5, 2012, k=K)) == K
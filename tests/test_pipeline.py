@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from pathlib import Path
+import shutil
+import warnings
+
+import pytest
+
+from src.pipeline import main
+
+RAW = Path(__file__).resolve().parents[1].joinpath('data/raw')
+COMBINED = ('districts.csv', 'schools.csv', 'all_data.csv', 'high_school.csv')
+
+
+def run(interim, processed, *stages):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', FutureWarning)
+        main([*stages, '--raw', str(RAW), '--interim', str(interim), '--processed', str(processed)])
+
+
+@pytest.mark.parametrize('dtype_backend', ['numpy_nullable', 'pyarrow'])
+def test_combine_does_not_depend_on_the_stages_run(tmp_path, dtype_backend):
+    full, combined = tmp_path.joinpath('full'), tmp_path.joinpath('combined')
+    run(full, tmp_path.joinpath('processed'), 'census', 'expenditures', 'kaggle', 'combine',
+        '--dtype-backend', dtype_backend)
+    shutil.copytree(full, combined)
+
+    # The combine stage alone reads the datasets made by the full run
+    run(combined, tmp_path.joinpath('processed'), 'combine', '--dtype-backend', dtype_backend)
+
+    for filename in COMBINED:
+        assert full.joinpath(filename).read_bytes() == combined.joinpath(filename).read_bytes(), filename
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+
+from src.models.predict_model import predict_batch
+from src.models.train_model import KEY_COLS
+
+
+class SumModel:
+    """ A model predicting the sum of the features """
+
+    def predict(self, X):
+        return X.sum(axis=1)
+
+
+def test_predictions_keep_emh():
+    batch = pd.DataFrame({'school_id': [10.0, 10.0, 10.0], 'district_id': [880.0, 880.0, 880.0],
+                          'year': [2012, 2012, 2012], 'emh': ['E', 'M', 'H'],
+                          'pct_fr': [' 1,500 ', 0.25, None]}, dtype=object)
+    model_info = {'model': SumModel(), 'features': ['pct_fr'], 'target': 'school_grade'}
+
+    predictions = predict_batch(model_info, batch)
+
+    assert list(predictions.columns) == KEY_COLS + ['predicted_school_grade']
+    assert not predictions.duplicated(KEY_COLS).any()
+    assert predictions['school_id'].dtype == 'Int64'
+    np.testing.assert_array_equal(predictions['predicted_school_grade'], [1500.0, 0.25, np.nan])
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data.programs import ProgramMatrix, build_program_matrix
+
+HEADER = 'Admin Unit,Fund,Location,Program,Object,Amount\n'
+DETAIL_2011 = HEADER + '''\
+0010,10,0001,0010,0100,"1,000"
+0010,10,0002,0010,0200,500
+0010,10,0001,2100,0100,(250)
+0010,10,0001,2100,0200,250
+0880,10,0001,0010,0100,"12,000"
+,10,0001,0010,0100,99
+'''
+DETAIL_2012 = HEADER + '''\
+0010,10,0001,0010,0100,"1,100"
+0880,10,0001,3300,0100,700
+'''
+
+
+@pytest.fixture
+def matrix(tmp_path):
+    filepaths = [tmp_path.joinpath('programs2011.csv'), tmp_path.joinpath('programs2012.csv')]
+    for filepath, detail in zip(filepaths, (DETAIL_2011, DETAIL_2012)):
+        filepath.write_text(detail)
+    return build_program_matrix(filepaths, (2011, 2012))
+
+
+def test_duplicate_entries_are_summed(matrix):
+    assert matrix.keys.values.tolist() == [[10, 2011], [880, 2011], [10, 2012], [880, 2012]]
+    assert matrix.codes == ['0010', '2100', '3300']
+    # The two 0010 rows of district 10 in 2011 are summed, the row without a district is dropped
+    np.testing.assert_array_equal(matrix.matrix.toarray(), [[1500, 0, 0],
+                                                           [12000, 0, 0],
+                                                           [1100, 0, 0],
+                                                           [0, 0, 700]])
+
+
+def test_cancelling_amounts_are_eliminated(matrix):
+    # The (250) and 250 of program 2100 leave no explicit zero
+    assert matrix.matrix.nnz == 4
+    assert matrix.columns(['2100']).matrix.nnz == 0
+
+
+def test_rows_and_columns_of_missing_keys(matrix):
+    assert len(matrix.rows(district_ids=[999])) == 0
+    assert matrix.rows(district_ids=[10], years=[2013]).matrix.shape == (0, 3)
+    assert matrix.rows(years=[2012]).keys['district_id'].tolist() == [10, 880]
+
+    assert matrix.columns(prefix='9').codes == []
+    assert matrix.columns(prefix='33').matrix.toarray().ravel().tolist() == [0, 0, 0, 700]
+    with pytest.raises(KeyError):
+        matrix.columns(['9999'])
+
+
+def test_align_gives_missing_keys_an_empty_row(matrix):
+    keys = pd.DataFrame({'district_id': [880, 999, 10], 'year': [2012, 2012, 2011]})
+
+    np.testing.assert_array_equal(matrix.align(keys).toarray(), [[0, 0, 700], [0, 0, 0], [1500, 0, 0]])
+
+
+def test_save_and_load(matrix, tmp_path):
+    matrix.save(tmp_path.joinpath('programs'))
+    loaded = ProgramMatrix.load(tmp_path.joinpath('programs'))
+
+    assert loaded.codes == matrix.codes
+    pd.testing.assert_frame_equal(loaded.keys, matrix.keys)
+    assert (loaded.matrix != matrix.matrix).nnz == 0
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+import pandas as pd
+
+from src.data.queries import scan
+
+
+def write_tables(interim):
+    pd.DataFrame({'school_id': [1, 2, 3],
+                  'school': ['Adams', 'Baker', 'Clark'],
+                  'district_id': [10, 20, 10]}).to_csv(interim / 'schools.csv', index=False)
+    pd.DataFrame({'district_id': [10, 20],
+                  'district_name': ['DENVER COUNTY 1', 'MAPLETON 1']}).to_csv(interim / 'districts.csv',
+                                                                            index=False)
+
+
+def test_filter_on_joined_column_after_select(tmp_path):
+    write_tables(tmp_path)
+
+    df = (scan(tmp_path, 'schools').select('school')
+          .join(scan(tmp_path, 'districts'), 'district_id')
+          .where(district_name='DENVER COUNTY 1')
+          .collect())
+
+    assert list(df.columns) == ['school']
+    assert df['school'].tolist() == ['Adams', 'Clark']
+
+
+def test_filter_on_joined_column_of_left_join(tmp_path):
+    write_tables(tmp_path)
+
+    df = (scan(tmp_path, 'schools').select('school', 'district_name')
+          .join(scan(tmp_path, 'districts'), 'district_id', how='left')
+          .where(district_name='MAPLETON 1')
+          .collect())
+
+    assert df.to_dict('records') == [{'school': 'Baker', 'district_name': 'MAPLETON 1'}]
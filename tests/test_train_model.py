@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from src.models.train_model import fit_kmeans
+
+
+def test_fit_kmeans_with_fewer_rows_than_clusters():
+    X = np.random.default_rng(0).normal(size=(3, 2)).astype(np.float32)
+
+    with pytest.raises(ValueError, match='k=4 is larger than the 3 rows'):
+        fit_kmeans(X, 4)
+
+
+def test_fit_kmeans_with_small_batches():
+    X = np.random.default_rng(0).normal(size=(50, 2)).astype(np.float32)
+
+    model = fit_kmeans(X, 5, batch_size=2)
+
+    assert model.cluster_centers_.shape == (5, 2)